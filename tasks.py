@@ -183,3 +183,25 @@ def drop_database(ctx):
 
     cursor.close()
     conn.close()
+
+
+@task
+def worker_pool(ctx, workers=None):
+    # Imported here, as the configuration requires the POSTGRES_* variables
+    from uptime_service_validation.coordinator import validator_pool
+
+    validator_pool.main(int(workers) if workers else None)
+
+
+@task
+def benchmark_scoring(ctx, sizes="1000,10000,100000", repeat=5, save=False, tolerance=1.5):
+    # Imported here, as the configuration requires the POSTGRES_* variables
+    from uptime_service_validation.benchmarks import scoring
+
+    if not scoring.run(
+        [int(size) for size in sizes.split(",")],
+        int(repeat),
+        save,
+        float(tolerance),
+    ):
+        raise SystemExit(1)
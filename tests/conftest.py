@@ -0,0 +1,44 @@
+import os
+from pathlib import Path
+
+import psycopg2
+import pytest
+
+# Tests of the SQL run against a real database when TEST_POSTGRES_DSN is set,
+# e.g. "host=localhost dbname=test user=postgres"
+TEST_POSTGRES_DSN = os.environ.get("TEST_POSTGRES_DSN")
+CREATE_TABLES_SQL = (
+    Path(__file__).parents[1] / "uptime_service_validation/database/create_tables.sql"
+)
+
+
+@pytest.fixture
+def connect():
+    """Create the schema of create_tables.sql in a scratch schema and return
+    a function opening connections to it. The schema is dropped afterwards."""
+    if not TEST_POSTGRES_DSN:
+        pytest.skip("TEST_POSTGRES_DSN is not set")
+    schema = f"test_{os.getpid()}"
+    admin = psycopg2.connect(TEST_POSTGRES_DSN)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"SET search_path = {schema}")
+        cursor.execute(CREATE_TABLES_SQL.read_text())
+    connections = []
+
+    def connect(autocommit=True):
+        connection = psycopg2.connect(
+            TEST_POSTGRES_DSN, options=f"-c search_path={schema} -c timezone=UTC"
+        )
+        connection.autocommit = autocommit
+        connections.append(connection)
+        return connection
+
+    yield connect
+    for connection in connections:
+        connection.close()
+    with admin.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+    admin.close()
@@ -1,8 +1,20 @@
-from datetime import datetime
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+import random
+
+from cassandra import ReadTimeout
+
 from uptime_service_validation.coordinator.aws_keyspaces_client import (
+    AdaptiveConcurrencyLimit,
     AWSKeyspacesClient,
+    ExponentialBackOffRetryPolicy,
+    RetryingExecutor,
+    RetryMetrics,
     ShardCalculator,
+    SubmissionQueryPlanner,
 )
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.helper import Batch
 
 
 def test_get_submitted_at_date_list():
@@ -67,3 +79,326 @@ def test_calculate_shards_in_range():
         start_time, end_time
     )
     assert result_cql_statement == expected_cql_statement
+
+
+def test_partitions_in_range_cover_every_second_of_the_range():
+    rng = random.Random(7)
+    for _ in range(50):
+        start = datetime(2023, 11, 6) + timedelta(seconds=rng.randrange(3 * 86400))
+        end = start + timedelta(seconds=rng.randrange(1, 2 * 86400))
+        partitions = ShardCalculator.partitions_in_range(start, end)
+        assert len(partitions) == len(set(partitions))
+        covered = set()
+        current = start
+        while current <= end:
+            covered.add(
+                (
+                    current.strftime("%Y-%m-%d"),
+                    ShardCalculator.calculate_shard(
+                        current.hour, current.minute, current.second
+                    ),
+                )
+            )
+            current += timedelta(seconds=72)
+        covered.add(
+            (
+                end.strftime("%Y-%m-%d"),
+                ShardCalculator.calculate_shard(end.hour, end.minute, end.second),
+            )
+        )
+        assert covered == set(partitions)
+
+
+def test_partition_span_tiles_the_range():
+    start = datetime(2023, 11, 6, 23, 50, tzinfo=timezone.utc)
+    end = start + timedelta(minutes=20)
+    partitions = ShardCalculator.partitions_in_range(start, end)
+    spans = [ShardCalculator.partition_span(*partition) for partition in partitions]
+    assert spans[0][0] <= start < spans[0][1]
+    assert spans[-1][0] <= end < spans[-1][1]
+    assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+    for (date, shard), (span_start, span_end) in zip(partitions, spans):
+        last_second = span_end - timedelta(seconds=1)
+        for time in (span_start, last_second):
+            assert time.strftime("%Y-%m-%d") == date
+            assert ShardCalculator.calculate_shard(
+                time.hour, time.minute, time.second
+            ) == shard
+
+
+def test_aligned_intervals_read_disjoint_partitions():
+    session = FakeSession()
+    planner = SubmissionQueryPlanner(session, "SELECT * FROM submissions")
+    start = datetime(2023, 11, 6, 23, 50, 7)
+    batch = Batch(start, 1, timedelta(minutes=20))
+    intervals = ShardCalculator.align_intervals(list(batch.split(5)))
+    assert intervals[0][0] == batch.start_time
+    assert intervals[-1][1] == batch.end_time
+    assert all(a[1] == b[0] for a, b in zip(intervals, intervals[1:]))
+    assert all(ShardCalculator.on_shard_boundary(end) for _, end in intervals[:-1])
+    # no mini-batch spans two dates
+    assert datetime(2023, 11, 7) in [end for _, end in intervals]
+
+    partitions = [
+        tuple(parameters[:2])
+        for interval in intervals
+        for _, parameters in planner.partition_statements([interval], True, False)
+    ]
+    assert len(partitions) == len(set(partitions))
+    assert set(partitions) == set(
+        ShardCalculator.partitions_in_range(batch.start_time, batch.end_time)
+    )
+
+    # the IN queries of aligned mini-batches do not share shards either
+    shards = [
+        set(parameters[1])
+        for start, end in intervals
+        for _, parameters in [planner.window_statement(start, end, True, False)]
+    ]
+    assert all(not a & b for a, b in zip(shards, shards[1:]))
+    assert planner.window_statement(
+        datetime(2023, 11, 7, 0, 0), datetime(2023, 11, 7, 0, 12), True, False
+    )[1][1] == [0, 1, 2, 3, 4]
+
+    # more mini-batches than shards: some are merged
+    assert len(ShardCalculator.align_intervals(list(batch.split(40)))) <= 10
+
+
+def shards_in_range_by_second(start_time, end_time):
+    shards = set()
+    current_time = start_time
+    while current_time < end_time:
+        shards.add(
+            ShardCalculator.calculate_shard(
+                current_time.hour, current_time.minute, current_time.second
+            )
+        )
+        current_time += timedelta(seconds=1)
+    total_seconds_end = end_time.hour * 3600 + end_time.minute * 60 + end_time.second
+    if total_seconds_end % 144 == 0:
+        shards.add(total_seconds_end // 144)
+    return sorted(shards)
+
+
+def test_shards_in_range_matches_per_second_walk():
+    rng = random.Random(11)
+    durations = [0, 1, 143, 144, 145, 3600, 86399, 86400, 90000]
+    for _ in range(40):
+        start = datetime(2023, 11, 6) + timedelta(
+            seconds=rng.randrange(86400), microseconds=rng.choice([0, 630499])
+        )
+        duration = timedelta(
+            seconds=rng.choice(durations + [rng.randrange(4 * 3600)]),
+            microseconds=rng.choice([0, 1, 500000]),
+        )
+        end = start + duration
+        assert ShardCalculator.shards_in_range(
+            start, end
+        ) == shards_in_range_by_second(start, end), (start, end)
+
+
+class FakePreparedStatement:
+    def __init__(self, query):
+        self.query = query
+
+    def bind(self, parameters):
+        return (self.query, list(parameters))
+
+
+class FakeSession:
+    def __init__(self):
+        self.prepared = []
+
+    def prepare(self, query):
+        self.prepared.append(query)
+        return FakePreparedStatement(query)
+
+
+def test_planner_prepares_each_query_variant_once():
+    session = FakeSession()
+    planner = SubmissionQueryPlanner(session, "SELECT * FROM submissions")
+    start = datetime(2023, 11, 6, 23, 55, 0)
+    end = datetime(2023, 11, 7, 0, 5, 0)
+
+    query, parameters = planner.window_statement(start, end, True, False)
+    assert query.endswith(
+        "submitted_at_date IN ? AND shard IN ? AND submitted_at >= ? AND submitted_at < ?"
+    )
+    assert parameters == [
+        ["2023-11-06", "2023-11-07"],
+        [0, 1, 2, 597, 598, 599],
+        start,
+        end,
+    ]
+    planner.window_statement(start, end, True, False)
+    planner.window_statement(start, end, True, False, limit=10)
+    assert len(session.prepared) == 2
+
+    partitions = list(planner.partition_statements([(start, end)], True, False))
+    assert [parameters[:2] for _, parameters in partitions] == [
+        ["2023-11-06", 597],
+        ["2023-11-06", 598],
+        ["2023-11-06", 599],
+        ["2023-11-07", 0],
+        ["2023-11-07", 1],
+        ["2023-11-07", 2],
+    ]
+    assert len(session.prepared) == 3
+    assert SubmissionQueryPlanner.plan(start, end) is SubmissionQueryPlanner.plan(
+        start, end
+    )
+
+
+class FakeBoundStatement:
+    fetch_size = None
+
+    def __init__(self, parameters):
+        self.parameters = list(parameters)
+
+
+class FakePagingExecutor:
+    "Returns the fetch size of every statement as its only page."
+
+    def execute_async(self, statement):
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def pages(self, statement, result=None):
+        yield [statement.fetch_size]
+
+
+def test_partition_queries_are_paged_by_the_fetch_size(monkeypatch):
+    monkeypatch.setattr(Config, "SUBMISSION_FETCH_SIZE", 1234)
+    session = FakeSession()
+    client = AWSKeyspacesClient.__new__(AWSKeyspacesClient)
+    client._planner = SubmissionQueryPlanner(session, "SELECT * FROM submissions")
+    client.executor = FakePagingExecutor()
+    client.concurrency_limit = None
+    monkeypatch.setattr(
+        FakePreparedStatement,
+        "bind",
+        lambda self, parameters: FakeBoundStatement(parameters),
+    )
+    start = datetime(2023, 11, 6, 23, 59, 0)
+    end = datetime(2023, 11, 7, 0, 1, 0)
+    # one query per partition, either side of midnight
+    assert list(client.stream_partitioned_submissions([(start, end)])) == [
+        [1234]
+    ] * 2
+    assert list(
+        client.stream_partitioned_submissions([(start, end)], fetch_size=10)
+    ) == [[10]] * 2
+
+
+class FakeResponseFuture:
+    _col_names = None
+    _col_types = None
+
+    def __init__(self, outcome, paging_state):
+        self.outcome = outcome
+        self._paging_state = paging_state
+        self.has_more_pages = paging_state is not None
+
+    def add_callbacks(self, callback, errback):
+        if isinstance(self.outcome, Exception):
+            errback(self.outcome)
+        else:
+            callback(self.outcome)
+
+
+class FakeConnection:
+    timers = []
+
+    @classmethod
+    def create_timer(cls, delay, callback):
+        cls.timers.append(delay)
+        callback()
+
+
+class FakeAsyncSession:
+    """Pages are lists of rows; each request fails once with a ReadTimeout
+    before succeeding."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+        self.cluster = type("FakeCluster", (), {"connection_class": FakeConnection})
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+    def execute_async(self, statement, paging_state=None):
+        self.requests.append(paging_state)
+        page = paging_state or 0
+        if self.requests.count(paging_state) == 1:
+            return FakeResponseFuture(ReadTimeout("throttled"), None)
+        next_page = page + 1 if page + 1 < len(self.pages) else None
+        return FakeResponseFuture(self.pages[page], next_page)
+
+
+def test_retrying_executor_retries_every_page_after_backoff():
+    session = FakeAsyncSession([[(1,), (2,)], [(3,)]])
+    metrics = RetryMetrics()
+    executor = RetryingExecutor(
+        session, ExponentialBackOffRetryPolicy(base_delay=0.5), metrics
+    )
+    FakeConnection.timers.clear()
+
+    assert list(executor.pages("statement")) == [[(1,), (2,)], [(3,)]]
+    assert session.requests == [None, None, 1, 1]
+    assert len(FakeConnection.timers) == 2
+    assert all(0.5 <= delay <= 0.55 for delay in FakeConnection.timers)
+    snapshot = metrics.snapshot()
+    assert snapshot["retries"] == 2
+    assert snapshot["retries_by_error"] == {"ReadTimeout": 2}
+    assert snapshot["failures"] == 0
+
+
+def test_retrying_executor_gives_up_after_max_retries():
+    session = FakeAsyncSession([[(1,)]])
+    session.execute_async = lambda statement, paging_state=None: FakeResponseFuture(
+        ReadTimeout("throttled"), None
+    )
+    metrics = RetryMetrics()
+    executor = RetryingExecutor(
+        session, ExponentialBackOffRetryPolicy(base_delay=0, max_retries=3), metrics
+    )
+    future = executor.execute_async("statement")
+    assert isinstance(future.exception(), ReadTimeout)
+    assert metrics.snapshot()["retries"] == 3
+    assert metrics.snapshot()["failures"] == 1
+
+
+def test_adaptive_concurrency_limit_increases_additively_and_decreases_once_per_burst():
+    now = [0.0]
+    limit = AdaptiveConcurrencyLimit(
+        2, 16, latency_target=1.0, throughput_window=10.0, clock=lambda: now[0]
+    )
+    # a round of fast reads adds about one concurrent read
+    for _ in range(3):
+        limit.on_success(sent_at=now[0] - 0.1, rows=10)
+    assert limit.current == 3
+    # slow reads hold the limit
+    limit.on_success(sent_at=now[0] - 2.0, rows=10)
+    assert limit.current == 3
+    while limit.current < 16:
+        limit.on_success(sent_at=now[0], rows=0)
+    limit.on_success(sent_at=now[0], rows=0)
+    assert limit.limit == 16
+
+    now[0] = 5.0
+    limit.on_throttle(sent_at=4.0)
+    assert limit.current == 8
+    # reads sent before the decrease belong to the same burst
+    limit.on_throttle(sent_at=4.5)
+    assert limit.current == 8
+    limit.on_throttle(sent_at=5.0)
+    assert limit.current == 4
+    for _ in range(5):
+        limit.on_throttle(sent_at=now[0])
+    assert limit.current == 2
+
+    assert limit.snapshot() == {"limit": 2, "rows_per_second": 4.0}
+    now[0] = 20.0
+    assert limit.throughput() == 0
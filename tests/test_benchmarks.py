@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from uptime_service_validation.benchmarks import scoring
+from uptime_service_validation.benchmarks.synthetic import (
+    ChainSpec,
+    chain_hash,
+    generate_batch,
+)
+
+
+def test_generate_batch_follows_the_spec():
+    spec = ChainSpec(producers=40, submissions_per_producer=5, fork_rate=0.2)
+    synthetic = generate_batch(spec)
+    df = synthetic.state_hash_df
+
+    assert len(df) == 200
+    assert df["submitter"].nunique() == 40
+    assert df["submitted_at"].is_monotonic_increasing
+    assert df["submitted_at"].min() >= spec.batch_start
+    assert df["submitted_at"].max() < spec.batch_start + spec.interval
+    assert set(df["height"]) == set(
+        range(spec.start_height + 1, spec.start_height + spec.chain_depth + 1)
+    )
+    forks = (~df["state_hash"].str.startswith("3NChain")).mean()
+    assert 0.1 < forks < 0.3
+    assert (df["parent"] == df["height"].map(lambda h: chain_hash(h - 1))).all()
+    assert len(synthetic.p_selected_node_df) == spec.carried_over
+    assert synthetic.p_selected_node_df["state_hash"].iloc[-1] == chain_hash(
+        spec.start_height
+    )
+    # the same spec always yields the same batch
+    assert generate_batch(spec).state_hash_df.equals(df)
+
+
+def test_synthetic_chain_is_scored():
+    spec = scoring.spec_for(500)
+    synthetic = generate_batch(spec)
+    db = scoring.InMemoryDB(synthetic)
+    scoring.process_statehash_df(
+        db, synthetic.batch, synthetic.state_hash_df, timedelta(0)
+    )
+    selected = set(db.statehash_results["state_hash"])
+    chain = {
+        chain_hash(height)
+        for height in range(spec.start_height + 1, spec.start_height + spec.chain_depth + 1)
+    }
+    assert chain <= selected
+    assert len(db.point_records) == len(synthetic.state_hash_df)
+
+
+def test_benchmark_times_every_stage_and_flags_regressions():
+    results = {"200": scoring.benchmark(200, repeat=1)}
+    assert list(results["200"]) == scoring.STAGES
+
+    baselines = {"200": dict(results["200"])}
+    results["200"]["bfs"] = 0.5
+    baselines["200"]["bfs"] = 0.1
+    # too short to be told apart from noise
+    results["200"]["apply_weights"] = 0.0005
+    baselines["200"]["apply_weights"] = 0.0001
+    lines, regressions = scoring.compare(results, baselines, tolerance=2)
+    assert regressions == [("200", "bfs")]
+    assert len(lines) == len(scoring.STAGES) + 1
+
+
+def test_baselines_of_another_environment_are_not_checked(monkeypatch, capsys):
+    slow = {stage: 1.0 for stage in scoring.STAGES}
+    baselines = {"200": {stage: 0.1 for stage in scoring.STAGES}}
+    monkeypatch.setattr(scoring, "benchmark", lambda size, repeat: slow)
+
+    monkeypatch.setattr(
+        scoring, "load_baselines", lambda: (scoring.environment(), baselines)
+    )
+    assert not scoring.run([200], repeat=1)
+
+    elsewhere = {**scoring.environment(), "host": "another-host"}
+    monkeypatch.setattr(scoring, "load_baselines", lambda: (elsewhere, baselines))
+    assert scoring.run([200], repeat=1)
+    output = capsys.readouterr().out
+    assert "recorded in another environment" in output
+    assert "host: another-host (baselines)" in output
+
+
+def test_saved_baselines_record_their_environment(tmp_path):
+    path = tmp_path / "baselines.json"
+    scoring.save_baselines({"200": {"bfs": 0.5}}, path)
+    environment, baselines = scoring.load_baselines(path)
+    assert environment == scoring.environment()
+    assert baselines == {"200": {"bfs": 0.5}}
+    assert scoring.environment_differences(environment) == []
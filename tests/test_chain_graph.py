@@ -0,0 +1,31 @@
+from uptime_service_validation.coordinator.chain_graph import (
+    ChainGraph,
+    UNREACHED_WEIGHT,
+)
+
+
+def test_add_edge_adds_missing_nodes_once():
+    graph = ChainGraph()
+    graph.add_node("state_hash_1")
+    graph.add_edge("state_hash_1", "state_hash_2")
+    graph.add_edge("state_hash_1", "state_hash_2")
+    graph.add_edge("state_hash_0", "state_hash_1")
+
+    assert graph.nodes == ["state_hash_1", "state_hash_2", "state_hash_0"]
+    assert graph.edges == [
+        ("state_hash_1", "state_hash_2"),
+        ("state_hash_0", "state_hash_1"),
+    ]
+    assert graph.weight("state_hash_0") == UNREACHED_WEIGHT
+
+
+def test_bfs_lowers_weights_along_the_chain():
+    graph = ChainGraph()
+    for parent, child in [("a", "b"), ("b", "c"), ("c", "d"), ("x", "d")]:
+        graph.add_edge(parent, child)
+    graph.weights[graph.index["a"]] = 0
+    graph.weights[graph.index["x"]] = 1
+
+    graph.bfs(sources=[graph.index["a"], graph.index["x"]], start=graph.index["a"])
+
+    assert [graph.weight(node) for node in "abcdx"] == [0, 1, 2, 2, 1]
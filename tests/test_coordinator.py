@@ -0,0 +1,179 @@
+from datetime import datetime, timedelta, timezone
+import threading
+
+import pandas as pd
+from uptime_service_validation.coordinator import coordinator
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.coordinator import (
+    State,
+    VerificationPipeline,
+)
+from uptime_service_validation.coordinator.helper import (
+    Batch,
+    SubmissionColumns,
+    Timer,
+)
+
+
+def test_pipeline_verifies_next_batch_ahead_in_order():
+    start = datetime.now(timezone.utc) - timedelta(minutes=45)
+    batch = Batch(start, 1, timedelta(minutes=20))
+    verified = []
+    released = threading.Event()
+
+    def verify(b):
+        verified.append(b.start_time)
+        if len(verified) > 1:
+            released.wait(5)
+        return [(b.start_time, b.end_time)], b.start_time
+
+    pipeline = VerificationPipeline(verify=verify)
+    try:
+        assert pipeline.verified(batch)[1] == batch.start_time
+        # the next batch's window is over, so it is verified right away
+        nxt = batch.next(2)
+        pipeline.prefetch(nxt)
+        pipeline.prefetch(nxt)
+        released.set()
+        assert pipeline.verified(nxt)[1] == nxt.start_time
+        assert verified == [batch.start_time, nxt.start_time]
+        assert pipeline.pending == {}
+    finally:
+        pipeline.close()
+
+
+def test_pipeline_close_cancels_waiting_prefetch():
+    start = datetime.now(timezone.utc)
+    batch = Batch(start, 1, timedelta(minutes=20))
+    pipeline = VerificationPipeline(verify=lambda b: ([], None))
+    pipeline.prefetch(batch)
+    pipeline.close()
+    future = pipeline.pending[(batch.start_time, batch.end_time)]
+    assert future.cancelled() or future.result(1) is None
+
+
+def test_pipeline_verifies_again_a_batch_whose_prefetch_failed():
+    start = datetime.now(timezone.utc) - timedelta(minutes=45)
+    batch = Batch(start, 1, timedelta(minutes=20))
+    calls = []
+
+    def verify(b):
+        calls.append(b.start_time)
+        if len(calls) == 1:
+            raise RuntimeError("validators failed")
+        return [], b.start_time
+
+    pipeline = VerificationPipeline(verify=verify)
+    try:
+        pipeline.prefetch(batch)
+        assert pipeline.verified(batch)[1] == batch.start_time
+        assert calls == [batch.start_time, batch.start_time]
+    finally:
+        pipeline.close()
+
+
+def test_pipeline_retry_does_not_wait_for_next_batch_prefetch():
+    start = datetime.now(timezone.utc) - timedelta(minutes=25)
+    batch = Batch(start, 1, timedelta(minutes=20))
+    verified = []
+
+    def verify(b):
+        verified.append(b.start_time)
+        return [], b.start_time
+
+    pipeline = VerificationPipeline(verify=verify)
+    try:
+        # the next batch's window is not over, its prefetch is waiting
+        pipeline.prefetch(batch.next(2))
+        assert pipeline.verified(batch)[1] == batch.start_time
+        assert verified == [batch.start_time]
+        assert pipeline.prefetched(batch.next(2))
+    finally:
+        pipeline.close()
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self):
+        self.connection = FakeConnection()
+        self.bot_logs = []
+        self.scoreboard_updates = []
+
+    def create_bot_log(self, values):
+        self.bot_logs.append(values)
+        return len(self.bot_logs)
+
+    def update_scoreboard(self, score_till_time, uptime_days):
+        self.scoreboard_updates.append(score_till_time)
+
+
+def test_state_lagging_batches():
+    interval = timedelta(minutes=20)
+    start = datetime.now(timezone.utc) - 5 * interval
+    state = State(Batch(start, 7, interval))
+    batches = state.lagging_batches(10)
+    # the last window is over, but not the delay following it
+    assert [b.start_time for b in batches] == [start + i * interval for i in range(4)]
+    assert batches[0] is state.batch
+    assert len(state.lagging_batches(2)) == 2
+
+
+def test_catch_up_verifies_once_and_updates_scoreboard_once(monkeypatch):
+    interval = timedelta(minutes=20)
+    start = datetime.now(timezone.utc) - 4 * interval
+    state = State(Batch(start, 7, interval))
+    db = FakeDB()
+    verified = []
+
+    def run_validators(time_intervals):
+        verified.append(time_intervals)
+        timer = Timer()
+        with timer.measure():
+            pass
+        return timer
+
+    monkeypatch.setattr(coordinator, "run_validators", run_validators)
+    monkeypatch.setattr(
+        coordinator,
+        "load_submissions",
+        lambda *args, **kwargs: [pd.DataFrame([]), SubmissionColumns()],
+    )
+    coordinator.catch_up(db, state, state.lagging_batches(10), cassandra=None)
+
+    assert len(verified) == 1
+    assert verified[0][0][0] == start
+    assert verified[0][-1][1] == start + 3 * interval
+    assert len(verified[0]) == Config.CATCHUP_JOB_NUMBER
+    assert [values[2] for values in db.bot_logs] == [
+        (start + i * interval).timestamp() for i in range(3)
+    ]
+    assert db.scoreboard_updates == [start + 3 * interval]
+    assert state.batch.start_time == start + 3 * interval
+    # bot logs are chained in order
+    assert state.batch.bot_log_id == 3
+
+
+def test_verify_batch_apart_ends_its_read_transaction(monkeypatch):
+    class VerificationDB:
+        rolled_back = False
+
+        def rollback(self):
+            self.rolled_back = True
+
+    db = VerificationDB()
+    monkeypatch.setattr(
+        coordinator, "verify_batch", lambda batch, db, cassandra: ([], None)
+    )
+    start = datetime.now(timezone.utc)
+    coordinator.verify_batch_apart(Batch(start, 1, timedelta(minutes=20)), db)
+    assert db.rolled_back
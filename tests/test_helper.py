@@ -1,14 +1,26 @@
 from datetime import datetime, timedelta
 from uptime_service_validation.coordinator.aws_keyspaces_client import Submission
 import pandas as pd
+from uptime_service_validation.coordinator.config import Config
 from uptime_service_validation.coordinator.helper import (
     Batch,
+    DB,
+    NodeRegistry,
+    StatehashRegistry,
+    SubmissionColumns,
+    SUBMISSION_FIELDS,
+    rows_to_csv,
     filter_state_hash_percentage,
     create_graph,
     apply_weights,
     bfs,
+    get_relations,
+    select_batch_state_hashes,
 )
 import calendar
+from contextlib import contextmanager
+import logging
+import random
 
 
 def test_get_time_batches():
@@ -165,6 +177,38 @@ def test_array_dataframe():
     )
 
 
+def test_submission_columns_dataframe_matches_submission_objects():
+    rows = []
+    for i in range(7):
+        row = dict.fromkeys(SUBMISSION_FIELDS, None)
+        row.update(
+            submitted_at=datetime(2023, 11, 6, 15, 35, i),
+            submitter=f"submitter_{i % 3}",
+            state_hash=f"state_hash_{i}",
+            height=i,
+            validation_error=[None, "", "error"][i % 3],
+            verified=i != 4,
+        )
+        rows.append(tuple(row[field] for field in SUBMISSION_FIELDS))
+
+    submissions = SubmissionColumns()
+    submissions.extend(rows[:4])
+    submissions.extend([])
+    submissions.extend(rows[4:])
+
+    verified = [
+        Submission(**dict(zip(SUBMISSION_FIELDS, row)))
+        for row in rows
+        if row[-1] and not row[-2]
+    ]
+    expected = pd.DataFrame(verified).drop(columns=["snark_work"])
+    assert len(submissions) == 7
+    pd.testing.assert_frame_equal(
+        submissions.to_dataframe(submissions.verified_mask()), expected
+    )
+    assert list(submissions.rows(["submitter", "height"]))[5] == ("submitter_2", 5)
+
+
 def test_filter_state_hash_single():
     master_state_hash = pd.DataFrame(
         [["state_hash_1", "block_producer_key_1"]],
@@ -187,6 +231,36 @@ def test_filter_state_hash_multi():
     assert output == ["state_hash_1"]
 
 
+def test_filter_state_hash_matches_per_statehash_scan():
+    rng = random.Random(42)
+    rows = [
+        [f"state_hash_{rng.randint(0, 40)}", f"block_producer_key_{rng.randint(0, 60)}"]
+        for _ in range(500)
+    ]
+    master_state_hash = pd.DataFrame(rows, columns=["state_hash", "block_producer_key"])
+
+    # the original implementation, filtering the whole frame once per statehash
+    state_hash_list = (
+        master_state_hash["state_hash"]
+        .value_counts()
+        .sort_values(ascending=False)
+        .index.to_list()
+    )
+    threshold = round(master_state_hash["block_producer_key"].nunique() * 0.1, 2)
+    expected = [
+        s
+        for s in state_hash_list
+        if master_state_hash[master_state_hash["state_hash"] == s][
+            "block_producer_key"
+        ].nunique()
+        >= threshold
+    ]
+
+    output = filter_state_hash_percentage(master_state_hash, p=0.1)
+    assert output == expected
+    assert 0 < len(output) < len(state_hash_list)
+
+
 # The create_graph function creates a graph and adds all the state_hashes that appear in the batch as nodes, as well as the hashes from the previous batch.
 # It also adds edges between any child and parent hash (this is even for parent-child relationship between batches)
 # The arguments are:
@@ -274,7 +348,7 @@ def test_apply_weights_sum_weights_empty_parents_and_empty_selected_node():
     )
     assert len(list(weighted_graph.nodes)) == 5
     for node in list(weighted_graph.nodes):
-        assert weighted_graph.nodes[node]["weight"] == 9999
+        assert weighted_graph.weight(node) == 9999
 
 
 def test_apply_weights_sum_weights_nested():
@@ -297,15 +371,15 @@ def test_apply_weights_sum_weights_nested():
     assert len(list(weighted_graph.nodes)) == 5
     for node in list(weighted_graph.nodes):
         if node == "state_hash_1":
-            assert weighted_graph.nodes[node]["weight"] == 0
+            assert weighted_graph.weight(node) == 0
         if node == "state_hash_2":
-            assert weighted_graph.nodes[node]["weight"] == 0
+            assert weighted_graph.weight(node) == 0
         if node == "state_hash_3":
-            assert weighted_graph.nodes[node]["weight"] == 9999
+            assert weighted_graph.weight(node) == 9999
         if node == "parent_state_hash_1":
-            assert weighted_graph.nodes[node]["weight"] == 123
+            assert weighted_graph.weight(node) == 123
         if node == "parent_state_hash_2":
-            assert weighted_graph.nodes[node]["weight"] == 345
+            assert weighted_graph.weight(node) == 345
 
 
 # The bfs is what computes the weight for nodes that aren't previous hashes or above the 34% threshold (which automatically have weight 0).
@@ -402,3 +476,264 @@ def test_blockchain_epoch():
         [1640081730000, 1640945730000], columns=["blockchain_epoch"]
     )
     pd.testing.assert_frame_equal(state_hash_df[["blockchain_epoch"]], expected)
+
+
+class FakeRegistryDB:
+    def __init__(self, statehashes=None, nodes=None):
+        self.tables = {"statehash": dict(statehashes or {}), "nodes": dict(nodes or {})}
+        self.loads = 0
+        self.inserted = []
+
+    def _load(self, table):
+        self.loads += 1
+        return dict(self.tables[table])
+
+    def _insert(self, table, keys):
+        self.inserted.append(keys)
+        rows = self.tables[table]
+        for key in keys:
+            rows.setdefault(key, len(rows) + 1)
+        return {key: rows[key] for key in keys}
+
+    def get_statehash_ids(self):
+        return self._load("statehash")
+
+    def insert_statehashes(self, values):
+        return self._insert("statehash", values)
+
+    def get_node_ids(self):
+        return self._load("nodes")
+
+    def insert_nodes(self, block_producer_keys, updated_at):
+        return self._insert("nodes", block_producer_keys)
+
+
+def test_statehash_registry_loads_once_and_inserts_only_new_values():
+    db = FakeRegistryDB(statehashes={"state_hash_1": 1, "state_hash_2": 2})
+    registry = StatehashRegistry(db)
+
+    ids = registry.ids_for(["state_hash_1", "state_hash_3", "state_hash_1", None])
+    assert ids == {"state_hash_1": 1, "state_hash_3": 3}
+    ids = registry.ids_for(["state_hash_2", "state_hash_3"])
+    assert ids == {"state_hash_2": 2, "state_hash_3": 3}
+
+    assert db.loads == 1
+    assert db.inserted == [["state_hash_3"]]
+    assert len(registry) == 3
+
+
+def test_statehash_registry_reloads_after_invalidate():
+    db = FakeRegistryDB(statehashes={"state_hash_1": 1})
+    registry = StatehashRegistry(db)
+    registry.ids_for(["state_hash_1"])
+    registry.invalidate()
+    assert len(registry) == 0
+    assert registry.ids_for(["state_hash_1"]) == {"state_hash_1": 1}
+    assert db.loads == 2
+
+
+def test_node_registry_inserts_only_new_block_producers():
+    db = FakeRegistryDB(nodes={"block_producer_key_1": 7})
+    registry = NodeRegistry(db)
+
+    ids = registry.ids_for(["block_producer_key_2", "block_producer_key_1"])
+    assert ids == {"block_producer_key_1": 7, "block_producer_key_2": 2}
+    assert db.inserted == [["block_producer_key_2"]]
+
+
+class FakeConnection:
+    def __init__(self, name):
+        self.name = name
+        self.closed = 0
+
+
+class FakePool:
+    def __init__(self):
+        self.given = 0
+        self.discarded = []
+
+    def getconn(self):
+        self.given += 1
+        return FakeConnection(f"connection_{self.given}")
+
+    def putconn(self, connection, close=False):
+        self.discarded.append((connection.name, close))
+
+
+def test_db_replaces_lost_connection_from_pool():
+    pool = FakePool()
+    db = DB(pool.getconn(), logging, pool=pool)
+    db.statehashes.ids = {"state_hash_1": 1}
+
+    assert db.connection.name == "connection_1"
+    db.connection.closed = 2
+    assert db.connection.name == "connection_2"
+    assert pool.discarded == [("connection_1", True)]
+    # ids cached from the lost session may not have been committed
+    assert db.statehashes.ids is None
+    with db.read_connection() as connection:
+        assert connection.name == "connection_2"
+
+
+class FakeLsnCursor:
+    "Answers the WAL position queries of read_connection."
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, parameters=None):
+        self.connection.queries += 1
+
+    def fetchone(self):
+        return (self.connection.answer,)
+
+
+class FakeLsnConnection(FakeConnection):
+    def __init__(self, name, answer):
+        super().__init__(name)
+        self.answer = answer
+        self.queries = 0
+
+    def cursor(self):
+        return FakeLsnCursor(self)
+
+
+class FakeReadPool:
+    def __init__(self, replica):
+        self.replica = replica
+
+    @contextmanager
+    def connection(self):
+        yield self.replica
+
+
+def test_read_connection_uses_replica_once_it_has_replayed_the_primary():
+    replica = FakeLsnConnection("replica", True)
+    db = DB(
+        FakeLsnConnection("primary", "0/16B3748"),
+        logging,
+        read_pool=FakeReadPool(replica),
+    )
+    with db.read_connection() as connection:
+        assert connection.name == "replica"
+
+
+def test_read_connection_falls_back_to_primary_on_replica_lag(monkeypatch, caplog):
+    monkeypatch.setattr(Config, "POSTGRES_REPLICA_WAIT_SECONDS", 0.25)
+    replica = FakeLsnConnection("replica", False)
+    db = DB(
+        FakeLsnConnection("primary", "0/16B3748"),
+        logging,
+        read_pool=FakeReadPool(replica),
+    )
+    with db.read_connection() as connection:
+        assert connection.name == "primary"
+    # the replica is polled until the wait times out
+    assert replica.queries > 1
+    assert "has not replayed 0/16B3748" in caplog.text
+
+
+def test_rows_to_csv_tells_nulls_from_empty_strings():
+    rows = [
+        ("state_hash_1", None, "", 1, True),
+        ('quoted "hash", with comma', float("nan"), "error", 2, False),
+    ]
+    assert rows_to_csv(rows).read() == (
+        "state_hash_1,\\N,,1,True\n"
+        '"quoted ""hash"", with comma",\\N,error,2,False\n'
+    )
+
+
+def make_forky_batch(seed, length=60):
+    "Generate a batch of submissions on a chain with frequent forks."
+    rng = random.Random(seed)
+    tips = [f"previous_state_hash_{i}" for i in range(3)]
+    rows = []
+    for i in range(length):
+        parent = rng.choice(tips[-5:])
+        state_hash = f"state_hash_{seed}_{i}"
+        tips.append(state_hash)
+        for _ in range(rng.randint(1, 4)):
+            rows.append([state_hash, parent, f"block_producer_key_{rng.randint(0, 20)}"])
+    return pd.DataFrame(
+        rows, columns=["state_hash", "parent_state_hash", "block_producer_key"]
+    )
+
+
+def test_select_batch_state_hashes_matches_row_by_row_lookup():
+    for seed in range(5):
+        batch_df = make_forky_batch(seed)
+        shortlist = pd.DataFrame(
+            {
+                "state_hash": ["previous_state_hash_1"]
+                + list(batch_df["state_hash"].unique()[::3]),
+            }
+        )
+        shortlist["weight"] = range(len(shortlist))
+
+        # the original implementation, dropping rows and looking parents up one by one
+        expected = shortlist.copy()
+        batch_state_hash = list(batch_df["state_hash"].unique())
+        for index, row in expected.iterrows():
+            if not row["state_hash"] in batch_state_hash:
+                expected.drop(index, inplace=True, axis=0)
+        expected["parent_state_hash"] = [
+            batch_df[batch_df["state_hash"] == s]["parent_state_hash"].values[0]
+            for s in expected["state_hash"].values
+        ]
+
+        output = select_batch_state_hashes(batch_df, shortlist)
+        pd.testing.assert_frame_equal(output, expected)
+
+        expected_relations = [
+            (parent, child)
+            for child, parent in output[["state_hash", "parent_state_hash"]].values
+            if parent in output["state_hash"].values
+        ]
+        assert list(get_relations(output)) == expected_relations
+
+
+def test_next_batch_follows_the_bot_log_of_the_batch():
+    start = datetime(2024, 6, 1)
+    batch = Batch(start, 1, timedelta(minutes=20))
+    nxt = batch.next(5)
+    assert nxt.start_time == batch.end_time
+    assert nxt.interval == batch.interval
+    # the next batch looks up the statehashes selected under this bot log
+    assert nxt.bot_log_id == 5
+
+
+def test_batch_split_balanced():
+    start = datetime(2024, 1, 1, 0, 0)
+    batch = Batch(start, 1, timedelta(minutes=20))
+    minute = timedelta(minutes=1)
+
+    def bucket(i):
+        return (start + minute * i, start + minute * (i + 1))
+
+    # a burst in the 3rd minute, a few submissions elsewhere
+    histogram = [(bucket(i), 0) for i in range(20)]
+    histogram[2] = (bucket(2), 300)
+    histogram[10] = (bucket(10), 50)
+    histogram[15] = (bucket(15), 50)
+    parts = batch.split_balanced(histogram, 100, 10)
+    assert len(parts) == 4
+    assert parts[0][0] == batch.start_time
+    assert parts[-1][1] == batch.end_time
+    assert all(a[1] == b[0] for a, b in zip(parts, parts[1:]))
+    # the burst is spread over three mini-batches
+    assert parts[0][1] == start + minute * 2 + minute / 3
+    assert parts[1][1] == start + minute * 2 + minute * 2 / 3
+    assert parts[2][1] == start + minute * 3
+
+    assert len(batch.split_balanced(histogram, 10, 5)) == 5
+    assert batch.split_balanced([(bucket(0), 0)], 100, 5) == []
+    assert batch.split_balanced(histogram, 10_000, 5) == [
+        (batch.start_time, batch.end_time)
+    ]
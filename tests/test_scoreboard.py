@@ -0,0 +1,253 @@
+from datetime import datetime, timedelta, timezone
+import logging
+import random
+
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.helper import (
+    DB,
+    SCORES_CTE,
+    SEED_SCORE_WINDOW_SQL,
+    SLIDE_SCORE_WINDOW_SQL,
+    UPDATE_SCORES_FROM_WINDOW_SQL,
+)
+
+START = datetime(2024, 6, 1, tzinfo=timezone.utc)
+BATCH = timedelta(hours=1)
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    def execute(self, query, parameters=None):
+        self.statements.append((query, parameters))
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self, rows=()):
+        self.cursor_ = FakeCursor(list(rows))
+
+    def cursor(self):
+        return self.cursor_
+
+
+def queries(connection):
+    return [query for query, _ in connection.cursor_.statements]
+
+
+def test_full_mode_computes_scores_from_scratch():
+    connection = FakeConnection()
+    DB(connection, logging).update_scoreboard(START, 1, mode=Config.SCOREBOARD_FULL)
+    statements = queries(connection)
+    assert statements[0].startswith(SCORES_CTE)
+    assert SEED_SCORE_WINDOW_SQL not in statements
+    assert SLIDE_SCORE_WINDOW_SQL not in statements
+
+
+def test_incremental_mode_seeds_the_window_on_first_update():
+    connection = FakeConnection([(86400.0, 0.0), None])
+    DB(connection, logging).update_scoreboard(
+        START, 1, mode=Config.SCOREBOARD_INCREMENTAL
+    )
+    statements = connection.cursor_.statements
+    assert (SEED_SCORE_WINDOW_SQL, {"start_epoch": 0.0, "end_epoch": 86400.0}) in (
+        statements
+    )
+    assert UPDATE_SCORES_FROM_WINDOW_SQL in queries(connection)
+
+
+def test_incremental_mode_slides_the_previous_window():
+    connection = FakeConnection([(90000.0, 3600.0), (0.0, 86400.0)])
+    DB(connection, logging).update_scoreboard(
+        START, 1, mode=Config.SCOREBOARD_INCREMENTAL
+    )
+    assert (
+        SLIDE_SCORE_WINDOW_SQL,
+        {
+            "start_epoch": 3600.0,
+            "end_epoch": 90000.0,
+            "previous_start_epoch": 0.0,
+            "previous_end_epoch": 86400.0,
+        },
+    ) in connection.cursor_.statements
+    assert SEED_SCORE_WINDOW_SQL not in queries(connection)
+
+
+def populate(connection, batches=60, nodes=8, seed=0):
+    """Insert hourly batches from START in which every node scores a point
+    with its own probability; a few batches failed (files_processed = -1)."""
+    rng = random.Random(seed)
+    with connection.cursor() as cursor:
+        node_ids = []
+        for index in range(nodes):
+            cursor.execute(
+                "INSERT INTO nodes (block_producer_key) VALUES (%s) RETURNING id",
+                (f"node-{index}",),
+            )
+            node_ids.append(cursor.fetchone()[0])
+        for index in range(batches):
+            start = START + index * BATCH
+            cursor.execute(
+                """INSERT INTO bot_logs (files_processed, batch_start_epoch, batch_end_epoch)
+                   VALUES (%s, %s, %s) RETURNING id""",
+                (
+                    -1 if index % 17 == 5 else 10,
+                    start.timestamp(),
+                    (start + BATCH).timestamp(),
+                ),
+            )
+            (bot_log_id,) = cursor.fetchone()
+            for rank, node_id in enumerate(node_ids):
+                if rng.random() < (rank + 1) / nodes:
+                    # points_summary is filled by the trigger on points
+                    cursor.execute(
+                        "INSERT INTO points (node_id, bot_log_id) VALUES (%s, %s)",
+                        (node_id, bot_log_id),
+                    )
+
+
+def scores(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id, score, score_percent FROM nodes ORDER BY id")
+        return cursor.fetchall()
+
+
+def reset_scores(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE nodes SET score = NULL, score_percent = NULL")
+
+
+def test_incremental_scores_match_full_scores_over_a_sliding_window(connect):
+    connection = connect()
+    populate(connection)
+    db = DB(connection, logging)
+    # steps shorter than the window, and one longer than it
+    score_till_time = START + 20 * BATCH
+    for step in [0, 1, 1, 3, 7, 30, 2]:
+        score_till_time += step * BATCH
+        reset_scores(connection)
+        db.update_scoreboard(score_till_time, 1, mode=Config.SCOREBOARD_INCREMENTAL)
+        incremental = scores(connection)
+        reset_scores(connection)
+        db.update_scoreboard(score_till_time, 1, mode=Config.SCOREBOARD_FULL)
+        assert incremental == scores(connection)
+        assert any(score is not None for _, score, _ in incremental)
+
+
+def test_verify_mode_rebuilds_a_corrupted_window(connect, caplog):
+    connection = connect()
+    populate(connection)
+    db = DB(connection, logging)
+    db.update_scoreboard(START + 30 * BATCH, 1, mode=Config.SCOREBOARD_INCREMENTAL)
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE node_window_points SET points = points + 1")
+    db.update_scoreboard(START + 31 * BATCH, 1, mode=Config.SCOREBOARD_VERIFY)
+    assert "Incremental scores differ" in caplog.text
+    verified = scores(connection)
+
+    reset_scores(connection)
+    db.update_scoreboard(START + 31 * BATCH, 1, mode=Config.SCOREBOARD_FULL)
+    assert verified == scores(connection)
+
+
+def insert_scored_nodes(connection, scores_by_key):
+    with connection.cursor() as cursor:
+        for key, score in scores_by_key.items():
+            cursor.execute(
+                """INSERT INTO nodes (block_producer_key, score, score_percent)
+                   VALUES (%s, %s, %s)""",
+                (key, score, score),
+            )
+
+
+def history(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """SELECT n.block_producer_key, h.score_at, h.score
+               FROM score_history h JOIN nodes n ON n.id = h.node_id
+               ORDER BY 1, 2"""
+        )
+        return cursor.fetchall()
+
+
+def test_changes_mode_records_changed_scores_only(connect, monkeypatch):
+    monkeypatch.setattr(Config, "SCORE_HISTORY_MODE", Config.SCORE_HISTORY_CHANGES)
+    connection = connect()
+    insert_scored_nodes(connection, {"a": 10, "b": 20})
+    db = DB(connection, logging)
+    db.update_scoreboard(START, 1, mode=Config.SCOREBOARD_FULL)
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE nodes SET score = 11 WHERE block_producer_key = 'a'")
+    db.update_scoreboard(START + BATCH, 1, mode=Config.SCOREBOARD_FULL)
+    db.update_scoreboard(START + 2 * BATCH, 1, mode=Config.SCOREBOARD_FULL)
+
+    naive = START.replace(tzinfo=None)
+    assert history(connection) == [
+        ("a", naive, 10),
+        ("a", naive + BATCH, 11),
+        ("b", naive, 20),
+    ]
+
+
+def test_downsampling_keeps_the_last_score_of_old_periods(connect):
+    connection = connect()
+    insert_scored_nodes(connection, {"a": None})
+    recent = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    recent -= timedelta(hours=2)
+    old = datetime(2024, 6, 1)
+    score_at = [old + i * timedelta(hours=6) for i in range(8)] + [
+        recent,
+        recent + timedelta(minutes=1),
+    ]
+    with connection.cursor() as cursor:
+        for score, at in enumerate(score_at):
+            cursor.execute(
+                """INSERT INTO score_history (node_id, score_at, score)
+                   SELECT id, %s, %s FROM nodes""",
+                (at, score),
+            )
+        cursor.execute("SELECT downsample_score_history(30, 'day')")
+
+    assert [(at, score) for _, at, score in history(connection)] == [
+        (old + timedelta(hours=18), 3),
+        (old + timedelta(hours=42), 7),
+        (recent, 8),
+        (recent + timedelta(minutes=1), 9),
+    ]
+
+
+def test_score_history_steps_carries_the_latest_score_forward(connect):
+    connection = connect()
+    insert_scored_nodes(connection, {"a": None})
+    day = timedelta(days=1)
+    old = datetime(2024, 6, 1)
+    with connection.cursor() as cursor:
+        for at, score in [(old, 1), (old + 2 * day + BATCH, 2)]:
+            cursor.execute(
+                """INSERT INTO score_history (node_id, score_at, score)
+                   SELECT id, %s, %s FROM nodes""",
+                (at, score),
+            )
+        cursor.execute(
+            "SELECT score_at, score FROM score_history_steps(%s, %s, '1 day')"
+            " ORDER BY score_at",
+            (old - day, old + 4 * day),
+        )
+        steps = cursor.fetchall()
+    # nothing is known before the first entry
+    assert steps == [
+        (old, 1),
+        (old + day, 1),
+        (old + 2 * day, 1),
+        (old + 3 * day, 2),
+        (old + 4 * day, 2),
+    ]
@@ -1,6 +1,14 @@
+from datetime import datetime, timedelta
+import io
 import logging
 import os
 import sys
+from types import SimpleNamespace
+
+from kubernetes.client.rest import ApiException
+import pytest
+
+from uptime_service_validation.coordinator import server
 from uptime_service_validation.coordinator.server import try_get_hostname_ip
 from uptime_service_validation.coordinator.config import bool_env_var_set
 
@@ -29,3 +37,236 @@ def test_bool_env_var_set():
     assert bool_env_var_set("TEST_VAR") == False
 
     assert bool_env_var_set("TEST_VAR_THAT_IS_NOT_SET") == False
+
+
+def fake_job(name, succeeded=None, failed=None, resource_version="1"):
+    return SimpleNamespace(
+        metadata=SimpleNamespace(name=name, resource_version=resource_version),
+        spec=SimpleNamespace(completions=1),
+        status=SimpleNamespace(
+            succeeded=succeeded, failed=failed, failed_indexes=None, conditions=None
+        ),
+    )
+
+
+class FakeBatchApi:
+    def __init__(self, listed, statuses=None):
+        self.listed = listed
+        self.statuses = statuses or {}
+        self.list_calls = 0
+        self.status_reads = []
+
+    def list_namespaced_job(self, namespace, label_selector=None, **kwargs):
+        self.list_calls += 1
+        return SimpleNamespace(
+            items=self.listed, metadata=SimpleNamespace(resource_version="1")
+        )
+
+    def read_namespaced_job_status(self, name, namespace):
+        self.status_reads.append(name)
+        return self.statuses[name]
+
+
+class FakeWatch:
+    # each stream() call plays the next list of events, or raises an exception
+    streams = []
+    calls = []
+
+    def stream(self, func, namespace, **kwargs):
+        FakeWatch.calls.append(kwargs)
+        events = FakeWatch.streams.pop(0)
+        if isinstance(events, Exception):
+            raise events
+        yield from events
+
+    def stop(self):
+        pass
+
+
+def test_wait_for_jobs_watches_the_job_group(monkeypatch):
+    monkeypatch.setattr(server.watch, "Watch", FakeWatch)
+    FakeWatch.calls = []
+    FakeWatch.streams = [
+        [
+            {"type": "MODIFIED", "object": fake_job("group-1", failed=1)},
+            {"type": "MODIFIED", "object": fake_job("other", succeeded=1)},
+        ],
+        # the resource version expired, the jobs are listed again
+        ApiException(status=410),
+        [{"type": "MODIFIED", "object": fake_job("group-1", succeeded=1)}],
+    ]
+    api = FakeBatchApi([fake_job("group-0", succeeded=1), fake_job("group-1")])
+    server.wait_for_jobs(api, "ns", ["group-0", "group-1"], "group", logging)
+
+    assert api.list_calls == 2
+    assert FakeWatch.calls[0]["label_selector"] == "job-group-name=group"
+    assert FakeWatch.calls[0]["resource_version"] == "1"
+    assert FakeWatch.streams == []
+    assert api.status_reads == []
+
+
+def test_wait_for_jobs_polls_when_watching_fails(monkeypatch):
+    monkeypatch.setattr(server.watch, "Watch", FakeWatch)
+    monkeypatch.setattr(server, "JOB_POLL_INTERVAL_SECONDS", 0)
+    FakeWatch.calls = []
+    FakeWatch.streams = [ConnectionError("watch failed")]
+    api = FakeBatchApi(
+        [fake_job("group-0")], statuses={"group-0": fake_job("group-0", succeeded=1)}
+    )
+    server.wait_for_jobs(api, "ns", ["group-0"], "group", logging)
+    assert api.status_reads == ["group-0"]
+
+
+def test_validator_job_template_builds_one_indexed_job_per_batch(monkeypatch):
+    monkeypatch.setattr(server.config, "load_incluster_config", lambda: None)
+    monkeypatch.setattr(
+        server, "open", lambda path: io.StringIO("validators\n"), raising=False
+    )
+    monkeypatch.setenv("WORKER_TTL_SECONDS_AFTER_FINISHED", "60")
+    monkeypatch.setenv("AUTH_VOLUME_MOUNT_PATH", "/auth")
+    for resource in ("CPU_REQUEST", "MEMORY_REQUEST", "CPU_LIMIT", "MEMORY_LIMIT"):
+        monkeypatch.setenv(f"WORKER_{resource}", "1")
+    template = server.ValidatorJobTemplate("verifier", "1.0")
+    assert template.namespace == "validators"
+
+    start = datetime(2024, 6, 1, 23, 50)
+    intervals = [
+        (start, start + timedelta(minutes=4)),
+        (start + timedelta(minutes=4), start + timedelta(minutes=20)),
+    ]
+    job = template.job("delegation-verify-24-06-02-00-12", intervals, "10.0.0.1")
+    spec = job["spec"]
+    assert spec["completionMode"] == "Indexed"
+    assert spec["completions"] == spec["parallelism"] == 2
+    labels = {"job-group-name": "delegation-verify-24-06-02-00-12"}
+    assert job["metadata"]["labels"] == spec["template"]["metadata"]["labels"] == labels
+    pod_spec = spec["template"]["spec"]
+    assert pod_spec["topologySpreadConstraints"][0]["labelSelector"] == {
+        "matchLabels": labels
+    }
+    env = {var["name"]: var.get("value") for var in pod_spec["containers"][0]["env"]}
+    assert env["CASSANDRA_HOST"] == "10.0.0.1"
+    assert env["MINI_BATCH_STARTS"] == (
+        "2024-06-01 23:50:00.0+0000,2024-06-01 23:54:00.0+0000"
+    )
+    assert env["MINI_BATCH_ENDS"] == (
+        "2024-06-01 23:54:00.0+0000,2024-06-02 00:10:00.0+0000"
+    )
+    # the template itself is left untouched
+    template_env = template.pod_spec["containers"][0]["env"]
+    assert "MINI_BATCH_STARTS" not in {var["name"] for var in template_env}
+    assert "labelSelector" not in template.pod_spec["topologySpreadConstraints"][0]
+
+
+class FakeJobTemplate:
+    namespace = "validators"
+
+    def __init__(self, conflict=False):
+        self.api_batch = self
+        self.conflict = conflict
+        self.created = []
+
+    def job(self, job_name, time_intervals, cassandra_ip):
+        return {"metadata": {"name": job_name}}
+
+    def create_namespaced_job(self, namespace, job):
+        if self.conflict:
+            raise ApiException(status=409, reason="AlreadyExists")
+        self.created.append(job["metadata"]["name"])
+
+
+def test_validator_pods_of_retried_batches_get_their_own_job(monkeypatch):
+    template = FakeJobTemplate()
+    monkeypatch.setattr(server, "validator_job_template", lambda *args: template)
+    monkeypatch.setattr(server, "try_get_hostname_ip", lambda host, logging: host)
+    monkeypatch.setattr(server, "wait_for_jobs", lambda *args: None)
+    start = datetime(2024, 6, 1)
+    intervals = [(start, start + timedelta(minutes=20))]
+    server.setUpValidatorPods(intervals, logging, "verifier", "1.0")
+    server.setUpValidatorPods(intervals, logging, "verifier", "1.0")
+
+    first, second = template.created
+    assert first != second
+    # job names are DNS labels
+    assert len(first) <= 63
+
+
+def test_validator_pods_fail_when_the_job_is_not_created(monkeypatch):
+    template = FakeJobTemplate(conflict=True)
+    monkeypatch.setattr(server, "validator_job_template", lambda *args: template)
+    monkeypatch.setattr(server, "try_get_hostname_ip", lambda host, logging: host)
+    monkeypatch.setattr(
+        server, "wait_for_jobs", lambda *args: pytest.fail("no job to wait for")
+    )
+    start = datetime(2024, 6, 1)
+    with pytest.raises(ApiException):
+        server.setUpValidatorPods(
+            [(start, start + timedelta(minutes=20))], logging, "verifier", "1.0"
+        )
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.records = []
+
+    def info(self, message):
+        self.records.append(("info", message))
+
+    def error(self, message):
+        self.records.append(("error", message))
+
+
+def test_run_processes_streams_output_and_caps_concurrency(tmp_path):
+    # every process writes more than a pipe buffer to both pipes, and records
+    # how many processes run at the same time
+    script = (
+        "import os, sys, time\n"
+        f"running = os.path.join({str(tmp_path)!r}, str(os.getpid()))\n"
+        "open(running, 'w').close()\n"
+        f"print(len(os.listdir({str(tmp_path)!r})), file=sys.stderr)\n"
+        "for i in range(5000):\n"
+        "    print('x' * 40)\n"
+        "    print('y' * 40, file=sys.stderr)\n"
+        "time.sleep(0.1)\n"
+        "os.remove(running)\n"
+        "sys.exit(int(sys.argv[1]))\n"
+    )
+    processes = [
+        (f"p{index}", [sys.executable, "-c", script, str(code)], dict(os.environ))
+        for index, code in enumerate([0, 3, 0, 0])
+    ]
+    logger = RecordingLogger()
+    results = server.run_processes(processes, logger, max_workers=2)
+
+    assert {name: code for name, (code, _) in results.items()} == {
+        "p0": 0,
+        "p1": 3,
+        "p2": 0,
+        "p3": 0,
+    }
+    assert all(wall_time >= 0.1 for _, wall_time in results.values())
+    stdout_lines = [m for level, m in logger.records if m.startswith("p0 (stdout)")]
+    assert len(stdout_lines) == 5000
+    concurrency = [
+        int(m.split(": ")[1])
+        for level, m in logger.records
+        if level == "error" and "(stderr)" in m and "y" not in m
+    ]
+    assert len(concurrency) == 4 and max(concurrency) <= 2
+    assert any("p1 exited with code 3" in m for _, m in logger.records)
+
+
+def test_run_process_survives_output_which_is_not_utf8():
+    script = (
+        "import sys\n"
+        "for i in range(5000):\n"
+        "    sys.stdout.buffer.write(b'caf\\xe9\\n')\n"
+        "    sys.stderr.buffer.write(b'\\xff\\xfe' * 20 + b'\\n')\n"
+    )
+    logger = RecordingLogger()
+    returncode, _ = server.run_process(
+        "p", [sys.executable, "-c", script], dict(os.environ), logger
+    )
+    assert returncode == 0
+    assert ("info", "p (stdout): caf\ufffd") in logger.records
+    assert sum("(stderr)" in m for _, m in logger.records) == 5000
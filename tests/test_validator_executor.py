@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta, timezone
+
+from uptime_service_validation.coordinator import validator_executor
+from uptime_service_validation.coordinator.config import Config
+
+
+def test_executor_name_defaults_to_kubernetes(monkeypatch):
+    monkeypatch.setattr(Config, "VALIDATOR_EXECUTOR", "")
+    monkeypatch.delenv("WORKER_POOL", raising=False)
+    monkeypatch.delenv("TEST_ENV", raising=False)
+    assert validator_executor.executor_name() == Config.EXECUTOR_KUBERNETES
+
+    monkeypatch.setenv("TEST_ENV", "1")
+    assert validator_executor.executor_name() == Config.EXECUTOR_DOCKER
+
+    monkeypatch.setenv("WORKER_POOL", "1")
+    assert validator_executor.executor_name() == Config.EXECUTOR_QUEUE
+
+    monkeypatch.setattr(Config, "VALIDATOR_EXECUTOR", Config.EXECUTOR_FAKE)
+    assert validator_executor.executor_name() == Config.EXECUTOR_FAKE
+
+
+class FakeCursor:
+    rowcount = 3
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, parameters=None):
+        self.statements.append((query, parameters))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+    def close(self):
+        self.closed = True
+
+
+def test_fake_executor_verifies_every_window():
+    connection = FakeConnection()
+    executor = validator_executor.FakeExecutor(
+        fork_rate=0.25, connection_factory=lambda: connection
+    )
+    t0 = datetime(2024, 6, 1, 0, 0, tzinfo=timezone.utc)
+    t1 = datetime(2024, 6, 1, 0, 4, tzinfo=timezone.utc)
+    t2 = datetime(2024, 6, 1, 0, 8, tzinfo=timezone.utc)
+    executor.run([(t0, t1), (t1, t2)])
+
+    updates = [params for query, params in connection.statements if params]
+    assert [(p["start"], p["end"]) for p in updates] == [(t0, t1), (t1, t2)]
+    assert all(p["fork_threshold"] == 2**30 for p in updates)
+    assert connection.closed
+
+
+def test_fake_executor_builds_a_chain_with_forks(connect):
+    connection = connect()
+    start = datetime(2024, 6, 1, 0, 0, tzinfo=timezone.utc)
+    submitters = [f"B62q{index}" for index in range(400)]
+    with connection.cursor() as cursor:
+        # every block producer submits every 3 minutes, for an hour and more
+        for rank in range(21):
+            submitted_at = start + rank * timedelta(minutes=3, seconds=1)
+            cursor.executemany(
+                """INSERT INTO submissions (submitted_at_date, submitted_at, submitter)
+                   VALUES (%s, %s, %s)""",
+                [(submitted_at.date(), submitted_at, key) for key in submitters],
+            )
+    end = start + timedelta(hours=1)
+    middle = start + timedelta(minutes=20)
+    executor = validator_executor.FakeExecutor(
+        fork_rate=0.25, connection_factory=connect
+    )
+    executor.run([(start, middle), (middle, end)])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """SELECT submitter, submitted_at, verified, slot, state_hash, parent
+               FROM submissions"""
+        )
+        rows = cursor.fetchall()
+    verified = [row for row in rows if row[1] < end.replace(tzinfo=None)]
+    assert len(verified) == 20 * len(submitters)
+    assert all(row[2] for row in verified)
+    # the submissions after the last window are left alone
+    assert all(row[2] is None for row in rows if row not in verified)
+
+    state_hashes = {row[4] for row in verified}
+    slots = sorted({row[3] for row in verified})
+    for slot in slots:
+        assert f"fake-{slot}" in state_hashes
+        if slot != slots[0]:
+            # every block, fork or not, is built on the chain block of the slot before
+            assert {row[5] for row in verified if row[3] == slot} == {
+                f"fake-{slot - 1}"
+            }
+
+    forking = {row[0] for row in verified if row[4].endswith("-fork")}
+    assert abs(len(forking) / len(submitters) - 0.25) < 0.05
+    # block producers report forks consistently
+    assert all(row[4].endswith("-fork") == (row[0] in forking) for row in verified)
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+import time
+
+from uptime_service_validation.coordinator import validator_pool
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.validator_pool import ValidationQueue
+
+START = datetime(2024, 6, 1, tzinfo=timezone.utc)
+WINDOWS = [
+    (START + timedelta(minutes=4 * i), START + timedelta(minutes=4 * (i + 1)))
+    for i in range(3)
+]
+
+
+def test_verification_command_passes_the_window(monkeypatch):
+    monkeypatch.setattr(
+        Config, "WORKER_POOL_COMMAND", "docker run --rm verifier '{start}' '{end}'"
+    )
+    start = datetime(2024, 6, 1, 23, 50, tzinfo=timezone.utc)
+    end = datetime(2024, 6, 1, 23, 54, tzinfo=timezone.utc)
+    command, env = validator_pool.verification_command(start, end)
+    assert command == [
+        "docker",
+        "run",
+        "--rm",
+        "verifier",
+        "2024-06-01 23:50:00.0+0000",
+        "2024-06-01 23:54:00.0+0000",
+    ]
+    assert env["START_TIMESTAMP"] == "2024-06-01 23:50:00.0+0000"
+    assert env["END_TIMESTAMP"] == "2024-06-01 23:54:00.0+0000"
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, parameters=None):
+        self.connection.statements.append((query, parameters))
+
+    def fetchone(self):
+        return self.connection.rows.pop(0)
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def test_fail_is_a_single_update_of_the_worker_claim():
+    connection = FakeConnection([("group",)])
+    assert ValidationQueue(connection).fail(7, "worker-1", "exit code 1", 3)
+    (query, parameters), notify = connection.statements
+    assert query.lstrip().startswith("UPDATE")
+    assert "status = 'running' AND worker = %s" in query
+    assert parameters == (3, "exit code 1", 7, "worker-1")
+    assert notify[1] == (validator_pool.DONE_CHANNEL, "group")
+
+
+def test_late_report_of_an_expired_claim_is_dropped():
+    connection = FakeConnection([None])
+    assert not ValidationQueue(connection).complete(7, "worker-1")
+    # nobody is notified of a window which did not change
+    assert len(connection.statements) == 1
+
+
+def test_claims_skip_windows_locked_by_other_workers(connect):
+    queue = ValidationQueue(connect())
+    queue.enqueue("group", WINDOWS)
+    locking = connect(autocommit=False)
+    with locking.cursor() as cursor:
+        cursor.execute("SELECT id FROM validation_queue ORDER BY id LIMIT 1 FOR UPDATE")
+        (locked_id,) = cursor.fetchone()
+
+    claimed = [ValidationQueue(connect()).claim(f"worker-{i}") for i in range(3)]
+    assert [item[1:] for item in claimed[:2]] == WINDOWS[1:]
+    assert locked_id not in [item[0] for item in claimed[:2]]
+    assert claimed[2] is None
+
+    locking.rollback()
+    assert queue.claim("worker-3")[0] == locked_id
+    assert queue.progress("group") == {"running": 3}
+
+
+def test_failed_windows_are_retried_until_max_attempts(connect):
+    queue = ValidationQueue(connect())
+    queue.enqueue("group", WINDOWS[:1])
+    for attempt in range(1, 4):
+        item_id, _, _ = queue.claim("worker")
+        assert queue.fail(item_id, "worker", "exit code 1", max_attempts=3)
+        expected = "failed" if attempt == 3 else "pending"
+        assert queue.progress("group") == {expected: 1}
+    assert queue.claim("worker") is None
+
+
+def test_expired_claims_are_released_and_late_reports_ignored(connect):
+    queue = ValidationQueue(connect())
+    queue.enqueue("group", WINDOWS[:1])
+    item_id, _, _ = queue.claim("worker-1")
+    assert queue.release_expired(3600) == 0
+    assert queue.release_expired(0) == 1
+
+    assert queue.claim("worker-2")[0] == item_id
+    # worker-1 finally reports on the window worker-2 is verifying
+    assert not queue.fail(item_id, "worker-1", "exit code 1")
+    assert not queue.complete(item_id, "worker-1")
+    assert queue.progress("group") == {"running": 1}
+    assert queue.complete(item_id, "worker-2")
+    assert queue.progress("group") == {"done": 1}
+
+
+def test_cancel_drops_pending_windows_only(connect):
+    queue = ValidationQueue(connect())
+    queue.enqueue("group", WINDOWS)
+    queue.enqueue("other", WINDOWS[:1])
+    queue.claim("worker")
+    queue.cancel("group")
+    assert queue.progress("group") == {"running": 1, "failed": 2}
+    assert queue.progress("other") == {"pending": 1}
+
+
+def test_wait_returns_when_a_window_is_done(connect):
+    coordinator = ValidationQueue(connect())
+    coordinator.listen(validator_pool.DONE_CHANNEL)
+    worker = ValidationQueue(connect())
+    worker.enqueue("group", WINDOWS[:1])
+    item_id, _, _ = worker.claim("worker")
+    worker.complete(item_id, "worker")
+    started = time.monotonic()
+    coordinator.wait(10)
+    assert time.monotonic() - started < 5
@@ -0,0 +1,240 @@
+"""Micro-benchmarks of the scoring of a batch. Each stage of
+process_statehash_df is timed on synthetic batches of increasing size, and
+process_statehash_df itself is timed end to end against an in-memory
+database, so that the cost of the database round trips is left out.
+
+Results are compared with the baselines recorded in baselines.json; run
+`invoke benchmark-scoring` to compare, and with `--save` to record new
+baselines. Timings only compare on the machine and with the versions they
+were recorded with, so baselines recorded elsewhere are reported but never
+flagged as regressions."""
+
+from datetime import timedelta
+import json
+import os
+from pathlib import Path
+import platform
+import time
+
+import pandas as pd
+
+from uptime_service_validation.benchmarks.synthetic import ChainSpec, generate_batch
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.coordinator import (
+    master_dataframe,
+    process_statehash_df,
+)
+from uptime_service_validation.coordinator.helper import (
+    IdRegistry,
+    apply_weights,
+    bfs,
+    create_graph,
+    filter_state_hash_percentage,
+    get_relations,
+)
+
+SIZES = [1_000, 10_000, 100_000]
+STAGES = [
+    "filter_state_hash_percentage",
+    "create_graph",
+    "apply_weights",
+    "bfs",
+    "process_statehash_df",
+]
+SUBMISSIONS_PER_PRODUCER = 10
+# Stages slower than their baseline by less than this are not regressions,
+# whatever the ratio, as timings this short are mostly noise
+NOISE_SECONDS = 0.001
+BASELINES_PATH = Path(__file__).with_name("baselines.json")
+
+
+class InMemoryRegistry(IdRegistry):
+    "Assigns consecutive ids to keys, as the database would."
+
+    def load(self):
+        return {}
+
+    def insert(self, keys):
+        first = len(self.ids) + 1
+        return {key: first + index for index, key in enumerate(keys)}
+
+
+class InMemoryDB:
+    "The part of DB used by process_statehash_df, without a database."
+
+    def __init__(self, synthetic):
+        self.synthetic = synthetic
+        self.statehashes = InMemoryRegistry(self)
+        self.nodes = InMemoryRegistry(self)
+        self.statehash_results = None
+        self.point_records = None
+
+    def get_previous_statehash(self, bot_log_id):
+        return self.synthetic.relation_df, self.synthetic.p_selected_node_df
+
+    def create_bot_log(self, values):
+        return self.synthetic.batch.bot_log_id + 1
+
+    def insert_statehash_results(self, df, page_size=100):
+        self.statehash_results = df
+
+    def create_point_record(self, df, page_size=100):
+        self.point_records = df
+
+
+def spec_for(size, **overrides):
+    "The shape of a synthetic batch of size submissions."
+    return ChainSpec(
+        producers=max(size // SUBMISSIONS_PER_PRODUCER, 1),
+        submissions_per_producer=SUBMISSIONS_PER_PRODUCER,
+        **overrides,
+    )
+
+
+def measure(function, repeat, setup=lambda: ()):
+    """Return the shortest time of repeat calls of function. setup is called
+    before each of them, untimed, and returns the arguments of function."""
+    best = None
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(size, repeat=5, **overrides):
+    "Time every scoring stage on a synthetic batch. Return seconds per stage."
+    synthetic = generate_batch(spec_for(size, **overrides))
+    master_df = master_dataframe(synthetic.state_hash_df)
+    p_selected_node_df = synthetic.p_selected_node_df
+    p_map = list(get_relations(synthetic.relation_df))
+    c_selected_node = filter_state_hash_percentage(
+        master_df, Config.STATE_HASH_THRESHOLD
+    )
+    queue_list = list(p_selected_node_df["state_hash"].values) + c_selected_node
+
+    def graph():
+        return create_graph(master_df, p_selected_node_df, c_selected_node, p_map)
+
+    def weighted_graph():
+        return (apply_weights(graph(), c_selected_node, p_selected_node_df),)
+
+    return {
+        "filter_state_hash_percentage": measure(
+            filter_state_hash_percentage,
+            repeat,
+            lambda: (master_df, Config.STATE_HASH_THRESHOLD),
+        ),
+        "create_graph": measure(graph, repeat),
+        "apply_weights": measure(
+            apply_weights,
+            repeat,
+            lambda: (graph(), c_selected_node, p_selected_node_df),
+        ),
+        "bfs": measure(
+            lambda g: bfs(g, queue_list, queue_list[0]), repeat, weighted_graph
+        ),
+        "process_statehash_df": measure(
+            process_statehash_df,
+            repeat,
+            lambda: (
+                InMemoryDB(synthetic),
+                synthetic.batch,
+                synthetic.state_hash_df,
+                timedelta(seconds=0),
+            ),
+        ),
+    }
+
+
+def environment():
+    "Describe what timings depend on: the machine and the versions used."
+    return {
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+    }
+
+
+def load_baselines(path=BASELINES_PATH):
+    """Return the environment the baselines were recorded in and the
+    baselines, or None and no baselines if none were recorded."""
+    if not path.exists():
+        return None, {}
+    with open(path) as f:
+        recorded = json.load(f)
+    return recorded.get("environment"), recorded["results"]
+
+
+def save_baselines(results, path=BASELINES_PATH):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+        f.write("\n")
+
+
+def environment_differences(recorded):
+    "List how the current environment differs from the recorded one."
+    current = environment()
+    recorded = recorded or {}
+    return [
+        f"{key}: {recorded.get(key)} (baselines) != {value} (now)"
+        for key, value in current.items()
+        if recorded.get(key) != value
+    ]
+
+
+def compare(results, baselines, tolerance):
+    """Return the report lines of every stage and the stages slower than
+    tolerance times their baseline, as (size, stage) pairs."""
+    lines = [f"{'size':>8} {'stage':<30} {'ms':>10} {'baseline':>10} {'ratio':>6}"]
+    regressions = []
+    for size, stages in results.items():
+        for stage, seconds in stages.items():
+            baseline = baselines.get(size, {}).get(stage)
+            if baseline:
+                ratio = seconds / baseline
+                lines.append(
+                    f"{size:>8} {stage:<30} {seconds * 1000:>10.3f} {baseline * 1000:>10.3f} {ratio:>6.2f}"
+                )
+                if ratio > tolerance and seconds - baseline > NOISE_SECONDS:
+                    regressions.append((size, stage))
+            else:
+                lines.append(
+                    f"{size:>8} {stage:<30} {seconds * 1000:>10.3f} {'-':>10} {'-':>6}"
+                )
+    return lines, regressions
+
+
+def run(sizes=SIZES, repeat=5, save=False, tolerance=1.5):
+    """Benchmark the scoring at the given sizes and compare it with the
+    baselines, or record them. Return False if a stage regressed."""
+    results = {str(size): benchmark(size, repeat) for size in sizes}
+    recorded_environment, baselines = load_baselines()
+    differences = environment_differences(recorded_environment)
+    if save:
+        # baselines of another environment are not comparable with these
+        baselines = {} if differences else baselines
+    lines, regressions = compare(results, baselines, tolerance)
+    print("\n".join(lines))
+    if save:
+        save_baselines({**baselines, **results})
+        print(f"baselines saved to {BASELINES_PATH}")
+        return True
+    if baselines and differences:
+        print(
+            "WARNING: the baselines were recorded in another environment, "
+            "regressions are not checked. Record baselines on this machine "
+            "with --save first.\n  " + "\n  ".join(differences)
+        )
+        return True
+    for size, stage in regressions:
+        print(f"{stage} at {size} submissions is over {tolerance}x its baseline")
+    return not regressions
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if run() else 1)
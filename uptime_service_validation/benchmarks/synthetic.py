@@ -0,0 +1,120 @@
+"""Synthetic batches of verified submissions, shaped like the ones the
+coordinator scores: block producers report the tip of a chain which grows
+block after block during the batch, a fraction of the reports are fork blocks
+of the same height, and the statehashes selected in the previous batch are
+carried over."""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from uptime_service_validation.coordinator.helper import Batch
+
+# Length of base58 statehashes and block producer keys
+STATE_HASH_LENGTH = 52
+PUBLIC_KEY_LENGTH = 55
+
+
+@dataclass
+class ChainSpec:
+    "Shape of a synthetic batch."
+
+    producers: int = 100
+    submissions_per_producer: int = 10
+    # fraction of the submissions reporting a fork block instead of the chain
+    fork_rate: float = 0.05
+    # number of distinct fork blocks at each height
+    forks_per_height: int = 3
+    # number of chain blocks produced during the batch
+    chain_depth: int = 10
+    # number of statehashes selected in the previous batch
+    carried_over: int = 10
+    # height of the last block of the previous batch
+    start_height: int = 100_000
+    batch_start: datetime = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    interval: timedelta = timedelta(minutes=20)
+    seed: int = 0
+
+    @property
+    def submissions(self):
+        return self.producers * self.submissions_per_producer
+
+
+@dataclass
+class SyntheticBatch:
+    """A batch and the inputs of process_statehash_df: the verified
+    submissions and the result of get_previous_statehash."""
+
+    batch: Batch
+    state_hash_df: pd.DataFrame
+    relation_df: pd.DataFrame
+    p_selected_node_df: pd.DataFrame
+
+
+def chain_hash(height):
+    return f"3NChain{height}".ljust(STATE_HASH_LENGTH, "x")
+
+
+def fork_hash(height, fork):
+    return f"3NFork{height}f{fork}".ljust(STATE_HASH_LENGTH, "x")
+
+
+def producer_key(index):
+    return f"B62q{index}".ljust(PUBLIC_KEY_LENGTH, "x")
+
+
+def previous_selection(spec):
+    """The chain blocks selected in the previous batch, as returned by
+    DB.get_previous_statehash."""
+    heights = range(spec.start_height - spec.carried_over + 1, spec.start_height + 1)
+    relation_df = pd.DataFrame(
+        {
+            "parent_state_hash": [chain_hash(height - 1) for height in heights],
+            "state_hash": [chain_hash(height) for height in heights],
+        }
+    )
+    p_selected_node_df = pd.DataFrame(
+        {"state_hash": relation_df["state_hash"], "weight": 0}
+    )
+    return relation_df, p_selected_node_df
+
+
+def generate_batch(spec):
+    """Generate a batch of spec.submissions verified submissions. Every block
+    producer submits at regular intervals (with some jitter) and reports the
+    chain block produced last, or a fork block of the same height."""
+    rng = np.random.default_rng(spec.seed)
+    interval = spec.interval.total_seconds()
+    submitters = np.repeat(np.arange(spec.producers), spec.submissions_per_producer)
+    rounds = np.tile(np.arange(spec.submissions_per_producer), spec.producers)
+    offsets = (rounds + rng.random(spec.submissions)) * (
+        interval / spec.submissions_per_producer
+    )
+    blocks = np.minimum(
+        (offsets * spec.chain_depth / interval).astype(int), spec.chain_depth - 1
+    )
+    heights = spec.start_height + 1 + blocks
+    forked = rng.random(spec.submissions) < spec.fork_rate
+    forks = rng.integers(0, spec.forks_per_height, spec.submissions)
+
+    submitted_at = pd.Timestamp(spec.batch_start) + pd.to_timedelta(offsets, unit="s")
+    state_hash_df = pd.DataFrame(
+        {
+            "submitted_at": submitted_at,
+            "submitter": [producer_key(index) for index in submitters],
+            "created_at": submitted_at,
+            "state_hash": [
+                fork_hash(height, fork) if is_fork else chain_hash(height)
+                for height, fork, is_fork in zip(heights, forks, forked)
+            ],
+            "parent": [chain_hash(height - 1) for height in heights],
+            "height": heights,
+            "slot": heights + spec.start_height // 2,
+        }
+    ).sort_values("submitted_at", ignore_index=True)
+
+    relation_df, p_selected_node_df = previous_selection(spec)
+    batch = Batch(spec.batch_start, 1, spec.interval)
+    return SyntheticBatch(batch, state_hash_df, relation_df, p_selected_node_df)
@@ -1,19 +1,33 @@
 import boto3
+import logging
+import threading
 import time
 import random
-from cassandra import ProtocolVersion
+from cassandra import (
+    OperationTimedOut,
+    ProtocolVersion,
+    ReadTimeout,
+    Unavailable,
+    WriteTimeout,
+)
 from cassandra.auth import PlainTextAuthProvider
-from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT, ResultSet
 from cassandra_sigv4.auth import SigV4AuthProvider
 from cassandra.policies import DCAwareRoundRobinPolicy, RetryPolicy
+from cassandra.query import SimpleStatement
 from ssl import SSLContext, CERT_REQUIRED, PROTOCOL_TLS_CLIENT
-from datetime import datetime, timedelta
-from typing import Optional, List
-
-import pandas as pd
+from collections import Counter, deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, List, Tuple
 
 from uptime_service_validation.coordinator.config import Config
-from uptime_service_validation.coordinator.helper import Submission
+from uptime_service_validation.coordinator.helper import Submission, SUBMISSION_FIELDS
+
+# delay before retrying a failed refresh of temporary credentials
+CREDENTIALS_RETRY_DELAY_SECONDS = 30
 
 
 class AWSKeyspacesClient:
@@ -36,40 +50,55 @@ class AWSKeyspacesClient:
         self.aws_region = self.cassandra_host.split(".")[1]
         self.ssl_context = self._create_ssl_context()
         self.request_timeout = 20.0
+        self.retry_policy = ExponentialBackOffRetryPolicy()
+        self.retry_metrics = RetryMetrics()
+        self.concurrency_limit = None
+        if Config.cassandra_adaptive_concurrency():
+            self.concurrency_limit = AdaptiveConcurrencyLimit(
+                Config.CASSANDRA_MIN_IN_FLIGHT,
+                Config.CASSANDRA_MAX_IN_FLIGHT,
+                Config.CASSANDRA_LATENCY_TARGET_MS / 1000,
+            )
+        self._planner = None
+        self.executor = None
+        self.session = None
+        # expiration of the temporary credentials when assuming a role
+        self.credentials_expiration = None
+        self._refresh_timer = None
 
         if self.cassandra_user and self.cassandra_pass:
             self.auth_provider = PlainTextAuthProvider(
                 username=self.cassandra_user, password=self.cassandra_pass
             )
+        else:
+            self.auth_provider = self._create_sigv4auth_provider()
+            self._schedule_credentials_refresh()
+        self.cluster = self._create_cluster()
+
+    def _create_cluster(self):
+        if self.cassandra_user and self.cassandra_pass:
             profile = ExecutionProfile(
                 # assuming this is for hosted Cassandra, load balancing policy to be determined
                 # load_balancing_policy=DCAwareRoundRobinPolicy(local_dc=self.aws_region),
-                retry_policy=ExponentialBackOffRetryPolicy(),
+                retry_policy=self.retry_policy,
                 request_timeout=self.request_timeout,
             )
-            self.cluster = Cluster(
-                [self.cassandra_host],
-                ssl_context=self.ssl_context,
-                auth_provider=self.auth_provider,
-                port=int(self.cassandra_port),
-                execution_profiles={EXEC_PROFILE_DEFAULT: profile},
-                protocol_version=ProtocolVersion.V4,
-            )
         else:
-            self.auth_provider = self._create_sigv4auth_provider()
             profile = ExecutionProfile(
                 load_balancing_policy=DCAwareRoundRobinPolicy(local_dc=self.aws_region),
-                retry_policy=ExponentialBackOffRetryPolicy(),
+                retry_policy=self.retry_policy,
                 request_timeout=self.request_timeout,
             )
-            self.cluster = Cluster(
-                [self.cassandra_host],
-                ssl_context=self.ssl_context,
-                auth_provider=self.auth_provider,
-                port=int(self.cassandra_port),
-                execution_profiles={EXEC_PROFILE_DEFAULT: profile},
-                protocol_version=ProtocolVersion.V4,
-            )
+        return Cluster(
+            [self.cassandra_host],
+            ssl_context=self.ssl_context,
+            auth_provider=self.auth_provider,
+            port=int(self.cassandra_port),
+            execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+            protocol_version=ProtocolVersion.V4,
+            # the driver's default picks any available compression
+            compression="lz4" if Config.cassandra_lz4_compression() else True,
+        )
 
     def _create_ssl_context(self):
         ssl_context = SSLContext(PROTOCOL_TLS_CLIENT)
@@ -82,6 +111,9 @@ class AWSKeyspacesClient:
         return self.role_arn is not None and self.role_arn != ""
 
     def _create_sigv4auth_provider(self):
+        return SigV4AuthProvider(self._create_boto_session())
+
+    def _create_boto_session(self):
         if self._using_assumed_role():
             if not self.web_identity_token_file:
                 raise ValueError(
@@ -92,6 +124,7 @@ class AWSKeyspacesClient:
                     "AWS_ROLE_SESSION_NAME environment variable is not set"
                 )
 
+            # the token is read on every refresh, as it is rotated on disk
             with open(self.web_identity_token_file, "r") as file:
                 web_identity_token = file.read().strip()
 
@@ -102,6 +135,7 @@ class AWSKeyspacesClient:
                 WebIdentityToken=web_identity_token,
             )
             credentials = response["Credentials"]
+            self.credentials_expiration = credentials["Expiration"]
             boto_session = boto3.Session(
                 aws_access_key_id=credentials["AccessKeyId"],
                 aws_secret_access_key=credentials["SecretAccessKey"],
@@ -114,10 +148,46 @@ class AWSKeyspacesClient:
                 aws_secret_access_key=self.aws_secret_access_key,
                 region_name=self.aws_region,
             )
-        return SigV4AuthProvider(boto_session)
+        return boto_session
+
+    def _schedule_credentials_refresh(self):
+        """Refresh the temporary credentials of an assumed role in the
+        background ahead of their expiration. The SigV4 provider reads them
+        whenever the driver opens a connection, so the session can outlive
+        them."""
+        if self.credentials_expiration is None:
+            return
+        remaining = self.credentials_expiration - datetime.now(timezone.utc)
+        delay = max(
+            remaining.total_seconds() - Config.CREDENTIALS_REFRESH_MARGIN_SECONDS,
+            CREDENTIALS_RETRY_DELAY_SECONDS,
+        )
+        self._refresh_timer = threading.Timer(delay, self._refresh_credentials)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh_credentials(self):
+        try:
+            self.auth_provider.session = self._create_boto_session()
+            logging.info(
+                "AWS credentials refreshed, valid until %s", self.credentials_expiration
+            )
+        except Exception as e:
+            logging.error("Error refreshing AWS credentials: %s", e)
+        self._schedule_credentials_refresh()
 
     def connect(self):
         self.session = self.cluster.connect()
+        self._planner = None
+        self.executor = RetryingExecutor(
+            self.session, self.retry_policy, self.retry_metrics, self.concurrency_limit
+        )
+
+    def reconnect(self):
+        "Replace the cluster and its session with new ones, e.g. after a failure."
+        self.cluster.shutdown()
+        self.cluster = self._create_cluster()
+        self.connect()
 
     def execute_query(self, query, parameters=None):
         if parameters:
@@ -132,34 +202,14 @@ class AWSKeyspacesClient:
         start_date: datetime, end_date: datetime
     ) -> List[str]:
         submitted_at_date_start = start_date.date()
-        submitted_at_date_end = end_date.date()
-        if submitted_at_date_start == submitted_at_date_end:
-            submitted_at_dates = [submitted_at_date_start.strftime("%Y-%m-%d")]
-        else:
-            submitted_at_dates = (
-                pd.date_range(submitted_at_date_start, submitted_at_date_end)
-                .map(lambda x: x.date().strftime("%Y-%m-%d"))
-                .to_list()
-            )
-        return submitted_at_dates
-
-    def get_submissions(
-        self,
-        limit: Optional[int] = None,
-        submitted_at_start: Optional[datetime] = None,
-        submitted_at_end: Optional[datetime] = None,
-        start_inclusive: bool = True,
-        end_inclusive: bool = False,
-    ) -> List[Submission]:
-        # you have to provide either both submitted_at_start and submitted_at_end or neither
-        if (submitted_at_start and not submitted_at_end) or (
-            not submitted_at_start and submitted_at_end
-        ):
-            raise ValueError(
-                "You have to provide either both submitted_at_start and submitted_at_end or neither"
-            )
+        days = (end_date.date() - submitted_at_date_start).days
+        return [
+            (submitted_at_date_start + timedelta(days=day)).strftime("%Y-%m-%d")
+            for day in range(days + 1)
+        ]
 
-        base_query = f"""SELECT 
+    def _select_submissions(self):
+        return f"""SELECT 
                         submitted_at_date, 
                         submitted_at, 
                         submitter, 
@@ -177,89 +227,424 @@ class AWSKeyspacesClient:
                         verified 
                        FROM {self.aws_keyspace}.submissions"""
 
-        # For storing conditions and corresponding parameters
-        conditions = []
-        parameters = []
-
-        # Getting submitted_at_date list
-        if submitted_at_start and submitted_at_end:
-            submitted_at_date_list = self.get_submitted_at_date_list(
-                submitted_at_start, submitted_at_end
+    @property
+    def planner(self):
+        # statements are prepared on the session, so the planner lives as long as it
+        if self._planner is None:
+            self._planner = SubmissionQueryPlanner(
+                self.session, self._select_submissions()
             )
+        return self._planner
 
-            shard_condition = ShardCalculator.calculate_shards_in_range(
-                submitted_at_start, submitted_at_end
+    def stream_submissions(
+        self,
+        limit: Optional[int] = None,
+        submitted_at_start: Optional[datetime] = None,
+        submitted_at_end: Optional[datetime] = None,
+        start_inclusive: bool = True,
+        end_inclusive: bool = False,
+        fetch_size: Optional[int] = None,
+    ):
+        """Stream submissions page by page, as fetched by the driver. Each page
+        is a list of rows with the columns in SUBMISSION_FIELDS order."""
+        # you have to provide either both submitted_at_start and submitted_at_end or neither
+        if (submitted_at_start and not submitted_at_end) or (
+            not submitted_at_start and submitted_at_end
+        ):
+            raise ValueError(
+                "You have to provide either both submitted_at_start and submitted_at_end or neither"
             )
 
-            if len(submitted_at_date_list) == 1:
-                submitted_at_date = submitted_at_date_list[0]
-            else:
-                submitted_at_date = None
-                submitted_at_dates = ",".join(
-                    [
-                        f"'{submitted_at_date}'"
-                        for submitted_at_date in submitted_at_date_list
-                    ]
-                )
-            # Adding conditions based on provided parameters
-            if submitted_at_date:
-                conditions.append("submitted_at_date = %s")
-                parameters.append(submitted_at_date)
-            elif submitted_at_dates:
-                conditions.append(f"submitted_at_date IN ({submitted_at_dates})")
-
-            # Add shard condition here since we have a submitted_at_date or submitted_at_dates
-            conditions.append(shard_condition)
-
-            if submitted_at_start:
-                start_operator = ">=" if start_inclusive else ">"
-                conditions.append(f"submitted_at {start_operator} %s")
-                parameters.append(submitted_at_start)
-            if submitted_at_end:
-                end_operator = "<=" if end_inclusive else "<"
-                conditions.append(f"submitted_at {end_operator} %s")
-                parameters.append(submitted_at_end)
-
-        # Constructing the final query
-        if conditions:
-            query = f"{base_query} WHERE {' AND '.join(conditions)}"
+        if submitted_at_start and submitted_at_end:
+            statement = self.planner.window_statement(
+                submitted_at_start,
+                submitted_at_end,
+                start_inclusive,
+                end_inclusive,
+                limit,
+            )
+            if statement is None:
+                return
         else:
-            query = base_query
+            query = self._select_submissions()
+            if limit is not None:
+                query += f" LIMIT {limit}"
+            statement = SimpleStatement(query)
+        statement.fetch_size = fetch_size or Config.SUBMISSION_FETCH_SIZE
 
-        if limit is not None:
-            query += f" LIMIT {limit}"
+        yield from self.executor.pages(statement)
 
-        # Executing the query with parameters
-        results = self.execute_query(query, parameters)
+    def stream_partitioned_submissions(
+        self,
+        time_intervals: List[Tuple[datetime, datetime]],
+        start_inclusive: bool = True,
+        end_inclusive: bool = False,
+        fetch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+    ):
+        """Stream the submissions of the given time intervals with one query
+        per (submitted_at_date, shard) partition instead of a multi-partition
+        IN query. Queries are sent asynchronously, with at most concurrency of
+        them in flight (by default the adaptive limit if enabled, otherwise
+        CASSANDRA_MAX_IN_FLIGHT), and the pages of their results are yielded in the
+        order of the partitions. Further pages of a partition are fetched
+        when its first page is consumed."""
+        statements = self.planner.partition_statements(
+            time_intervals, start_inclusive, end_inclusive
+        )
+        in_flight = deque()
+        for statement in statements:
+            statement.fetch_size = fetch_size or Config.SUBMISSION_FETCH_SIZE
+            while len(in_flight) >= self._max_in_flight(concurrency):
+                yield from self._pages_of(*in_flight.popleft())
+            in_flight.append((statement, self.executor.execute_async(statement)))
+        while in_flight:
+            yield from self._pages_of(*in_flight.popleft())
+
+    def _max_in_flight(self, concurrency=None):
+        if concurrency:
+            return concurrency
+        if self.concurrency_limit is not None:
+            return self.concurrency_limit.current
+        return Config.CASSANDRA_MAX_IN_FLIGHT
+
+    def _pages_of(self, statement, future):
+        return self.executor.pages(statement, future.result())
 
+    def get_submissions(
+        self,
+        limit: Optional[int] = None,
+        submitted_at_start: Optional[datetime] = None,
+        submitted_at_end: Optional[datetime] = None,
+        start_inclusive: bool = True,
+        end_inclusive: bool = False,
+    ) -> List[Submission]:
         # Mapping results to Submission dataclass instances
-        submissions = [
-            Submission(
-                submitted_at_date=row.submitted_at_date,
-                submitted_at=row.submitted_at,
-                submitter=row.submitter,
-                created_at=row.created_at,
-                block_hash=row.block_hash,
-                remote_addr=row.remote_addr,
-                peer_id=row.peer_id,
-                graphql_control_port=row.graphql_control_port,
-                built_with_commit_sha=row.built_with_commit_sha,
-                state_hash=row.state_hash,
-                parent=row.parent,
-                height=row.height,
-                slot=row.slot,
-                validation_error=row.validation_error,
-                verified=row.verified,
+        return [
+            Submission(**dict(zip(SUBMISSION_FIELDS, row)))
+            for page in self.stream_submissions(
+                limit,
+                submitted_at_start,
+                submitted_at_end,
+                start_inclusive,
+                end_inclusive,
             )
-            for row in results
+            for row in page
         ]
-        return submissions
+
+    def submission_histogram(self, start_time, end_time):
+        """Count the submissions between start_time (inclusive) and end_time
+        (exclusive) per (submitted_at_date, shard) partition, with one count
+        query per partition. Return a list of ((bucket_start, bucket_end),
+        count) in time order, the buckets being the partitions' time spans
+        clipped to the window."""
+        statement = self.planner.count_statement(f"{self.aws_keyspace}.submissions")
+        in_flight = deque()
+        histogram = []
+
+        def collect(partition, future):
+            span = ShardCalculator.partition_span(*partition)
+            histogram.append(
+                (
+                    (max(span[0], start_time), min(span[1], end_time)),
+                    future.result().one()[0],
+                )
+            )
+
+        for partition in self.planner.plan(start_time, end_time).partitions:
+            while len(in_flight) >= self._max_in_flight():
+                collect(*in_flight.popleft())
+            future = self.executor.execute_async(
+                statement.bind((*partition, start_time, end_time))
+            )
+            in_flight.append((partition, future))
+        while in_flight:
+            collect(*in_flight.popleft())
+        return histogram
 
     def close(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
         self.cluster.shutdown()
 
 
+@dataclass(frozen=True)
+class SubmissionQueryPlan:
+    "The dates, shards and (date, shard) partitions spanned by a time window."
+
+    dates: Tuple[str, ...]
+    shards: Tuple[int, ...]
+    partitions: Tuple[Tuple[str, int], ...]
+
+
+class SubmissionQueryPlanner:
+    """Plans the reads of submissions in a time window. Plans are computed
+    arithmetically and cached per window, and each variant of the query is
+    prepared once per session, so that only bound parameters are sent to the
+    server afterwards."""
+
+    def __init__(self, session, select_query):
+        self.session = session
+        self.select_query = select_query
+        self.statements = {}
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def plan(start_time, end_time):
+        return SubmissionQueryPlan(
+            dates=tuple(
+                AWSKeyspacesClient.get_submitted_at_date_list(start_time, end_time)
+            ),
+            shards=tuple(ShardCalculator.shards_in_range(start_time, end_time)),
+            partitions=tuple(ShardCalculator.partitions_in_range(start_time, end_time)),
+        )
+
+    def statement(self, partition, start_inclusive, end_inclusive, limit=False):
+        "Get the prepared statement of a query variant, preparing it on first use."
+        key = (partition, start_inclusive, end_inclusive, limit)
+        if key not in self.statements:
+            start_operator = ">=" if start_inclusive else ">"
+            end_operator = "<=" if end_inclusive else "<"
+            if partition:
+                partition_condition = "submitted_at_date = ? AND shard = ?"
+            else:
+                partition_condition = "submitted_at_date IN ? AND shard IN ?"
+            query = (
+                f"{self.select_query} WHERE {partition_condition}"
+                f" AND submitted_at {start_operator} ? AND submitted_at {end_operator} ?"
+            )
+            if limit:
+                query += " LIMIT ?"
+            self.statements[key] = self.session.prepare(query)
+        return self.statements[key]
+
+    def count_statement(self, table):
+        "Get the prepared statement counting the submissions of a partition."
+        if "count" not in self.statements:
+            self.statements["count"] = self.session.prepare(
+                f"SELECT count(*) FROM {table}"
+                " WHERE submitted_at_date = ? AND shard = ?"
+                " AND submitted_at >= ? AND submitted_at < ?"
+            )
+        return self.statements["count"]
+
+    def window_statement(
+        self, start_time, end_time, start_inclusive, end_inclusive, limit=None
+    ):
+        """Bind the query reading a time window with IN conditions on its dates
+        and shards. Returns None if the window spans no shard."""
+        if self.excludes_end_partition(start_time, end_time, end_inclusive):
+            # the shard starting at end_time is only read if the window covers
+            # it elsewhere, e.g. on another date
+            plan = self.plan(start_time, end_time - timedelta(microseconds=1))
+        else:
+            plan = self.plan(start_time, end_time)
+        if not plan.shards:
+            return None
+        parameters = [list(plan.dates), list(plan.shards), start_time, end_time]
+        if limit is not None:
+            parameters.append(limit)
+        return self.statement(
+            False, start_inclusive, end_inclusive, limit is not None
+        ).bind(parameters)
+
+    @staticmethod
+    def excludes_end_partition(start_time, end_time, end_inclusive):
+        """Check if none of the submissions of the partition starting at
+        end_time is read, as end_time is excluded and starts a shard."""
+        return (
+            not end_inclusive
+            and start_time < end_time
+            and ShardCalculator.on_shard_boundary(end_time)
+        )
+
+    def partition_statements(self, time_intervals, start_inclusive, end_inclusive):
+        "Bind one single-partition query per partition of every time interval."
+        statement = self.statement(True, start_inclusive, end_inclusive)
+        for start_time, end_time in time_intervals:
+            partitions = self.plan(start_time, end_time).partitions
+            if self.excludes_end_partition(start_time, end_time, end_inclusive):
+                partitions = partitions[:-1]
+            for submitted_at_date, shard in partitions:
+                yield statement.bind((submitted_at_date, shard, start_time, end_time))
+
+
+# Errors after which a query is retried with a backoff: timeouts and
+# unavailable replicas, which is also how Keyspaces reports throttling.
+RETRYABLE_ERRORS = (ReadTimeout, WriteTimeout, Unavailable, OperationTimedOut)
+
+
+class RetryMetrics:
+    "Counts the retries of Cassandra queries and the backoff delays spent on them."
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = Counter()
+        self.delay_seconds = 0.0
+        self.failures = 0
+
+    def record_retry(self, error, delay):
+        with self._lock:
+            self.retries[type(error).__name__] += 1
+            self.delay_seconds += delay
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self):
+        "Return the counters as a dict, e.g. for logging."
+        with self._lock:
+            return {
+                "retries": sum(self.retries.values()),
+                "retries_by_error": dict(self.retries),
+                "delay_seconds": round(self.delay_seconds, 3),
+                "failures": self.failures,
+            }
+
+
+class AdaptiveConcurrencyLimit:
+    """AIMD (additive increase, multiplicative decrease) limit on the number
+    of concurrent reads, following the throughput Keyspaces allows. Every read
+    answered within the latency target adds 1/limit, i.e. about one more
+    concurrent read per round of reads, and a throttled or timed out read
+    multiplies the limit by backoff_ratio. Errors of reads sent before the
+    last decrease are part of the same burst and do not decrease it again."""
+
+    def __init__(
+        self,
+        minimum,
+        maximum,
+        latency_target,
+        backoff_ratio=0.5,
+        throughput_window=60.0,
+        clock=time.monotonic,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target  # seconds
+        self.backoff_ratio = backoff_ratio
+        self.throughput_window = throughput_window  # seconds
+        self.clock = clock
+        self.limit = float(minimum)
+        self._last_decrease = float("-inf")
+        self._completed = deque()  # (completed at, rows)
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        "The number of reads which may currently be in flight."
+        return max(self.minimum, int(self.limit))
+
+    def on_success(self, sent_at, rows):
+        now = self.clock()
+        with self._lock:
+            self._completed.append((now, rows))
+            if now - sent_at <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self, sent_at):
+        with self._lock:
+            if sent_at >= self._last_decrease:
+                self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+                self._last_decrease = self.clock()
+
+    def throughput(self):
+        "Rows read per second over the last throughput_window seconds."
+        now = self.clock()
+        with self._lock:
+            while self._completed and self._completed[0][0] < now - self.throughput_window:
+                self._completed.popleft()
+            return sum(rows for _, rows in self._completed) / self.throughput_window
+
+    def snapshot(self):
+        "Return the current limit and observed throughput, e.g. for logging."
+        return {
+            "limit": self.current,
+            "rows_per_second": round(self.throughput(), 1),
+        }
+
+
+class RetryingExecutor:
+    """Executes statements asynchronously and retries them after an
+    exponential backoff on RETRYABLE_ERRORS. The delayed attempt is
+    scheduled on the driver's timer and then sent from the session's
+    executor, the same way the driver runs its own retries, so no thread
+    sleeps while waiting and other requests are not held up."""
+
+    def __init__(self, session, policy, metrics, concurrency_limit=None):
+        self.session = session
+        self.policy = policy
+        self.metrics = metrics
+        # optional AdaptiveConcurrencyLimit informed of latencies and throttling
+        self.concurrency_limit = concurrency_limit
+
+    def execute_async(self, statement, paging_state=None):
+        "Execute a statement, returning a Future of its ResultSet."
+        future = Future()
+        self._attempt(future, statement, paging_state, 0)
+        return future
+
+    def execute(self, statement, paging_state=None):
+        return self.execute_async(statement, paging_state).result()
+
+    def pages(self, statement, result=None):
+        """Yield the pages of rows of a statement, starting from its first
+        ResultSet if it was already fetched. Every page is fetched with
+        retries, resuming from the paging state of the previous one."""
+        if result is None:
+            result = self.execute(statement)
+        while True:
+            yield result.current_rows
+            if not result.has_more_pages:
+                break
+            result = self.execute(statement, result.paging_state)
+
+    def _attempt(self, future, statement, paging_state, retry_num):
+        sent_at = time.monotonic()
+        try:
+            response = self.session.execute_async(statement, paging_state=paging_state)
+        except Exception as error:
+            future.set_exception(error)
+            return
+        response.add_callbacks(
+            callback=lambda rows: self._on_success(future, response, sent_at, rows),
+            errback=lambda error: self._on_error(
+                future, statement, paging_state, retry_num, sent_at, error
+            ),
+        )
+
+    def _on_success(self, future, response, sent_at, rows):
+        if self.concurrency_limit is not None:
+            self.concurrency_limit.on_success(sent_at, len(rows))
+        future.set_result(ResultSet(response, rows))
+
+    def _on_error(self, future, statement, paging_state, retry_num, sent_at, error):
+        if not isinstance(error, RETRYABLE_ERRORS):
+            future.set_exception(error)
+            return
+        if self.concurrency_limit is not None:
+            self.concurrency_limit.on_throttle(sent_at)
+        if retry_num >= self.policy.max_retries:
+            self.metrics.record_failure()
+            future.set_exception(error)
+            return
+        delay = self.policy.get_backoff_time(retry_num)
+        self.metrics.record_retry(error, delay)
+        self.session.cluster.connection_class.create_timer(
+            delay,
+            lambda: self.session.submit(
+                self._attempt, future, statement, paging_state, retry_num + 1
+            ),
+        )
+
+
 class ExponentialBackOffRetryPolicy(RetryPolicy):
+    """Backoff settings of the coordinator's queries. The driver calls retry
+    policies on its event loop thread, so waiting there would stall every
+    other request; timeouts and unavailable errors are therefore rethrown
+    at once and retried after get_backoff_time by RetryingExecutor."""
+
     def __init__(self, base_delay=0.1, max_delay=10, max_retries=10):
         self.base_delay = base_delay  # seconds
         self.max_delay = max_delay  # seconds
@@ -281,10 +666,7 @@ class ExponentialBackOffRetryPolicy(RetryPolicy):
         data_retrieved,
         retry_num,
     ):
-        if retry_num >= self.max_retries:
-            return (self.RETHROW, None)
-        time.sleep(self.get_backoff_time(retry_num))
-        return (self.RETRY, consistency)
+        return (self.RETHROW, None)
 
     def on_write_timeout(
         self,
@@ -295,18 +677,12 @@ class ExponentialBackOffRetryPolicy(RetryPolicy):
         received_responses,
         retry_num,
     ):
-        if retry_num >= self.max_retries:
-            return (self.RETHROW, None)
-        time.sleep(self.get_backoff_time(retry_num))
-        return (self.RETRY, consistency)
+        return (self.RETHROW, None)
 
     def on_unavailable(
         self, query, consistency, required_replica, alive_replica, retry_num
     ):
-        if retry_num >= self.max_retries:
-            return (self.RETHROW, None)
-        time.sleep(self.get_backoff_time(retry_num))
-        return (self.RETRY_NEXT_HOST, None)
+        return (self.RETHROW, None)
 
 
 class ShardCalculator:
@@ -315,33 +691,123 @@ class ShardCalculator:
         return (3600 * hour + 60 * minute + second) // 144
 
     @classmethod
-    def calculate_shards_in_range(cls, start_time, end_time):
-        shards = set()
-        current_time = start_time
+    def partitions_in_range(cls, start_time, end_time):
+        """List the (submitted_at_date, shard) partitions which may hold
+        submissions between start_time and end_time. Unlike the IN query, only
+        the shards covered on each date are listed."""
+        last_shard = cls.calculate_shard(23, 59, 59)
+        partitions = []
+        for date in AWSKeyspacesClient.get_submitted_at_date_list(
+            start_time, end_time
+        ):
+            first = (
+                cls.calculate_shard(start_time.hour, start_time.minute, start_time.second)
+                if date == start_time.strftime("%Y-%m-%d")
+                else 0
+            )
+            last = (
+                cls.calculate_shard(end_time.hour, end_time.minute, end_time.second)
+                if date == end_time.strftime("%Y-%m-%d")
+                else last_shard
+            )
+            partitions.extend((date, shard) for shard in range(first, last + 1))
+        return partitions
+
+    @classmethod
+    def partition_span(cls, submitted_at_date, shard):
+        "Return the (start, end) UTC times of the submissions of a partition."
+        day = datetime.strptime(submitted_at_date, "%Y-%m-%d").replace(
+            tzinfo=timezone.utc
+        )
+        shard_seconds = 24 * 3600 // (cls.calculate_shard(23, 59, 59) + 1)
+        return (
+            day + timedelta(seconds=shard * shard_seconds),
+            day + timedelta(seconds=(shard + 1) * shard_seconds),
+        )
 
-        while current_time < end_time:
-            shard = cls.calculate_shard(
-                current_time.hour, current_time.minute, current_time.second
+    @classmethod
+    def on_shard_boundary(cls, time):
+        "Check if a time is the start of a shard."
+        seconds = 3600 * time.hour + 60 * time.minute + time.second
+        return time.microsecond == 0 and seconds % 144 == 0
+
+    @classmethod
+    def nearest_shard_boundary(cls, time):
+        "Return the start of a shard nearest to a time; midnight is one of them."
+        midnight = time.replace(hour=0, minute=0, second=0, microsecond=0)
+        seconds = (time - midnight).total_seconds()
+        return midnight + timedelta(seconds=round(seconds / 144) * 144)
+
+    @classmethod
+    def align_intervals(cls, time_intervals):
+        """Move the inner boundaries of consecutive time intervals to the
+        nearest shard boundaries, so that the intervals span disjoint
+        (submitted_at_date, shard) partitions. The inner boundary nearest to
+        a midnight is moved to it, so that intervals do not span two dates
+        either. The outer boundaries are kept and intervals left empty are
+        dropped."""
+        if not time_intervals:
+            return []
+        start_time = time_intervals[0][0]
+        end_time = time_intervals[-1][1]
+        bounds = [start_time]
+        for _, boundary in time_intervals[:-1]:
+            aligned = cls.nearest_shard_boundary(boundary)
+            bounds.append(min(max(aligned, bounds[-1]), end_time))
+        bounds.append(end_time)
+        midnight = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        while len(bounds) > 2:
+            midnight += timedelta(days=1)
+            if midnight >= end_time:
+                break
+            # the boundaries around the nearest one are on both sides of midnight
+            nearest = min(
+                range(1, len(bounds) - 1), key=lambda i: abs(bounds[i] - midnight)
             )
-            shards.add(shard)
-            # Move to the next second
-            current_time += timedelta(seconds=1)
+            bounds[nearest] = midnight
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
 
-        # Check if endTime falls exactly on a new shard boundary and add it if necessary
-        end_shard = cls.calculate_shard(end_time.hour, end_time.minute, end_time.second)
-        if end_shard not in shards:
-            # Check if end_time is exactly on the boundary of a new shard
-            total_seconds_end = (
-                (end_time.hour * 3600) + (end_time.minute * 60) + end_time.second
+    @classmethod
+    def shards_in_range(cls, start_time, end_time):
+        """List the shards of the seconds start_time + k (k = 0, 1, ...) before
+        end_time, plus the shard of end_time when it falls exactly on a shard
+        boundary. Computed in closed form rather than second by second."""
+        day_seconds = 24 * 3600
+        shard_count = cls.calculate_shard(23, 59, 59) + 1
+        delta = end_time - start_time
+        delta_microseconds = (
+            delta.days * day_seconds + delta.seconds
+        ) * 1_000_000 + delta.microseconds
+        # number of whole-second steps from start_time before reaching end_time
+        steps = max(0, -(-delta_microseconds // 1_000_000))
+
+        shards = set()
+        if steps >= day_seconds:
+            shards.update(range(shard_count))
+        elif steps > 0:
+            first_second = (
+                3600 * start_time.hour + 60 * start_time.minute + start_time.second
             )
-            if total_seconds_end % 144 == 0:
-                shards.add(end_shard)
+            last_second = first_second + steps - 1
+            if last_second < day_seconds:
+                shards.update(range(first_second // 144, last_second // 144 + 1))
+            else:
+                shards.update(range(first_second // 144, shard_count))
+                shards.update(range((last_second - day_seconds) // 144 + 1))
+
+        # Check if endTime falls exactly on a new shard boundary and add it if necessary
+        total_seconds_end = (
+            (end_time.hour * 3600) + (end_time.minute * 60) + end_time.second
+        )
+        if total_seconds_end % 144 == 0:
+            shards.add(total_seconds_end // 144)
+
+        return sorted(shards)
 
-        # Convert the set of unique shards into a sorted list for readability
-        shards_list = sorted(list(shards))
+    @classmethod
+    def calculate_shards_in_range(cls, start_time, end_time):
         # Format the shards into a CQL statement string
-        shards_list = sorted(list(shards))  # Sort the shards for readability
-        shards_str = ",".join(map(str, shards_list))
+        shards_str = ",".join(map(str, cls.shards_in_range(start_time, end_time)))
         cql_statement = f"shard in ({shards_str})"
         return cql_statement
 
@@ -0,0 +1,95 @@
+"""A compact directed graph of statehashes used to score a batch. Nodes are
+identified by consecutive integers assigned in insertion order and edges are
+kept in per-node adjacency lists, so that the breadth-first search over the
+chain is linear in the size of the graph."""
+
+from collections import deque
+
+# Weight of statehashes which are not (yet) known to belong to the chain.
+UNREACHED_WEIGHT = 9999
+
+
+class ChainGraph:
+    """Directed graph of parent-child relations between statehashes. Each
+    node carries a weight: the distance from the closest statehash known to
+    belong to the chain."""
+
+    def __init__(self):
+        self.index = {}
+        self.nodes = []
+        self.successors = []
+        self.predecessors = []
+        self.weights = []
+        self._edges = set()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add_node(self, state_hash):
+        "Add a statehash to the graph unless present. Return its id."
+        node_id = self.index.get(state_hash)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.index[state_hash] = node_id
+            self.nodes.append(state_hash)
+            self.successors.append([])
+            self.predecessors.append([])
+            self.weights.append(UNREACHED_WEIGHT)
+        return node_id
+
+    def add_edge(self, parent, child):
+        "Add a parent-child relation, adding missing nodes as necessary."
+        parent_id = self.add_node(parent)
+        child_id = self.add_node(child)
+        if (parent_id, child_id) not in self._edges:
+            self._edges.add((parent_id, child_id))
+            self.successors[parent_id].append(child_id)
+            self.predecessors[child_id].append(parent_id)
+
+    @property
+    def edges(self):
+        "Return parent-child pairs of statehashes."
+        return [
+            (self.nodes[parent_id], self.nodes[child_id])
+            for parent_id, children in enumerate(self.successors)
+            for child_id in children
+        ]
+
+    def weight(self, state_hash):
+        "Return the weight of a statehash."
+        return self.weights[self.index[state_hash]]
+
+    def minimum_weight(self, node_id):
+        """Return the weight of a node lowered, if possible, by one step from
+        any of its parents."""
+        weights = self.weights
+        weight = weights[node_id]
+        for parent_id in self.predecessors[node_id]:
+            weight = min(weights[parent_id] + 1, weight)
+        return weight
+
+    def bfs(self, sources, start):
+        """Run a multi-source breadth-first search from the given node ids,
+        updating weights of the visited nodes. Only the start node is marked
+        visited up front, so other sources may be reached (and re-weighted)
+        again from their parents."""
+        visited = bytearray(len(self.nodes))
+        visited[start] = 1
+        queue = deque(sources)
+        while queue:
+            node_id = queue.popleft()
+            for child_id in self.successors[node_id]:
+                if not visited[child_id]:
+                    self.weights[child_id] = self.minimum_weight(child_id)
+                    visited[child_id] = 1
+                    queue.append(child_id)
+
+    def to_networkx(self):
+        "Convert to a networkx graph, e.g. for plotting."
+        import networkx as nx
+
+        graph = nx.DiGraph()
+        for state_hash, weight in zip(self.nodes, self.weights):
+            graph.add_node(state_hash, weight=weight)
+        graph.add_edges_from(self.edges)
+        return graph
@@ -10,7 +10,28 @@ class Config:
     RETRY_COUNT = int(os.environ.get("RETRY_COUNT", "3"))
     SURVEY_INTERVAL_MINUTES = int(os.environ.get("SURVEY_INTERVAL_MINUTES", "20"))
     MINI_BATCH_NUMBER = int(os.environ.get("MINI_BATCH_NUMBER", "5"))
+    # How a batch is split into mini-batches: equal time slices, or slices
+    # holding about the same number of submissions
+    MINI_BATCH_SPLIT_TIME = "TIME"
+    MINI_BATCH_SPLIT_COUNT = "COUNT"
+    VALID_MINI_BATCH_SPLITS = [MINI_BATCH_SPLIT_TIME, MINI_BATCH_SPLIT_COUNT]
+    MINI_BATCH_SPLIT = os.getenv("MINI_BATCH_SPLIT", MINI_BATCH_SPLIT_TIME).upper()
+    SUBMISSIONS_PER_MINI_BATCH = int(
+        os.environ.get("SUBMISSIONS_PER_MINI_BATCH", "1000")
+    )
+    HISTOGRAM_BUCKET_SECONDS = int(os.environ.get("HISTOGRAM_BUCKET_SECONDS", "10"))
+    # Whether the boundaries between mini-batches are moved to the nearest
+    # Cassandra shard boundaries
+    MINI_BATCH_ALIGN_NONE = "NONE"
+    MINI_BATCH_ALIGN_SHARD = "SHARD"
+    VALID_MINI_BATCH_ALIGNS = [MINI_BATCH_ALIGN_NONE, MINI_BATCH_ALIGN_SHARD]
+    MINI_BATCH_ALIGN = os.getenv("MINI_BATCH_ALIGN", MINI_BATCH_ALIGN_NONE).upper()
     UPTIME_DAYS_FOR_SCORE = int(os.environ.get("UPTIME_DAYS_FOR_SCORE", "90"))
+    STATE_HASH_THRESHOLD = float(os.environ.get("STATE_HASH_THRESHOLD", "0.05"))
+    # Batches whose windows are over are processed together, up to this many
+    # at a time, with CATCHUP_JOB_NUMBER validator jobs; 1 disables catching up
+    CATCHUP_MAX_BATCHES = int(os.environ.get("CATCHUP_MAX_BATCHES", "1"))
+    CATCHUP_JOB_NUMBER = int(os.environ.get("CATCHUP_JOB_NUMBER", "20"))
 
     # Stateless Verifier
     WORKER_IMAGE = os.environ.get("WORKER_IMAGE")
@@ -20,6 +41,39 @@ class Config:
     AWS_S3_BUCKET = os.environ.get("AWS_S3_BUCKET")
     AWS_REGION = os.environ.get("AWS_REGION")
 
+    # How the stateless verifier is run; by default on Kubernetes, or as set
+    # by WORKER_POOL and TEST_ENV
+    EXECUTOR_KUBERNETES = "KUBERNETES"
+    EXECUTOR_DOCKER = "DOCKER"
+    EXECUTOR_SUBPROCESS = "SUBPROCESS"
+    EXECUTOR_QUEUE = "QUEUE"
+    EXECUTOR_FAKE = "FAKE"
+    VALID_VALIDATOR_EXECUTORS = [
+        EXECUTOR_KUBERNETES,
+        EXECUTOR_DOCKER,
+        EXECUTOR_SUBPROCESS,
+        EXECUTOR_QUEUE,
+        EXECUTOR_FAKE,
+    ]
+    VALIDATOR_EXECUTOR = os.environ.get("VALIDATOR_EXECUTOR", "").upper()
+    # Command run per mini-batch by the SUBPROCESS executor
+    VALIDATOR_COMMAND = os.environ.get(
+        "VALIDATOR_COMMAND", "/bin/entrypoint/entrypoint-worker.sh"
+    )
+    # Fraction of block producers reporting fork blocks with the FAKE executor
+    FAKE_FORK_RATE = float(os.environ.get("FAKE_FORK_RATE", "0.05"))
+    # Number of local validator processes run at a time (DOCKER, SUBPROCESS);
+    # 0 means one per CPU
+    LOCAL_VALIDATOR_CONCURRENCY = int(os.environ.get("LOCAL_VALIDATOR_CONCURRENCY", "0"))
+
+    # Validator worker pool
+    WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", "0"))
+    WORKER_POOL_COMMAND = os.environ.get(
+        "WORKER_POOL_COMMAND", "/bin/entrypoint/entrypoint-worker.sh"
+    )
+    WORKER_POOL_LEASE_SECONDS = int(os.environ.get("WORKER_POOL_LEASE_SECONDS", "1800"))
+    WORKER_POOL_POLL_SECONDS = int(os.environ.get("WORKER_POOL_POLL_SECONDS", "5"))
+
     # Slack Alerts
     WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
     ALARM_ZK_LOWER_LIMIT_SEC = os.environ.get("ALARM_ZK_LOWER_LIMIT_SEC")
@@ -30,6 +84,39 @@ class Config:
     STORAGE_POSTGRES = "POSTGRES"
     VALID_STORAGE_OPTIONS = [STORAGE_CASSANDRA, STORAGE_POSTGRES]
     SUBMISSION_STORAGE = os.getenv("SUBMISSION_STORAGE", STORAGE_POSTGRES).upper()
+    # Number of submissions fetched per round trip when loading submissions
+    SUBMISSION_FETCH_SIZE = int(os.environ.get("SUBMISSION_FETCH_SIZE", 5000))
+    # How submissions are queried from Cassandra: a single IN query over dates
+    # and shards per mini-batch, or one query per (date, shard) partition
+    CASSANDRA_QUERY_IN = "IN"
+    CASSANDRA_QUERY_PARTITION = "PARTITION"
+    VALID_CASSANDRA_QUERY_MODES = [CASSANDRA_QUERY_IN, CASSANDRA_QUERY_PARTITION]
+    CASSANDRA_QUERY_MODE = os.getenv("CASSANDRA_QUERY_MODE", CASSANDRA_QUERY_IN).upper()
+    CASSANDRA_MAX_IN_FLIGHT = int(os.environ.get("CASSANDRA_MAX_IN_FLIGHT", 32))
+    # Bounds and latency target of the adaptive concurrency of partition reads
+    CASSANDRA_MIN_IN_FLIGHT = int(os.environ.get("CASSANDRA_MIN_IN_FLIGHT", 2))
+    CASSANDRA_LATENCY_TARGET_MS = int(
+        os.environ.get("CASSANDRA_LATENCY_TARGET_MS", 1000)
+    )
+
+    # Scoreboard
+    SCOREBOARD_FULL = "FULL"
+    SCOREBOARD_INCREMENTAL = "INCREMENTAL"
+    SCOREBOARD_VERIFY = "VERIFY"
+    VALID_SCOREBOARD_MODES = [SCOREBOARD_FULL, SCOREBOARD_INCREMENTAL, SCOREBOARD_VERIFY]
+    SCOREBOARD_MODE = os.getenv("SCOREBOARD_MODE", SCOREBOARD_FULL).upper()
+    SCORE_HISTORY_ALL = "ALL"
+    SCORE_HISTORY_CHANGES = "CHANGES"
+    VALID_SCORE_HISTORY_MODES = [SCORE_HISTORY_ALL, SCORE_HISTORY_CHANGES]
+    SCORE_HISTORY_MODE = os.getenv("SCORE_HISTORY_MODE", SCORE_HISTORY_ALL).upper()
+
+    # Bulk writes
+    BULK_WRITE_TABLE_OPTIONS = ["points", "bot_logs_statehash", "submissions"]
+    BULK_WRITE_TABLES = [
+        table.strip().lower()
+        for table in os.environ.get("BULK_WRITE_TABLES", "").split(",")
+        if table.strip()
+    ]
 
     # Postgres
     POSTGRES_HOST = os.environ["POSTGRES_HOST"]
@@ -38,6 +125,18 @@ class Config:
     POSTGRES_PASSWORD = os.environ["POSTGRES_PASSWORD"]
     POSTGRES_PORT = os.environ["POSTGRES_PORT"]
     POSTGRES_SSLMODE = os.environ.get("POSTGRES_SSLMODE", "require")
+    POSTGRES_POOL_SIZE = int(os.environ.get("POSTGRES_POOL_SIZE", "4"))
+    POSTGRES_STATEMENT_TIMEOUT_MS = int(
+        os.environ.get("POSTGRES_STATEMENT_TIMEOUT_MS", "0")
+    )
+    POSTGRES_KEEPALIVES_IDLE = int(os.environ.get("POSTGRES_KEEPALIVES_IDLE", "30"))
+    # libpq connection string of a read replica for read-only queries
+    POSTGRES_REPLICA_DSN = os.environ.get("POSTGRES_REPLICA_DSN")
+    # Longest time to wait for the replica to catch up with the primary
+    # before a read falls back to the primary
+    POSTGRES_REPLICA_WAIT_SECONDS = float(
+        os.environ.get("POSTGRES_REPLICA_WAIT_SECONDS", "10")
+    )
 
     # Cassandra / Keyspaces
     AWS_KEYSPACE = os.environ.get("AWS_KEYSPACE")
@@ -54,6 +153,10 @@ class Config:
     AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
     AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
     SSL_CERTFILE = os.environ.get("SSL_CERTFILE")
+    # temporary credentials are refreshed this long before they expire
+    CREDENTIALS_REFRESH_MARGIN_SECONDS = int(
+        os.environ.get("CREDENTIALS_REFRESH_MARGIN_SECONDS", "300")
+    )
 
     # Application status
     IGNORE_APPLICATION_STATUS = os.environ.get("IGNORE_APPLICATION_STATUS")
@@ -85,6 +188,51 @@ class Config:
         """
         return bool_env_var_set("NO_CHECKS")
 
+    def worker_pool():
+        """
+        Checks if mini-batches should be verified by the validator worker pool
+        rather than by pods or local processes.
+
+        :return: True if WORKER_POOL is set.
+        """
+        return bool_env_var_set("WORKER_POOL")
+
+    def bulk_write(table):
+        """
+        Checks if rows should be written to the given table with COPY rather
+        than with batched INSERT statements.
+
+        :param table: The name of the table.
+        :return: True if the table is listed in BULK_WRITE_TABLES.
+        """
+        return table in Config.BULK_WRITE_TABLES
+
+    def cassandra_lz4_compression():
+        """
+        Checks if the connection to Cassandra should use LZ4 compression.
+
+        :return: True if the application should require LZ4 compression.
+        """
+        return bool_env_var_set("CASSANDRA_LZ4_COMPRESSION")
+
+    def cassandra_adaptive_concurrency():
+        """
+        Checks if the concurrency of Cassandra partition reads should adapt
+        to latencies and throttling.
+
+        :return: True if CASSANDRA_ADAPTIVE_CONCURRENCY is set.
+        """
+        return bool_env_var_set("CASSANDRA_ADAPTIVE_CONCURRENCY")
+
+    def pipeline_verification():
+        """
+        Checks if the next batch should be verified while the current one is
+        being scored.
+
+        :return: True if PIPELINE_VERIFICATION is set.
+        """
+        return bool_env_var_set("PIPELINE_VERIFICATION")
+
     def ignore_application_status():
         """
         Checks if the application should ignore the application status.
@@ -3,35 +3,40 @@ the validator processes, distribute work them and, when they're done,
 collect their results, compute scores for the delegation program and
 put the results in the database."""
 
-from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import partial
 import logging
 import os
 import sys
+import threading
 from time import sleep
 
 from dotenv import load_dotenv
 import pandas as pd
-import psycopg2
 from uptime_service_validation.coordinator.config import Config
 from uptime_service_validation.coordinator.helper import (
     DB,
+    Batch,
+    SubmissionColumns,
     Timer,
     get_relations,
-    find_new_values_to_insert,
     filter_state_hash_percentage,
     create_graph,
     apply_weights,
     bfs,
+    select_batch_state_hashes,
     send_slack_message,
     get_contact_details_from_spreadsheet,
 )
-from uptime_service_validation.coordinator.server import (
-    setUpValidatorPods,
-    setUpValidatorProcesses,
+from uptime_service_validation.coordinator.postgres_pool import PostgresPool
+from uptime_service_validation.coordinator.validator_executor import (
+    executor_name,
+    validator_executor,
 )
 from uptime_service_validation.coordinator.aws_keyspaces_client import (
     AWSKeyspacesClient,
+    ShardCalculator,
 )
 
 # Add project root to python path
@@ -39,6 +44,10 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..
 sys.path.insert(0, project_root)
 
 
+# Extra time waited after the end of a batch's time window before verifying it
+BATCH_END_DELAY = timedelta(minutes=2)
+
+
 class State:
     """The state aggregates all the data that remains constant while processing
     a single batch, but changes between batches. It also takes care of valid
@@ -56,8 +65,9 @@ class State:
     def wait_until_batch_ends(self):
         "If the time window if the current batch is not yet over, sleep until it is."
         if self.batch.end_time > self.current_timestamp:
-            delta = timedelta(minutes=2)
-            sleep_interval = (self.batch.end_time - self.current_timestamp) + delta
+            sleep_interval = (
+                self.batch.end_time - self.current_timestamp
+            ) + BATCH_END_DELAY
             time_until = self.current_timestamp + sleep_interval
             logging.info(
                 "All submissions are processed till date. "
@@ -68,6 +78,21 @@ class State:
             sleep(sleep_interval.total_seconds())
             self.__update_timestamp()
 
+    def lagging_batches(self, limit):
+        """Return the batches, starting with the current one, whose time
+        window is already over, at most limit of them. Only the time windows
+        of the batches following the current one are meaningful."""
+        self.__update_timestamp()
+        batches = []
+        batch = self.batch
+        while (
+            len(batches) < limit
+            and batch.end_time + BATCH_END_DELAY <= self.current_timestamp
+        ):
+            batches.append(batch)
+            batch = batch.next(batch.bot_log_id)
+        return batches
+
     def advance_to_next_batch(self, next_bot_log_id):
         """Update the state so that it describes the next batch in line;
         transitioning the state to the next loop pass."""
@@ -110,42 +135,84 @@ class State:
             )
 
 
-def load_submissions(time_intervals, db, submission_storage=Config.SUBMISSION_STORAGE):
+def read_cassandra_submissions(cassandra, time_intervals):
+    "Read the submissions of the mini-batch intervals from Cassandra."
+    submissions = SubmissionColumns()
+    if Config.CASSANDRA_QUERY_MODE == Config.CASSANDRA_QUERY_PARTITION:
+        for page in cassandra.stream_partitioned_submissions(
+            time_intervals, start_inclusive=True, end_inclusive=False
+        ):
+            submissions.extend(page)
+    else:
+        for time_interval in time_intervals:
+            for page in cassandra.stream_submissions(
+                submitted_at_start=time_interval[0],
+                submitted_at_end=time_interval[1],
+                start_inclusive=True,
+                end_inclusive=False,
+            ):
+                submissions.extend(page)
+    return submissions
+
+
+def load_submissions(
+    time_intervals,
+    db,
+    submission_storage=Config.SUBMISSION_STORAGE,
+    cassandra=None,
+):
     """
     Load submissions from Config.SUBMISSION_STORAGE:
      - return validated subs as a DataFrame for further processing.
-     - return all subs for storing in the submissions_by_submitter table.
+     - return all subs (SubmissionColumns) for storing in the submissions table.
+    Rows are streamed into column buffers and the DataFrame is built once.
+    A connected Cassandra client can be passed to be reused across batches;
+    it is reconnected and the read retried once if reading fails. Otherwise
+    a client is created for this call only.
     """
-    submissions = []
-    submissions_verified = []
+    submissions = SubmissionColumns()
 
+    if not time_intervals:
+        # no mini-batch, as there were no submissions to verify
+        return [pd.DataFrame([]), submissions]
     if submission_storage == Config.STORAGE_CASSANDRA:
-        cassandra = AWSKeyspacesClient()
+        shared_client = cassandra is not None
+        if not shared_client:
+            cassandra = AWSKeyspacesClient()
         try:
-            cassandra.connect()
-            for time_interval in time_intervals:
-                submissions.extend(
-                    cassandra.get_submissions(
-                        submitted_at_start=time_interval[0],
-                        submitted_at_end=time_interval[1],
-                        start_inclusive=True,
-                        end_inclusive=False,
-                    )
+            if not shared_client:
+                cassandra.connect()
+            try:
+                submissions = read_cassandra_submissions(cassandra, time_intervals)
+            except Exception as e:
+                if not shared_client:
+                    raise
+                logging.warning(
+                    "Error in loading submissions: %s. Reconnecting to Cassandra and retrying...",
+                    e,
+                )
+                cassandra.reconnect()
+                submissions = read_cassandra_submissions(cassandra, time_intervals)
+            logging.info(
+                "Cassandra query retries: %s", cassandra.retry_metrics.snapshot()
+            )
+            if cassandra.concurrency_limit is not None:
+                logging.info(
+                    "Cassandra read concurrency: %s",
+                    cassandra.concurrency_limit.snapshot(),
                 )
         except Exception as e:
             logging.error("Error in loading submissions: %s", e)
             return [pd.DataFrame([]), submissions]
         finally:
-            cassandra.close()
+            if not shared_client:
+                cassandra.close()
     elif submission_storage == Config.STORAGE_POSTGRES:
         start_date = time_intervals[0][0]
         end_date = time_intervals[-1][1]
         try:
-            submissions_result = db.get_submissions(start_date, end_date)
-            if submissions_result is None:
-                logging.error("Failed to load submissions from database.")
-                return [pd.DataFrame([]), submissions]
-            submissions.extend(submissions_result)
+            for rows in db.stream_submissions(start_date, end_date):
+                submissions.extend(rows)
         except Exception as e:
             logging.error("Error in loading submissions: %s", e)
             return [pd.DataFrame([]), submissions]
@@ -154,29 +221,22 @@ def load_submissions(time_intervals, db, submission_storage=Config.SUBMISSION_ST
 
     # for further processing
     # we use only submissions verified = True and validation_error = None or ""
-    for submission in submissions:
-        if submission.verified and (
-            submission.validation_error is None or submission.validation_error == ""
-        ):
-            submissions_verified.append(submission)
+    verified = submissions.verified_mask()
 
     all_submissions_count = len(submissions)
-    submissions_to_process_count = len(submissions_verified)
+    submissions_to_process_count = sum(verified)
     logging.info("number of all submissions: %s", all_submissions_count)
     logging.info("number of submissions to process: %s", submissions_to_process_count)
     if submissions_to_process_count < all_submissions_count:
         logging.warning(
             "some submissions were not processed, because they were not verified or had validation errors"
         )
-    return [
-        pd.DataFrame([asdict(submission) for submission in submissions_verified]),
-        submissions,
-    ]
+    return [submissions.to_dataframe(verified), submissions]
 
 
-def process_statehash_df(db, batch, state_hash_df, verification_time):
-    """Process the state hash dataframe and return the master dataframe."""
-    all_files_count = state_hash_df.shape[0]
+def master_dataframe(state_hash_df):
+    """Build the dataframe scored by the coordinator from the dataframe of
+    verified submissions."""
     master_df = pd.DataFrame()
     master_df["state_hash"] = state_hash_df["state_hash"]
     master_df["blockchain_height"] = state_hash_df["height"]
@@ -192,32 +252,6 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
     master_df["blockchain_epoch"] = state_hash_df["created_at"].apply(
         lambda row: int(row.timestamp() * 1000)
     )
-
-    state_hash = pd.unique(
-        master_df[["state_hash", "parent_state_hash"]].values.ravel("k")
-    )
-    existing_state_df = db.get_statehash_df()
-    existing_nodes = db.get_existing_nodes()
-    logging.info("number of nodes in the previous batch: %s", len(existing_nodes))
-    state_hash_to_insert = find_new_values_to_insert(
-        existing_state_df, pd.DataFrame(state_hash, columns=["statehash"])
-    )
-    logging.info("number of statehashes to insert: %s", len(state_hash_to_insert))
-    if not state_hash_to_insert.empty:
-        db.create_statehash(state_hash_to_insert)
-
-    nodes_in_cur_batch = pd.DataFrame(
-        master_df["submitter"].unique(), columns=["block_producer_key"]
-    )
-    logging.info("number of nodes in the current batch: %s", len(nodes_in_cur_batch))
-
-    node_to_insert = find_new_values_to_insert(existing_nodes, nodes_in_cur_batch)
-    logging.info("number of nodes to insert: %s", len(node_to_insert))
-
-    if not node_to_insert.empty:
-        node_to_insert["updated_at"] = datetime.now(timezone.utc)
-        db.create_node_record(node_to_insert, 100)
-
     master_df.rename(
         inplace=True,
         columns={
@@ -225,11 +259,31 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
             "submitter": "block_producer_key",
         },
     )
+    return master_df
+
+
+def process_statehash_df(db, batch, state_hash_df, verification_time):
+    """Process the state hash dataframe and return the master dataframe."""
+    all_files_count = state_hash_df.shape[0]
+    master_df = master_dataframe(state_hash_df)
+
+    state_hash = pd.unique(
+        master_df[["state_hash", "parent_state_hash"]].values.ravel("k")
+    )
+    statehash_ids = db.statehashes.ids_for(state_hash)
+    logging.info("number of known statehashes: %s", len(db.statehashes))
+
+    nodes_in_cur_batch = master_df["block_producer_key"].unique()
+    logging.info("number of nodes in the current batch: %s", len(nodes_in_cur_batch))
+    node_ids = db.nodes.ids_for(nodes_in_cur_batch)
+    logging.info("number of known nodes: %s", len(db.nodes))
 
     relation_df, p_selected_node_df = db.get_previous_statehash(batch.bot_log_id)
 
     p_map = list(get_relations(relation_df))
-    c_selected_node = filter_state_hash_percentage(master_df)
+    c_selected_node = filter_state_hash_percentage(
+        master_df, Config.STATE_HASH_THRESHOLD
+    )
 
     logging.info("creating graph for the current batch...")
     batch_graph = create_graph(master_df, p_selected_node_df, c_selected_node, p_map)
@@ -244,34 +298,21 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
     logging.info("weights applied successfully.")
 
     queue_list = list(p_selected_node_df["state_hash"].values) + c_selected_node
-    batch_state_hash = list(master_df["state_hash"].unique())
 
     logging.info("running BFS on the graph...")
     shortlisted_state_hash_df = bfs(
         graph=weighted_graph,
         queue_list=queue_list,
         node=queue_list[0],
-        # batch_statehash=batch_state_hash, (this used to be here in old code,
-        # but it's not used anywhere inside the function)
     )
     logging.info("BFS completed successfully.")
     point_record_df = master_df[
         master_df["state_hash"].isin(shortlisted_state_hash_df["state_hash"].values)
     ]
-
-    for index, row in shortlisted_state_hash_df.iterrows():
-        if not row["state_hash"] in batch_state_hash:
-            shortlisted_state_hash_df.drop(index, inplace=True, axis=0)
-    p_selected_node_df = shortlisted_state_hash_df.copy()
-    parent_hash = []
-    for s in shortlisted_state_hash_df["state_hash"].values:
-        p_hash = master_df[master_df["state_hash"] == s]["parent_state_hash"].values[0]
-        parent_hash.append(p_hash)
-    shortlisted_state_hash_df["parent_state_hash"] = parent_hash
-
-    p_map = list(
-        get_relations(shortlisted_state_hash_df[["parent_state_hash", "state_hash"]])
+    shortlisted_state_hash_df = select_batch_state_hashes(
+        master_df, shortlisted_state_hash_df
     )
+
     if not point_record_df.empty:
         file_timestamp = master_df.iloc[-1]["file_timestamps"]
     else:
@@ -291,6 +332,12 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
     )
     bot_log_id = db.create_bot_log(values)
 
+    shortlisted_state_hash_df["statehash_id"] = shortlisted_state_hash_df[
+        "state_hash"
+    ].map(statehash_ids)
+    shortlisted_state_hash_df["parent_statehash_id"] = shortlisted_state_hash_df[
+        "parent_state_hash"
+    ].map(statehash_ids)
     shortlisted_state_hash_df["bot_log_id"] = bot_log_id
     db.insert_statehash_results(shortlisted_state_hash_df)
 
@@ -299,27 +346,247 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
         point_record_df.loc[:, "amount"] = 1
         point_record_df.loc[:, "created_at"] = datetime.now(timezone.utc)
         point_record_df.loc[:, "bot_log_id"] = bot_log_id
+        point_record_df.loc[:, "node_id"] = point_record_df["block_producer_key"].map(
+            node_ids
+        )
+        point_record_df.loc[:, "statehash_id"] = point_record_df["state_hash"].map(
+            statehash_ids
+        )
         point_record_df = point_record_df[
             [
                 "file_name",
                 "file_timestamps",
                 "blockchain_epoch",
-                "block_producer_key",
+                "node_id",
                 "blockchain_height",
                 "amount",
                 "created_at",
                 "bot_log_id",
-                "state_hash",
+                "statehash_id",
             ]
         ]
         db.create_point_record(point_record_df)
     return bot_log_id
 
 
-def process(db, state):
+def submission_histogram(start_time, end_time, db=None, cassandra=None):
+    """Read the histogram of the submission counts of a time window from the
+    submission storage, or return None if it is not available."""
+    if Config.SUBMISSION_STORAGE == Config.STORAGE_CASSANDRA:
+        if cassandra is None:
+            return None
+        return cassandra.submission_histogram(start_time, end_time)
+    if db is None:
+        return None
+    return db.submission_histogram(
+        start_time, end_time, timedelta(seconds=Config.HISTOGRAM_BUCKET_SECONDS)
+    )
+
+
+def split_batch(batch, parts_number, db=None, cassandra=None):
+    """Split the time window of a batch into at most parts_number mini-batches,
+    aligning their boundaries to shard boundaries with MINI_BATCH_ALIGN=SHARD,
+    so that no two mini-batches read the same Cassandra partition."""
+    time_intervals = split_batch_window(batch, parts_number, db, cassandra)
+    if Config.MINI_BATCH_ALIGN == Config.MINI_BATCH_ALIGN_SHARD:
+        time_intervals = ShardCalculator.align_intervals(time_intervals)
+    return time_intervals
+
+
+def split_batch_window(batch, parts_number, db=None, cassandra=None):
+    """Split the time window of a batch into at most parts_number mini-batches.
+    With MINI_BATCH_SPLIT=COUNT the boundaries are cut at the quantiles of the
+    submission counts, and the number of mini-batches depends on the total,
+    an empty window getting none. Equal time slices are used otherwise, or if
+    the submission counts can't be read."""
+    if Config.MINI_BATCH_SPLIT == Config.MINI_BATCH_SPLIT_COUNT:
+        try:
+            histogram = submission_histogram(
+                batch.start_time, batch.end_time, db, cassandra
+            )
+        except Exception as e:
+            logging.warning("Error in counting submissions: %s", e)
+            histogram = None
+        if histogram is not None:
+            time_intervals = batch.split_balanced(
+                histogram, Config.SUBMISSIONS_PER_MINI_BATCH, parts_number
+            )
+            logging.info(
+                "%s submissions split into %s mini-batches.",
+                sum(count for _, count in histogram),
+                len(time_intervals),
+            )
+            return time_intervals
+    return list(batch.split(parts_number))
+
+
+def run_validators(time_intervals):
+    """Launch the validators on the given time intervals and wait until they
+    are done. Return the timer which measured the validation."""
+    timer = Timer()
+    if not time_intervals:
+        logging.info("no submissions to verify")
+        with timer.measure():
+            pass
+        return timer
+    with timer.measure():
+        validator_executor().run(time_intervals)
+    return timer
+
+
+def verify_batch(batch, db=None, cassandra=None):
+    """Launch the validators on the mini-batches of a batch and wait until
+    they are done. Return the mini-batch time intervals and the timer which
+    measured the validation."""
+    time_intervals = split_batch(batch, Config.MINI_BATCH_NUMBER, db, cassandra)
+    return time_intervals, run_validators(time_intervals)
+
+
+def verify_batch_apart(batch, db, cassandra=None):
+    """Verify a batch with a DB of its own, which the main thread does not
+    use, and end the read transaction it opened."""
+    try:
+        return verify_batch(batch, db, cassandra)
+    finally:
+        db.rollback()
+
+
+class VerificationPipeline:
+    """Verifies batches ahead of scoring them. While a batch is being scored
+    and committed in the main thread, the verification of the next batch is
+    started in a background thread as soon as its time window closes.
+    Scoring stays sequential, so bot logs are still created and chained in
+    batch order. Verifications run one at a time. verify must not share a
+    database connection with the main thread, see verify_batch_apart."""
+
+    def __init__(self, verify=verify_batch):
+        self.verify = verify
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="verification"
+        )
+        self.stopping = threading.Event()
+        # held while verifying, so that verifications never overlap
+        self.lock = threading.Lock()
+        # (start_time, end_time) of prefetched batches -> Future of their verification
+        self.pending = {}
+
+    def prefetch(self, batch):
+        "Verify a batch in the background once its time window is over."
+        window = (batch.start_time, batch.end_time)
+        if window not in self.pending:
+            logging.info("verification of the next batch scheduled: %s - %s", *window)
+            self.pending[window] = self.executor.submit(self._wait_and_verify, batch)
+
+    def verified(self, batch):
+        """Return the verification result of a batch, waiting for it if it
+        was prefetched. A batch which was not prefetched (e.g. when it is
+        retried), or whose prefetch failed, is verified in the calling thread
+        rather than behind the prefetch of the next batch."""
+        future = self.pending.pop((batch.start_time, batch.end_time), None)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as error:
+                logging.error(
+                    "ERROR verifying batch %s - %s ahead: %s, verifying it again.",
+                    batch.start_time,
+                    batch.end_time,
+                    error,
+                )
+        return self._verify(batch)
+
+    def prefetched(self, batch):
+        "Check if the verification of a batch was started ahead."
+        return (batch.start_time, batch.end_time) in self.pending
+
+    def close(self):
+        "Cancel prefetched verifications which have not started yet."
+        self.stopping.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _wait_and_verify(self, batch):
+        delay = batch.end_time + BATCH_END_DELAY - datetime.now(timezone.utc)
+        if delay.total_seconds() > 0 and self.stopping.wait(delay.total_seconds()):
+            return None
+        return self._verify(batch)
+
+    def _verify(self, batch):
+        with self.lock:
+            return self.verify(batch)
+
+
+def catch_up(db, state, batches, cassandra=None):
+    """Process several batches whose time windows are over at once, after
+    the coordinator fell behind. The validators are run a single time over
+    the windows of all the batches, with Config.CATCHUP_JOB_NUMBER jobs.
+    The batches are then scored one after another, each bot log referring to
+    the previous one, and the scoreboard is updated once at the end."""
+    first = batches[0]
+    span = Batch(first.start_time, first.bot_log_id, first.interval * len(batches))
+    logging.info(
+        "catching up with %s batches: %s - %s.",
+        len(batches),
+        span.start_time,
+        span.end_time,
+    )
+    timer = run_validators(split_batch(span, Config.CATCHUP_JOB_NUMBER, db, cassandra))
+    logging.info(
+        "ZKValidator results of %s batches read in %s.", len(batches), timer.duration
+    )
+    # every batch is accounted its share of the common validation time
+    verification_time = timer.duration / len(batches)
+
+    scored_till = None
+    submissions = []
+    for _ in batches:
+        time_intervals = list(state.batch.split(Config.MINI_BATCH_NUMBER))
+        state_hash_df, all_submissions = load_submissions(
+            time_intervals, db, Config.SUBMISSION_STORAGE, cassandra=cassandra
+        )
+        try:
+            if state_hash_df.empty:
+                values = (
+                    0,  # submissions processed
+                    state.batch.end_time,
+                    state.batch.start_time.timestamp(),
+                    state.batch.end_time.timestamp(),
+                    verification_time.total_seconds(),
+                )
+                bot_log_id = db.create_bot_log(values)
+            else:
+                bot_log_id = process_statehash_df(
+                    db, state.batch, state_hash_df, verification_time
+                )
+            db.connection.commit()
+        except Exception as error:
+            db.rollback()
+            logging.error("ERROR: %s", error)
+            state.retry_batch()
+            break
+        scored_till = state.batch.end_time
+        submissions.append(all_submissions)
+        state.advance_to_next_batch(bot_log_id)
+
+    if scored_till is None:
+        return
+    try:
+        db.update_scoreboard(scored_till, Config.UPTIME_DAYS_FOR_SCORE)
+        # we only copy submissions to Postgres if we're using Cassandra as the primary storage
+        if Config.SUBMISSION_STORAGE == Config.STORAGE_CASSANDRA:
+            for all_submissions in submissions:
+                db.insert_submissions(all_submissions)
+    except Exception as error:
+        db.connection.rollback()
+        logging.error("ERROR: %s", error)
+    else:
+        db.connection.commit()
+
+
+def process(db, state, cassandra=None, pipeline=None):
     """Perform a signle iteration of the coordinator loop, processing exactly
     one batch of submissions. Launch verifiers to process submissions, then
-    compute scores and store them in the database."""
+    compute scores and store them in the database. With a VerificationPipeline,
+    the next batch is verified while this one is being scored."""
     logging.info(
         "iteration start at: %s, cur_timestamp: %s",
         state.batch.start_time,
@@ -329,22 +596,23 @@ def process(db, state):
         "running for batch: %s - %s.", state.batch.start_time, state.batch.end_time
     )
 
+    if Config.CATCHUP_MAX_BATCHES > 1 and (
+        pipeline is None or not pipeline.prefetched(state.batch)
+    ):
+        batches = state.lagging_batches(Config.CATCHUP_MAX_BATCHES)
+        if len(batches) > 1:
+            catch_up(db, state, batches, cassandra)
+            return
+
     # sleep until batch ends, update the state accordingly, then continue.
     state.wait_until_batch_ends()
-    time_intervals = list(state.batch.split(Config.MINI_BATCH_NUMBER))
-
-    timer = Timer()
-    if Config.is_test_environment():
-        logging.info("running in test environment")
-        with timer.measure():
-            setUpValidatorProcesses(
-                time_intervals, logging, Config.WORKER_IMAGE, Config.WORKER_TAG
-            )
+    if pipeline is None:
+        time_intervals, timer = verify_batch(state.batch, db, cassandra)
     else:
-        with timer.measure():
-            setUpValidatorPods(
-                time_intervals, logging, Config.WORKER_IMAGE, Config.WORKER_TAG
-            )
+        time_intervals, timer = pipeline.verified(state.batch)
+        # the time window of the next batch does not depend on this batch's
+        # bot log id, so it can be verified while this one is being scored
+        pipeline.prefetch(state.batch.next(state.batch.bot_log_id))
 
     logging.info(
         "reading ZKValidator results from a db between the time range: %s - %s",
@@ -354,7 +622,7 @@ def process(db, state):
 
     logging.info("ZKValidator results read from a db in %s.", timer.duration)
     webhook_url = Config.WEBHOOK_URL
-    if webhook_url is not None:
+    if webhook_url is not None and time_intervals:
         if timer.duration < float(Config.ALARM_ZK_LOWER_LIMIT_SEC):
             send_slack_message(
                 webhook_url,
@@ -369,7 +637,7 @@ def process(db, state):
             )
 
     state_hash_df, all_submissions = load_submissions(
-        time_intervals, db, Config.SUBMISSION_STORAGE
+        time_intervals, db, Config.SUBMISSION_STORAGE, cassandra=cassandra
     )
     if not state_hash_df.empty:
         try:
@@ -378,7 +646,7 @@ def process(db, state):
             )
             db.connection.commit()
         except Exception as error:
-            db.connection.rollback()
+            db.rollback()
             logging.error("ERROR: %s", error)
             state.retry_batch()
             return
@@ -427,31 +695,100 @@ def main():
     else:
         logging.info("Using SUBMISSION_STORAGE: %s", Config.SUBMISSION_STORAGE)
 
-    connection = psycopg2.connect(
-        host=Config.POSTGRES_HOST,
-        port=Config.POSTGRES_PORT,
-        database=Config.POSTGRES_DB,
-        user=Config.POSTGRES_USER,
-        password=Config.POSTGRES_PASSWORD,
-    )
+    if Config.CASSANDRA_QUERY_MODE not in Config.VALID_CASSANDRA_QUERY_MODES:
+        raise ValueError(
+            f"Invalid Cassandra query mode: {Config.CASSANDRA_QUERY_MODE}. Valid options are {Config.VALID_CASSANDRA_QUERY_MODES}"
+        )
+    if Config.SUBMISSION_STORAGE == Config.STORAGE_CASSANDRA:
+        logging.info("Using CASSANDRA_QUERY_MODE: %s", Config.CASSANDRA_QUERY_MODE)
+
+    if Config.SCOREBOARD_MODE not in Config.VALID_SCOREBOARD_MODES:
+        raise ValueError(
+            f"Invalid scoreboard mode: {Config.SCOREBOARD_MODE}. Valid options are {Config.VALID_SCOREBOARD_MODES}"
+        )
+    logging.info("Using SCOREBOARD_MODE: %s", Config.SCOREBOARD_MODE)
+    if Config.SCORE_HISTORY_MODE not in Config.VALID_SCORE_HISTORY_MODES:
+        raise ValueError(
+            f"Invalid score history mode: {Config.SCORE_HISTORY_MODE}. Valid options are {Config.VALID_SCORE_HISTORY_MODES}"
+        )
+    logging.info("Using SCORE_HISTORY_MODE: %s", Config.SCORE_HISTORY_MODE)
+
+    invalid_tables = set(Config.BULK_WRITE_TABLES) - set(Config.BULK_WRITE_TABLE_OPTIONS)
+    if invalid_tables:
+        raise ValueError(
+            f"Invalid bulk write tables: {sorted(invalid_tables)}. Valid options are {Config.BULK_WRITE_TABLE_OPTIONS}"
+        )
+    if Config.BULK_WRITE_TABLES:
+        logging.info("Using COPY to write tables: %s", Config.BULK_WRITE_TABLES)
+
+    if Config.MINI_BATCH_SPLIT not in Config.VALID_MINI_BATCH_SPLITS:
+        raise ValueError(
+            f"Invalid mini-batch split: {Config.MINI_BATCH_SPLIT}. Valid options are {Config.VALID_MINI_BATCH_SPLITS}"
+        )
+    logging.info("Using MINI_BATCH_SPLIT: %s", Config.MINI_BATCH_SPLIT)
+    if Config.MINI_BATCH_ALIGN not in Config.VALID_MINI_BATCH_ALIGNS:
+        raise ValueError(
+            f"Invalid mini-batch alignment: {Config.MINI_BATCH_ALIGN}. Valid options are {Config.VALID_MINI_BATCH_ALIGNS}"
+        )
+    logging.info("Using MINI_BATCH_ALIGN: %s", Config.MINI_BATCH_ALIGN)
 
-    interval = Config.SURVEY_INTERVAL_MINUTES
-    db = DB(connection, logging)
-    batch = db.get_batch_timings(timedelta(minutes=interval))
+    if Config.VALIDATOR_EXECUTOR and (
+        Config.VALIDATOR_EXECUTOR not in Config.VALID_VALIDATOR_EXECUTORS
+    ):
+        raise ValueError(
+            f"Invalid validator executor: {Config.VALIDATOR_EXECUTOR}. Valid options are {Config.VALID_VALIDATOR_EXECUTORS}"
+        )
+    if (
+        executor_name() == Config.EXECUTOR_FAKE
+        and Config.SUBMISSION_STORAGE != Config.STORAGE_POSTGRES
+    ):
+        raise ValueError("The FAKE validator executor requires POSTGRES storage")
+    logging.info("Using VALIDATOR_EXECUTOR: %s", executor_name())
+
+    if Config.CATCHUP_MAX_BATCHES > 1:
+        logging.info(
+            "Catching up with up to %s lagging batches using %s jobs.",
+            Config.CATCHUP_MAX_BATCHES,
+            Config.CATCHUP_JOB_NUMBER,
+        )
+
+    pool = PostgresPool.primary()
+    db = DB(pool.getconn(), logging, pool=pool, read_pool=PostgresPool.replica())
+    batch = db.get_batch_timings(timedelta(minutes=Config.SURVEY_INTERVAL_MINUTES))
     state = State(batch)
-    while not state.stop:
-        if Config.ignore_application_status():
-            logging.info("Ignoring application status update.")
-        else:
-            try:
-                contact_details = get_contact_details_from_spreadsheet()
-                db.update_application_status(contact_details)
-            except Exception as error:
-                logging.error(
-                    "ERROR updating application status: %s", error, exc_info=True
-                )
 
-        process(db, state)
+    # one Cassandra session is kept for the life of the coordinator
+    cassandra = None
+    if Config.SUBMISSION_STORAGE == Config.STORAGE_CASSANDRA:
+        cassandra = AWSKeyspacesClient()
+        cassandra.connect()
+    pipeline = None
+    if Config.pipeline_verification():
+        logging.info("Verifying the next batch while scoring the current one.")
+        verification_db = DB(pool.getconn(), logging, pool=pool, read_pool=db.read_pool)
+        pipeline = VerificationPipeline(
+            partial(verify_batch_apart, db=verification_db, cassandra=cassandra)
+        )
+    try:
+        while not state.stop:
+            if Config.ignore_application_status():
+                logging.info("Ignoring application status update.")
+            else:
+                try:
+                    contact_details = get_contact_details_from_spreadsheet()
+                    db.update_application_status(contact_details)
+                except Exception as error:
+                    logging.error(
+                        "ERROR updating application status: %s", error, exc_info=True
+                    )
+
+            process(db, state, cassandra, pipeline)
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+            pool.putconn(verification_db.connection)
+        if cassandra is not None:
+            cassandra.close()
 
 
 if __name__ == "__main__":
@@ -1,25 +1,39 @@
 """This module contains various helper functions and classes for the
 coordinator."""
 
+from abc import ABC, abstractmethod
 from contextlib import contextmanager
+import csv
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+import io
+from itertools import compress
+import math
 import os
 from typing import ByteString, Optional, List
-import matplotlib.pyplot as plt
-import networkx as nx
 import pandas as pd
 import psycopg2
-from psycopg2 import extras
+from psycopg2 import extras, sql
 import requests
 from google.oauth2 import service_account
 import gspread
 import time
 import random
 
+from uptime_service_validation.coordinator.chain_graph import (
+    ChainGraph,
+    UNREACHED_WEIGHT,
+)
 from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.postgres_pool import (
+    current_lsn,
+    wait_for_replay,
+)
 
 ERROR = "Error: {0}"
+# Marker used for NULL values in CSV streamed with COPY, so that empty strings
+# can still be told apart from missing values.
+COPY_NULL = "\\N"
 
 
 @dataclass
@@ -44,6 +58,74 @@ class Submission:
     verified: Optional[bool] = None
 
 
+# Fields of the submissions read from the submission storage, in the order in
+# which they are selected.
+SUBMISSION_FIELDS = [
+    "submitted_at_date",
+    "submitted_at",
+    "submitter",
+    "created_at",
+    "block_hash",
+    "remote_addr",
+    "peer_id",
+    "graphql_control_port",
+    "built_with_commit_sha",
+    "state_hash",
+    "parent",
+    "height",
+    "slot",
+    "validation_error",
+    "verified",
+]
+
+
+class SubmissionColumns:
+    """Column-oriented buffer of submissions. Chunks of rows streamed from the
+    submission storage are appended to per-field lists and the DataFrame is
+    built once at the end, without creating a Submission object per row."""
+
+    def __init__(self, fields=SUBMISSION_FIELDS):
+        self.fields = list(fields)
+        self.columns = {field: [] for field in self.fields}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def extend(self, rows):
+        "Append a chunk of rows, each a sequence of values in field order."
+        if not rows:
+            return
+        for column, values in zip(self.columns.values(), zip(*rows)):
+            column.extend(values)
+        self.count += len(rows)
+
+    def rows(self, fields):
+        "Iterate over the rows as tuples of the given fields."
+        return zip(*(self.columns[field] for field in fields))
+
+    def verified_mask(self):
+        "Flag the submissions which are verified and have no validation error."
+        return [
+            bool(verified) and not validation_error
+            for verified, validation_error in zip(
+                self.columns["verified"], self.columns["validation_error"]
+            )
+        ]
+
+    def to_dataframe(self, mask=None):
+        """Build a DataFrame of the buffered submissions, optionally keeping
+        only those flagged in mask."""
+        if mask is None:
+            data = self.columns
+        else:
+            data = {
+                field: list(compress(column, mask))
+                for field, column in self.columns.items()
+            }
+        return pd.DataFrame(data, columns=self.fields)
+
+
 class Timer:
     "This is a simple context manager to measure execution time."
 
@@ -80,9 +162,11 @@ class Batch:
         return self.start_time + self.interval
 
     def next(self, bot_log_id):
-        "Return an object representing the next batch."
+        """Return an object representing the next batch. bot_log_id is the bot
+        log of this batch, from which the next one carries over the selected
+        statehashes."""
         return self.__class__(
-            start_time=self.end_time, interval=self.interval, bot_log_id=-bot_log_id
+            start_time=self.end_time, interval=self.interval, bot_log_id=bot_log_id
         )
 
     def split(self, parts_number):
@@ -93,14 +177,225 @@ class Batch:
             for i in range(parts_number)
         )
 
+    def split_balanced(self, histogram, submissions_per_part, max_parts):
+        """Split the batch time window into parts holding about the same
+        number of submissions. The histogram lists ((start, end), count)
+        buckets of the window in time order; submissions are assumed to be
+        spread evenly within a bucket. The number of parts is chosen from the
+        total count, at most max_parts, and an empty window has no parts."""
+        total = sum(count for _, count in histogram)
+        if total == 0:
+            return []
+        parts_number = max(1, min(max_parts, math.ceil(total / submissions_per_part)))
+        cuts = []
+        cumulative = 0
+        for (bucket_start, bucket_end), count in histogram:
+            # cut at every count quantile k * total / parts_number in this bucket
+            while (
+                len(cuts) < parts_number - 1
+                and count
+                and cumulative + count >= total * (len(cuts) + 1) / parts_number
+            ):
+                fraction = (total * (len(cuts) + 1) / parts_number - cumulative) / count
+                cuts.append(bucket_start + (bucket_end - bucket_start) * fraction)
+            cumulative += count
+        bounds = [self.start_time] + cuts + [self.end_time]
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+class IdRegistry(ABC):
+    """An in-process mapping of natural keys (statehash values, block producer
+    keys) to their database ids. It is loaded from the database once, on first
+    use, and then extended with every key inserted by the coordinator, so that
+    processing a batch never has to scan the underlying table nor look ids up
+    row by row. Subclasses define how keys are loaded and inserted."""
+
+    def __init__(self, db):
+        self.db = db
+        self.ids = None
+
+    def __len__(self):
+        return 0 if self.ids is None else len(self.ids)
+
+    @abstractmethod
+    def load(self):
+        "Return the mapping of all keys known to the database to their ids."
+
+    @abstractmethod
+    def insert(self, keys):
+        "Insert given keys into the database and return their ids."
+
+    def ids_for(self, keys):
+        """Return the mapping of given keys to their ids, inserting the ones
+        that are not known yet. Null keys are skipped."""
+        if self.ids is None:
+            self.ids = self.load()
+        keys = {key for key in keys if pd.notna(key)}
+        missing = [key for key in keys if key not in self.ids]
+        if missing:
+            self.ids.update(self.insert(sorted(missing)))
+        return {key: self.ids[key] for key in keys}
+
+    def invalidate(self):
+        """Forget the cached mapping; it is reloaded from the database on next
+        use. Must be called whenever a transaction inserting keys is rolled
+        back."""
+        self.ids = None
+
+
+class StatehashRegistry(IdRegistry):
+    "Maps statehash values to ids of the statehash table."
+
+    def load(self):
+        return self.db.get_statehash_ids()
+
+    def insert(self, keys):
+        return self.db.insert_statehashes(keys)
+
+
+class NodeRegistry(IdRegistry):
+    "Maps block producer keys to ids of the nodes table."
+
+    def load(self):
+        return self.db.get_node_ids()
+
+    def insert(self, keys):
+        return self.db.insert_nodes(keys, datetime.now(timezone.utc))
+
+
+# Scores of block producers computed from scratch over the scoring window,
+# i.e. the batches contained in the last uptime_days before score_till_time.
+SCORES_CTE = """with vars  (snapshot_date, start_date) as( values (%(score_till_time)s AT TIME ZONE 'UTC',
+                        (%(score_till_time)s - interval '%(uptime_days)s' day) AT TIME ZONE 'UTC')
+              )
+              , epochs as(
+                select extract('epoch' from snapshot_date) as end_epoch,
+                extract('epoch' from start_date) as start_epoch from vars
+              )
+              , b_logs as(
+                select (count(1) ) as surveys
+                from bot_logs b , epochs e
+                where b.batch_start_epoch >= start_epoch and  b.batch_end_epoch <= end_epoch and b.files_processed > -1
+              )
+              , scores as (
+                select p.node_id, count(p.bot_log_id) bp_points
+                from points_summary p join bot_logs b on p.bot_log_id =b.id, epochs
+                where b.batch_start_epoch >= start_epoch and b.batch_end_epoch <= end_epoch
+                group by 1
+              )
+              , final_scores as (
+                select node_id, bp_points,
+                surveys, trunc( ((bp_points::decimal*100) / surveys),2) as score_perc
+                from scores l join nodes n on l.node_id=n.id, b_logs t
+              ) """
+
+# Initialise the maintained scoring window from scratch.
+SEED_SCORE_WINDOW_SQL = """
+    delete from node_window_points;
+    insert into node_window_points (node_id, points)
+      select p.node_id, count(1)
+      from points_summary p join bot_logs b on p.bot_log_id = b.id
+      where b.batch_start_epoch >= %(start_epoch)s and b.batch_end_epoch <= %(end_epoch)s
+      group by 1;
+    insert into score_window (start_epoch, end_epoch, surveys)
+      select %(start_epoch)s, %(end_epoch)s, count(1) from bot_logs b
+      where b.batch_start_epoch >= %(start_epoch)s and b.batch_end_epoch <= %(end_epoch)s
+        and b.files_processed > -1
+    on conflict (id) do update set start_epoch = excluded.start_epoch,
+      end_epoch = excluded.end_epoch, surveys = excluded.surveys """
+
+# Move the maintained scoring window: count batches which entered the window
+# and discount the ones which left it since the previous update.
+SLIDE_SCORE_WINDOW_SQL = """
+    with changed as (
+      select id, files_processed, 1 as sign from bot_logs
+      where batch_start_epoch >= %(start_epoch)s and batch_end_epoch <= %(end_epoch)s
+        and (batch_end_epoch > %(previous_end_epoch)s or batch_start_epoch < %(previous_start_epoch)s)
+      union all
+      select id, files_processed, -1 as sign from bot_logs
+      where batch_start_epoch >= %(previous_start_epoch)s and batch_end_epoch <= %(previous_end_epoch)s
+        and (batch_end_epoch > %(end_epoch)s or batch_start_epoch < %(start_epoch)s)
+    )
+    , window_update as (
+      update score_window set start_epoch = %(start_epoch)s, end_epoch = %(end_epoch)s,
+        surveys = surveys + (select coalesce(sum(sign), 0) from changed where files_processed > -1)
+    )
+    insert into node_window_points (node_id, points)
+      select p.node_id, sum(c.sign)
+      from points_summary p join changed c on p.bot_log_id = c.id
+      group by 1
+    on conflict (node_id) do update set points = node_window_points.points + excluded.points """
+
+# Update scores of nodes from the maintained scoring window. Like the full
+# computation, nodes without points in the window are left untouched.
+UPDATE_SCORES_FROM_WINDOW_SQL = """
+    with final_scores as (
+      select w.node_id, w.points as bp_points,
+        trunc( ((w.points::decimal*100) / s.surveys),2) as score_perc
+      from node_window_points w, score_window s
+      where w.points > 0
+    )
+    update nodes nrt set score = s.bp_points, score_percent=s.score_perc
+    from final_scores s where nrt.id=s.node_id
+      and (nrt.score, nrt.score_percent) is distinct from (s.bp_points, s.score_perc) """
+
 
 class DB:
     """A wrapper around the database connection, providing high-level methods
     for querying and updating the database."""
 
-    def __init__(self, connection, logger):
-        self.connection = connection
+    def __init__(self, connection, logger, pool=None, read_pool=None):
+        self._connection = connection
         self.logger = logger
+        # PostgresPool the connection comes from, used to replace it when lost
+        self.pool = pool
+        # optional PostgresPool of a read replica, see read_connection
+        self.read_pool = read_pool
+        self.statehashes = StatehashRegistry(self)
+        self.nodes = NodeRegistry(self)
+
+    @property
+    def connection(self):
+        """The connection to the primary database. If it was closed, e.g.
+        by the server, and a pool is set, it is replaced by a new one."""
+        if self._connection.closed and self.pool is not None:
+            self.logger.warning("Database connection lost, reconnecting...")
+            self.pool.putconn(self._connection, close=True)
+            self._connection = self.pool.getconn()
+            self.statehashes.invalidate()
+            self.nodes.invalidate()
+        return self._connection
+
+    @contextmanager
+    def read_connection(self):
+        """A connection for read-only queries: one from the replica pool if
+        set, once the replica has replayed everything written on the primary
+        so far (e.g. the results the validators just wrote), otherwise the
+        primary connection. Reads fall back to the primary if the replica
+        does not catch up within POSTGRES_REPLICA_WAIT_SECONDS."""
+        if self.read_pool is None:
+            yield self.connection
+            return
+        lsn = current_lsn(self.connection)
+        with self.read_pool.connection() as connection:
+            if wait_for_replay(connection, lsn, Config.POSTGRES_REPLICA_WAIT_SECONDS):
+                yield connection
+                return
+        self.logger.warning(
+            "Read replica has not replayed %s yet, reading from the primary.", lsn
+        )
+        yield self.connection
+
+    def rollback(self):
+        """Roll back the current transaction and drop cached ids, which may
+        refer to rows that were never committed."""
+        try:
+            self.connection.rollback()
+        except psycopg2.InterfaceError:
+            # the connection is closed, it is replaced on next use
+            pass
+        self.statehashes.invalidate()
+        self.nodes.invalidate()
 
     def get_batch_timings(self, interval):
         "Get the time-frame for the next batch and previous batch's id."
@@ -146,55 +441,44 @@ class DB:
             cursor.close()
         return previous_result_df, p_selected_node_df
 
-    def get_statehash_df(self):
-        "Get the list of all known statehashes as a data frame."
+    def get_statehash_ids(self):
+        "Get the mapping of all known statehashes to their database ids."
         cursor = self.connection.cursor()
         try:
-            cursor.execute("select value from statehash")
-            result = cursor.fetchall()
-            state_hash = pd.DataFrame(result, columns=["statehash"])
-        except (Exception, psycopg2.DatabaseError) as error:
-            self.logger.error(ERROR.format(error))
-            return -1
-        finally:
-            cursor.close()
-        return state_hash
-
-    def create_statehash(self, statehash_df, page_size=100):
-        "Add a new statehashto the database."
-        tuples = [tuple(x) for x in statehash_df.to_numpy()]
-        self.logger.info("create_statehash: %s", tuples)
-        query = """INSERT INTO statehash ( value)
-                VALUES ( %s)  """
-        cursor = self.connection.cursor()
-        try:
-            extras.execute_batch(cursor, query, tuples, page_size)
+            cursor.execute("SELECT value, id FROM statehash")
+            return dict(cursor.fetchall())
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return -1
+            raise RuntimeError("Could not load statehashes.") from error
         finally:
             cursor.close()
-        self.logger.info("create_statehash  end ")
-        return 0
 
-    def create_node_record(self, df, page_size=100):
-        "Add new block producers to the database."
-        self.logger.info("create_node_record  start ")
-        tuples = [tuple(x) for x in df.to_numpy()]
-        query = """INSERT INTO nodes ( block_producer_key, updated_at)
-                VALUES ( %s,  %s )  """
+    def insert_statehashes(self, values):
+        """Add new statehashes to the database and return the mapping of the
+        given values to their ids. Values which are already present in the
+        table are not inserted again, their ids are returned instead."""
+        self.logger.info("insert_statehashes  start (statehashes: %s)", len(values))
+        # The outer SELECT does not see rows inserted by the CTE, so each
+        # value is returned exactly once: either as new or as pre-existing.
+        query = """WITH new AS (
+                     INSERT INTO statehash (value) SELECT unnest(%s::text[])
+                     ON CONFLICT (value) DO NOTHING
+                     RETURNING value, id
+                   )
+                   SELECT value, id FROM new
+                   UNION ALL
+                   SELECT value, id FROM statehash WHERE value = ANY(%s::text[])"""
         cursor = self.connection.cursor()
         try:
-            extras.execute_batch(cursor, query, tuples, page_size)
+            cursor.execute(query, (values, values))
+            result = dict(cursor.fetchall())
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return 1
+            raise
         finally:
             cursor.close()
-        self.logger.info("create_node_record  end ")
-        return 0
+        self.logger.info("insert_statehashes  end ")
+        return result
 
     def create_bot_log(self, values):
         "Add a new batch to the database."
@@ -215,100 +499,107 @@ class DB:
         return result[0]
 
     def insert_statehash_results(self, df, page_size=100):
-        "Relate statehashes to the batches they were observed in."
+        """Relate statehashes to the batches they were observed in. The data
+        frame is expected to carry statehash ids rather than values."""
         self.logger.info("create_botlogs_statehash  start ")
-        temp_df = df[["parent_state_hash", "state_hash", "weight", "bot_log_id"]]
-        tuples = [tuple(x) for x in temp_df.to_numpy()]
+        temp_df = df[["parent_statehash_id", "statehash_id", "weight", "bot_log_id"]]
+        tuples = [
+            (as_db_id(parent_id), as_db_id(statehash_id), int(weight), bot_log_id)
+            for parent_id, statehash_id, weight, bot_log_id in temp_df.itertuples(
+                index=False
+            )
+        ]
         query = """INSERT INTO bot_logs_statehash(parent_statehash_id, statehash_id, weight, bot_log_id )
-                VALUES (
-                  (SELECT id FROM statehash WHERE value= %s),
-                  (SELECT id FROM statehash WHERE value= %s),
-                  %s,
-                  %s ) """
+                VALUES ( %s, %s, %s, %s ) """
         cursor = self.connection.cursor()
 
         try:
-            extras.execute_batch(cursor, query, tuples, page_size)
+            if Config.bulk_write("bot_logs_statehash"):
+                copy_insert(
+                    cursor,
+                    "bot_logs_statehash",
+                    ["parent_statehash_id", "statehash_id", "weight", "bot_log_id"],
+                    tuples,
+                )
+            else:
+                extras.execute_batch(cursor, query, tuples, page_size)
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return 1
+            raise
         finally:
             cursor.close()
         self.logger.info("create_botlogs_statehash  end ")
         return 0
 
     def create_point_record(self, df, page_size=100):
-        "Add a new scoring submission to the database."
+        """Add a new scoring submission to the database. The data frame is
+        expected to carry node and statehash ids rather than values."""
         self.logger.info("create_point_record  start ")
         tuples = [tuple(x) for x in df.to_numpy()]
         query = """INSERT INTO points
                    (file_name, file_timestamps, blockchain_epoch, node_id,
                    blockchain_height, amount, created_at, bot_log_id, statehash_id)
-                VALUES ( %s, %s,  %s, (SELECT id FROM nodes WHERE block_producer_key= %s),
-                         %s, %s, %s, %s, (SELECT id FROM statehash WHERE value= %s) )"""
+                VALUES ( %s, %s, %s, %s, %s, %s, %s, %s, %s )"""
         try:
             cursor = self.connection.cursor()
-            extras.execute_batch(cursor, query, tuples, page_size)
+            if Config.bulk_write("points"):
+                copy_insert(cursor, "points", POINTS_COLUMNS, tuples)
+            else:
+                extras.execute_batch(cursor, query, tuples, page_size)
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return 1
+            raise
         finally:
             cursor.close()
         self.logger.info("create_point_record  end ")
         return 0
 
-    def update_scoreboard(self, score_till_time, uptime_days=30):
-        "Update the block producer scores."
+    def update_scoreboard(
+        self, score_till_time, uptime_days=30, mode=Config.SCOREBOARD_MODE
+    ):
+        """Update the block producer scores. In FULL mode scores are computed
+        from scratch over the whole scoring window. In INCREMENTAL mode only
+        batches which entered or left the window since the previous update are
+        accounted for. VERIFY mode updates incrementally, then cross-checks the
+        result against the full computation and resynchronises on mismatch."""
         self.logger.info(
-            "updateScoreboard  start (score_till_time: %s, uptime_days: %s) ",
+            "updateScoreboard  start (score_till_time: %s, uptime_days: %s, mode: %s) ",
             score_till_time,
             uptime_days,
+            mode,
         )
         # update the scores
         # Note that points_summary table is updated by the database trigger
         # on every insert to the points table.
         # It holds one record per block producer per batch if they submitted any valid submissions within the batch.
         # Scores are calculated based on the points_summary table.
-        sql = """with vars  (snapshot_date, start_date) as( values (%s AT TIME ZONE 'UTC',
-                        (%s - interval '%s' day) AT TIME ZONE 'UTC')
-              )
-              , epochs as(
-                select extract('epoch' from snapshot_date) as end_epoch,
-                extract('epoch' from start_date) as start_epoch from vars
-              )
-              , b_logs as(
-                select (count(1) ) as surveys
-                from bot_logs b , epochs e
-                where b.batch_start_epoch >= start_epoch and  b.batch_end_epoch <= end_epoch and b.files_processed > -1
-              )
-              , scores as (
-                select p.node_id, count(p.bot_log_id) bp_points
-                from points_summary p join bot_logs b on p.bot_log_id =b.id, epochs
-                where b.batch_start_epoch >= start_epoch and b.batch_end_epoch <= end_epoch
-                group by 1
-              )
-              , final_scores as (
-                select node_id, bp_points,
-                surveys, trunc( ((bp_points::decimal*100) / surveys),2) as score_perc
-                from scores l join nodes n on l.node_id=n.id, b_logs t
-              )
-              update nodes nrt set score = s.bp_points, score_percent=s.score_perc
-              from final_scores s where nrt.id=s.node_id """
-
-        history_sql = """insert into score_history (node_id, score_at, score, score_percent)
+        params = {"score_till_time": score_till_time, "uptime_days": uptime_days}
+        if Config.SCORE_HISTORY_MODE == Config.SCORE_HISTORY_CHANGES:
+            # only record nodes whose score differs from their latest history entry
+            history_sql = """insert into score_history (node_id, score_at, score, score_percent)
+                      SELECT n.id as node_id, %s, n.score, n.score_percent from nodes n
+                      left join lateral (
+                        select h.score, h.score_percent from score_history h
+                        where h.node_id = n.id order by h.score_at desc limit 1
+                      ) last on true
+                      where n.score is not null
+                      and (last.score, last.score_percent) is distinct from (n.score, n.score_percent) """
+        else:
+            history_sql = """insert into score_history (node_id, score_at, score, score_percent)
                       SELECT id as node_id, %s, score, score_percent from nodes where score is not null """
         try:
             cursor = self.connection.cursor()
-            cursor.execute(
-                sql,
-                (
-                    score_till_time,
-                    score_till_time,
-                    uptime_days,
-                ),
-            )
+            if mode == Config.SCOREBOARD_FULL:
+                cursor.execute(
+                    SCORES_CTE
+                    + """ update nodes nrt set score = s.bp_points, score_percent=s.score_perc
+                          from final_scores s where nrt.id=s.node_id """,
+                    params,
+                )
+            else:
+                window = self._slide_score_window(cursor, params)
+                if mode == Config.SCOREBOARD_VERIFY:
+                    self._verify_score_window(cursor, params, window)
             cursor.execute(history_sql, (score_till_time,))
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
@@ -319,19 +610,97 @@ class DB:
         self.logger.info("updateScoreboard  end ")
         return 0
 
-    def get_existing_nodes(self):
-        "Get the list of all known block producers."
+    def _slide_score_window(self, cursor, params):
+        """Move the maintained scoring window (score_window and
+        node_window_points tables) to end at score_till_time and update the
+        scores of nodes from it. Return the new window bounds."""
+        cursor.execute(
+            """select extract('epoch' from (%(score_till_time)s AT TIME ZONE 'UTC')),
+                      extract('epoch' from ((%(score_till_time)s - interval '%(uptime_days)s' day) AT TIME ZONE 'UTC'))""",
+            params,
+        )
+        end_epoch, start_epoch = cursor.fetchone()
+        window = {"start_epoch": start_epoch, "end_epoch": end_epoch}
+        cursor.execute("SELECT start_epoch, end_epoch FROM score_window FOR UPDATE")
+        previous_window = cursor.fetchone()
+        if previous_window is None:
+            self.logger.info("score window not initialised, computing it from scratch")
+            cursor.execute(SEED_SCORE_WINDOW_SQL, window)
+        else:
+            window["previous_start_epoch"], window["previous_end_epoch"] = (
+                previous_window
+            )
+            cursor.execute(SLIDE_SCORE_WINDOW_SQL, window)
+        cursor.execute(UPDATE_SCORES_FROM_WINDOW_SQL)
+        return window
+
+    def _verify_score_window(self, cursor, params, window):
+        """Compare the maintained scoring window with the full computation.
+        On mismatch, log it and rebuild the window from scratch."""
+        cursor.execute(
+            SCORES_CTE
+            + """ select
+                    (select count(*) from final_scores f
+                     full join (select node_id, points from node_window_points where points > 0) w
+                     using (node_id) where f.bp_points is distinct from w.points),
+                    (select surveys from b_logs),
+                    (select surveys from score_window) """,
+            params,
+        )
+        mismatched_nodes, surveys, window_surveys = cursor.fetchone()
+        if mismatched_nodes or surveys != window_surveys:
+            self.logger.error(
+                "Incremental scores differ from the full computation "
+                "(mismatched nodes: %s, surveys: %s != %s), rebuilding the score window.",
+                mismatched_nodes,
+                window_surveys,
+                surveys,
+            )
+            cursor.execute(SEED_SCORE_WINDOW_SQL, window)
+            cursor.execute(UPDATE_SCORES_FROM_WINDOW_SQL)
+        else:
+            self.logger.info("Incremental scores match the full computation.")
+
+    def get_node_ids(self):
+        "Get the mapping of all known block producer keys to their node ids."
         cursor = self.connection.cursor()
         try:
-            cursor.execute("select block_producer_key from nodes")
-            result = cursor.fetchall()
-            nodes = pd.DataFrame(result, columns=["block_producer_key"])
+            cursor.execute("SELECT block_producer_key, id FROM nodes")
+            return dict(cursor.fetchall())
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            return -1
+            raise RuntimeError("Could not load nodes.") from error
+        finally:
+            cursor.close()
+
+    def insert_nodes(self, block_producer_keys, updated_at):
+        """Add new block producers to the database and return the mapping of
+        the given keys to their node ids. Keys which are already present in
+        the table are not inserted again, their ids are returned instead."""
+        self.logger.info("insert_nodes  start (nodes: %s)", len(block_producer_keys))
+        query = """WITH new AS (
+                     INSERT INTO nodes (block_producer_key, updated_at)
+                     SELECT unnest(%s::text[]), %s
+                     ON CONFLICT (block_producer_key) DO NOTHING
+                     RETURNING block_producer_key, id
+                   )
+                   SELECT block_producer_key, id FROM new
+                   UNION ALL
+                   SELECT block_producer_key, id FROM nodes
+                   WHERE block_producer_key = ANY(%s::text[])"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(
+                query, (block_producer_keys, updated_at, block_producer_keys)
+            )
+            result = dict(cursor.fetchall())
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.logger.error(ERROR.format(error))
+            raise
         finally:
             cursor.close()
-        return nodes
+        self.logger.info("insert_nodes  end ")
+        return result
 
     # tuples = [discord_id, block_producer_email, block_producer_key]
     def update_application_status(self, tuples, page_size=100):
@@ -353,7 +722,8 @@ class DB:
         return 0
 
     def insert_submissions(self, submissions):
-        """Insert a list of Submission objects into the submissions table."""
+        """Insert the submissions buffered in a SubmissionColumns into the
+        submissions table."""
         self.logger.info(
             "insert_submissions  start (submissions: %s)", len(submissions)
         )
@@ -363,26 +733,14 @@ class DB:
                 state_hash, parent, height, slot, validation_error, verified
             ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        values = [
-            (
-                submission.submitted_at_date,
-                submission.submitted_at,
-                submission.submitter,
-                submission.remote_addr,
-                submission.block_hash,
-                submission.state_hash,
-                submission.parent,
-                submission.height,
-                submission.slot,
-                submission.validation_error,
-                submission.verified,
-            )
-            for submission in submissions
-        ]
+        values = list(submissions.rows(SUBMISSIONS_COLUMNS))
 
         cursor = self.connection.cursor()
         try:
-            extras.execute_batch(cursor, insert_query, values)
+            if Config.bulk_write("submissions"):
+                copy_insert(cursor, "submissions", SUBMISSIONS_COLUMNS, values)
+            else:
+                extras.execute_batch(cursor, insert_query, values)
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error("Error inserting submissions: %s", error)
             cursor.close()
@@ -392,13 +750,13 @@ class DB:
         self.logger.info("insert_submissions  end")
         return 0
 
-    # return list of Submission objects
-    def get_submissions(
-        self, start_date: datetime, end_date: datetime
-    ) -> Optional[List[Submission]]:
-        "Get the submissions for a given submitter and time frame."
+    def stream_submissions(self, start_date, end_date, fetch_size=None):
+        """Stream the submissions of a time frame in chunks of at most
+        fetch_size rows (tuples in SUBMISSION_FIELDS order). A server-side
+        cursor is used, so the whole result is never held in memory. Reads
+        go to the replica if one is configured."""
+        fetch_size = fetch_size or Config.SUBMISSION_FETCH_SIZE
         query = """
-            SET TIME ZONE 'UTC';
             SELECT 
                 submitted_at_date, 
                 submitted_at, 
@@ -418,39 +776,71 @@ class DB:
             FROM submissions 
             WHERE submitted_at >= %s 
             AND submitted_at < %s
-            ORDER BY submitted_at DESC;
+            ORDER BY submitted_at DESC
+        """
+        with self.read_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TIME ZONE 'UTC'")
+            cursor = connection.cursor(name="stream_submissions")
+            cursor.itersize = fetch_size
+            try:
+                cursor.execute(query, (start_date, end_date))
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.close()
+
+    def submission_histogram(self, start_date, end_date, bucket):
+        """Count the submissions of a time frame per bucket of the given
+        duration. Return a list of ((bucket_start, bucket_end), count) in time
+        order, empty buckets included. Reads go to the replica if one is
+        configured."""
+        self.logger.info("submission_histogram  start ")
+        bucket_seconds = bucket.total_seconds()
+        query = """
+            SELECT floor((extract(epoch FROM submitted_at) - %s) / %s)::int AS bucket,
+                count(*)
+            FROM submissions
+            WHERE submitted_at >= %s
+            AND submitted_at < %s
+            GROUP BY 1
         """
+        with self.read_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TIME ZONE 'UTC'")
+                cursor.execute(
+                    query,
+                    (start_date.timestamp(), bucket_seconds, start_date, end_date),
+                )
+                counts = dict(cursor.fetchall())
+        buckets = math.ceil((end_date - start_date) / bucket)
+        histogram = [
+            (
+                (
+                    start_date + bucket * index,
+                    min(start_date + bucket * (index + 1), end_date),
+                ),
+                counts.get(index, 0),
+            )
+            for index in range(buckets)
+        ]
+        self.logger.info("submission_histogram  end ")
+        return histogram
 
+    # return list of Submission objects
+    def get_submissions(
+        self, start_date: datetime, end_date: datetime
+    ) -> Optional[List[Submission]]:
+        "Get the submissions for a given submitter and time frame."
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (start_date, end_date))
-
-            # print query with parameters
-            # preview_query = cursor.mogrify(query, (start_date, end_date))
-            # print(preview_query.decode("utf-8"))
-            result = cursor.fetchall()
-            # convert the result to a list of Submission objects
-            submissions = [
-                Submission(
-                    submitted_at_date=row[0],
-                    submitted_at=row[1],
-                    submitter=row[2],
-                    created_at=row[3],
-                    block_hash=row[4],
-                    remote_addr=row[5],
-                    peer_id=row[6],
-                    graphql_control_port=row[7],
-                    built_with_commit_sha=row[8],
-                    state_hash=row[9],
-                    parent=row[10],
-                    height=row[11],
-                    slot=row[12],
-                    validation_error=row[13],
-                    verified=row[14],
-                )
-                for row in result
+            return [
+                Submission(**dict(zip(SUBMISSION_FIELDS, row)))
+                for rows in self.stream_submissions(start_date, end_date)
+                for row in rows
             ]
-            return submissions
         except psycopg2.Error as e:
             self.logger.error("Database error: %s", e)
             return None
@@ -499,87 +889,166 @@ def get_contact_details_from_spreadsheet():
 
 def get_relations(df):
     "Extract parent-child relations between statehashes in a dataframe."
-    return (
-        (parent, child)
-        for child, parent in df[["state_hash", "parent_state_hash"]].values
-        if parent in df["state_hash"].values
+    relations_df = df[df["parent_state_hash"].isin(df["state_hash"])]
+    return zip(
+        relations_df["parent_state_hash"].values, relations_df["state_hash"].values
     )
 
 
-def find_new_values_to_insert(existing_values, new_values):
-    "Find the new values to insert into the database."
-    return (
-        existing_values.merge(new_values, how="outer", indicator=True)
-        .loc[lambda x: x["_merge"] == "right_only"]
-        .drop("_merge", axis=1)
-        .drop_duplicates()
+def select_batch_state_hashes(batch_df, shortlisted_state_hash_df):
+    """Restrict statehashes shortlisted by the BFS to those submitted within
+    the batch and attach their parents (as first submitted in the batch)."""
+    parents = batch_df.drop_duplicates("state_hash").set_index("state_hash")[
+        "parent_state_hash"
+    ]
+    selected_df = shortlisted_state_hash_df[
+        shortlisted_state_hash_df["state_hash"].isin(parents.index)
+    ].copy()
+    selected_df["parent_state_hash"] = selected_df["state_hash"].map(parents)
+    return selected_df
+
+
+POINTS_COLUMNS = [
+    "file_name",
+    "file_timestamps",
+    "blockchain_epoch",
+    "node_id",
+    "blockchain_height",
+    "amount",
+    "created_at",
+    "bot_log_id",
+    "statehash_id",
+]
+
+SUBMISSIONS_COLUMNS = [
+    "submitted_at_date",
+    "submitted_at",
+    "submitter",
+    "remote_addr",
+    "block_hash",
+    "state_hash",
+    "parent",
+    "height",
+    "slot",
+    "validation_error",
+    "verified",
+]
+
+
+def rows_to_csv(rows):
+    """Serialise rows into a CSV buffer suitable for COPY ... FROM STDIN.
+    Nulls (None or NaN) are written as COPY_NULL."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow(
+            COPY_NULL if value is None or value is pd.NA or value != value else value
+            for value in row
+        )
+    buffer.seek(0)
+    return buffer
+
+
+def copy_insert(cursor, table, columns, rows):
+    """Insert rows into a table in a constant number of round trips: stream
+    them with COPY into a temporary staging table and merge it into the
+    target with a single INSERT ... SELECT, which fires the same triggers as
+    regular inserts."""
+    staging = sql.Identifier(f"staging_{table}")
+    column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+    cursor.execute(
+        sql.SQL(
+            "CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+        ).format(staging, column_list, sql.Identifier(table))
+    )
+    cursor.copy_expert(
+        sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL {})")
+        .format(staging, column_list, sql.Literal(COPY_NULL))
+        .as_string(cursor),
+        rows_to_csv(rows),
     )
+    cursor.execute(
+        sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}; DROP TABLE {}").format(
+            sql.Identifier(table), column_list, column_list, staging, staging
+        )
+    )
+
+
+def as_db_id(value):
+    "Convert an id taken from a data frame into a value psycopg2 can adapt."
+    return None if pd.isna(value) else int(value)
 
 
 def filter_state_hash_percentage(df, p=0.05):
-    "Filter statehashes by percentage of block producers who submitted them."
-    state_hash_list = (
-        df["state_hash"].value_counts().sort_values(ascending=False).index.to_list()
-    )
+    """Filter statehashes by percentage of block producers who submitted them.
+    Statehashes are returned in descending order of submissions count."""
+    state_hash_counts = df["state_hash"].value_counts().sort_values(ascending=False)
     # get 5% number of blk in given batch
     total_unique_blk = df["block_producer_key"].nunique()
     percentage_result = round(total_unique_blk * p, 2)
-    good_state_hash_list = list()
-    for s in state_hash_list:
-        blk_count = df[df["state_hash"] == s]["block_producer_key"].nunique()
-        # check blk_count for state_hash submitted by blk least 5%
-        if blk_count >= percentage_result:
-            good_state_hash_list.append(s)
-    return good_state_hash_list
+    # count distinct block producers of every statehash in a single pass
+    blk_counts = (
+        df.groupby("state_hash")["block_producer_key"]
+        .nunique()
+        .reindex(state_hash_counts.index)
+    )
+    # check blk_count for state_hash submitted by blk least 5%
+    return blk_counts[blk_counts >= percentage_result].index.to_list()
 
 
 def create_graph(batch_df, p_selected_node_df, c_selected_node, p_map):
     """Create a directed graph of parent-child relations between blocks
     in the batch dataframe."""
-    batch_graph = nx.DiGraph()
-    parent_hash_list = batch_df["parent_state_hash"].unique()
-    state_hash_list = set(
-        list(batch_df["state_hash"].unique())
-        + list(p_selected_node_df["state_hash"].values)
-    )
-    selected_parent = [
-        parent for parent in parent_hash_list if parent in state_hash_list
-    ]
-
-    batch_graph.add_nodes_from(list(p_selected_node_df["state_hash"].values))
-    batch_graph.add_nodes_from(c_selected_node)
-    batch_graph.add_nodes_from(state_hash_list)
-
-    for row in batch_df.itertuples():
-        state_hash = getattr(row, "state_hash")
-        parent_hash = getattr(row, "parent_state_hash")
-
-        if parent_hash in selected_parent:
-            batch_graph.add_edge(parent_hash, state_hash)
+    batch_graph = ChainGraph()
+    batch_state_hashes = batch_df["state_hash"].unique()
+    state_hash_set = set(batch_state_hashes).union(p_selected_node_df["state_hash"])
+
+    for state_hash in p_selected_node_df["state_hash"].values:
+        batch_graph.add_node(state_hash)
+    for state_hash in c_selected_node:
+        batch_graph.add_node(state_hash)
+    for state_hash in batch_state_hashes:
+        batch_graph.add_node(state_hash)
+
+    edges_df = batch_df[batch_df["parent_state_hash"].isin(state_hash_set)]
+    for parent_hash, state_hash in zip(
+        edges_df["parent_state_hash"].values, edges_df["state_hash"].values
+    ):
+        batch_graph.add_edge(parent_hash, state_hash)
 
     #  add edges from previous batch nodes
-    batch_graph.add_edges_from(p_map)
+    for parent_hash, state_hash in p_map:
+        batch_graph.add_edge(parent_hash, state_hash)
 
     return batch_graph
 
 
 def apply_weights(batch_graph, c_selected_node, p_selected_node):
     "Apply weights to to statehashes,"
-    for node in list(batch_graph.nodes()):
-        if node in c_selected_node:
-            batch_graph.nodes[node]["weight"] = 0
-        elif node in p_selected_node["state_hash"].values:
-            batch_graph.nodes[node]["weight"] = p_selected_node[
-                p_selected_node["state_hash"] == node
-            ]["weight"].values[0]
+    c_selected = set(c_selected_node)
+    p_weights = {}
+    for state_hash, weight in zip(
+        p_selected_node["state_hash"].values, p_selected_node["weight"].values
+    ):
+        p_weights.setdefault(state_hash, weight)
+
+    for node_id, node in enumerate(batch_graph.nodes):
+        if node in c_selected:
+            batch_graph.weights[node_id] = 0
+        elif node in p_weights:
+            batch_graph.weights[node_id] = p_weights[node]
         else:
-            batch_graph.nodes[node]["weight"] = 9999
+            batch_graph.weights[node_id] = UNREACHED_WEIGHT
 
     return batch_graph
 
 
 def plot_graph(batch_graph, g_pos, title):
     "Plot the graph of parent-child relations between state hashes."
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
+    batch_graph = batch_graph.to_networkx()
     # plot the graph
     plt.figure(figsize=(8, 8))
     plt.title(title)
@@ -605,35 +1074,21 @@ def plot_graph(batch_graph, g_pos, title):
 
 def get_minimum_weight(graph, child_node):
     "Find the statehash with the minimum weight."
-    child_node_weight = graph.nodes[child_node]["weight"]
-    for parent in list(graph.predecessors(child_node)):
-        lower = min(graph.nodes[parent]["weight"] + 1, child_node_weight)
-        child_node_weight = lower
-    return child_node_weight
+    return graph.minimum_weight(graph.index[child_node])
 
 
 def bfs(graph, queue_list, node, max_depth=2):
     "Breadth-first search through the graph."
-    visited = list()
-    visited.append(node)
-    cnt = 2
-    while queue_list:
-        m = queue_list.pop(0)
-        for neighbour in list(graph.neighbors(m)):
-            if neighbour not in visited:
-                graph.nodes[neighbour]["weight"] = get_minimum_weight(graph, neighbour)
-                visited.append(neighbour)
-                # if not neighbour in visited:
-                queue_list.append(neighbour)
-        # plot_graph(graph, g_pos, str(cnt)+'.'+m)
-        cnt += 1
+    graph.bfs(
+        sources=[graph.index[state_hash] for state_hash in queue_list],
+        start=graph.index[node],
+    )
     shortlisted_state = []
     hash_weights = []
-    for node in list(graph.nodes()):
-        if graph.nodes[node]["weight"] <= max_depth:
-            # if node in batch_statehash:
-            shortlisted_state.append(node)
-            hash_weights.append(graph.nodes[node]["weight"])
+    for state_hash, weight in zip(graph.nodes, graph.weights):
+        if weight <= max_depth:
+            shortlisted_state.append(state_hash)
+            hash_weights.append(weight)
 
     shortlisted_state_hash_df = pd.DataFrame()
     shortlisted_state_hash_df["state_hash"] = shortlisted_state
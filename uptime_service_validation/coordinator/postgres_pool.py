@@ -0,0 +1,155 @@
+"""Pooled PostgreSQL connections for the coordinator: a pool for the primary
+database and, optionally, one for a read replica."""
+
+from contextlib import contextmanager
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+from uptime_service_validation.coordinator.config import Config
+
+# Interval at which a lagging replica is checked again
+REPLAY_POLL_SECONDS = 0.1
+
+# Connections idle for longer than this are checked with a query before they
+# are handed out again.
+HEALTH_CHECK_IDLE_SECONDS = 30
+
+
+def connection_options():
+    "Connection parameters shared by the primary and the replica connections."
+    options = {
+        "keepalives": 1,
+        "keepalives_idle": Config.POSTGRES_KEEPALIVES_IDLE,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    }
+    if Config.POSTGRES_STATEMENT_TIMEOUT_MS:
+        options["options"] = (
+            f"-c statement_timeout={Config.POSTGRES_STATEMENT_TIMEOUT_MS}"
+        )
+    return options
+
+
+def current_lsn(connection):
+    "Return the current WAL position of the primary a connection is open to."
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn()::text")
+        return cursor.fetchone()[0]
+
+
+def wait_for_replay(connection, lsn, timeout):
+    """Wait until the replica a connection is open to has replayed the WAL up
+    to lsn, for timeout seconds at most. Return whether it did. A server which
+    is not in recovery (i.e. not a streaming replica) has nothing to replay."""
+    deadline = time.monotonic() + timeout
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                "SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn",
+                (lsn,),
+            )
+            if cursor.fetchone()[0]:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(REPLAY_POLL_SECONDS)
+
+
+class PostgresPool:
+    """A thread-safe pool of PostgreSQL connections. Connections use TCP
+    keepalives and the configured statement_timeout, and those which have
+    been idle for a while are checked before being handed out, so that a
+    connection dropped by the server is replaced rather than returned."""
+
+    def __init__(self, maxconn, dsn=None, readonly=False, **connect_kwargs):
+        self.pool = ThreadedConnectionPool(1, maxconn, dsn, **connect_kwargs)
+        self.maxconn = maxconn
+        self.readonly = readonly
+        self._returned_at = {}
+
+    @classmethod
+    def primary(cls):
+        "Create the pool of connections to the primary database."
+        return cls(
+            Config.POSTGRES_POOL_SIZE,
+            host=Config.POSTGRES_HOST,
+            port=Config.POSTGRES_PORT,
+            database=Config.POSTGRES_DB,
+            user=Config.POSTGRES_USER,
+            password=Config.POSTGRES_PASSWORD,
+            **connection_options(),
+        )
+
+    @classmethod
+    def replica(cls):
+        """Create the pool of read-only connections to the replica given by
+        POSTGRES_REPLICA_DSN, or return None if there is none."""
+        if not Config.POSTGRES_REPLICA_DSN:
+            return None
+        return cls(
+            Config.POSTGRES_POOL_SIZE,
+            Config.POSTGRES_REPLICA_DSN,
+            readonly=True,
+            **connection_options(),
+        )
+
+    def getconn(self):
+        "Take a healthy connection from the pool."
+        # every connection of the pool may be broken, plus a new one
+        for _ in range(self.maxconn + 1):
+            connection = self.pool.getconn()
+            if self._healthy(connection):
+                if self.readonly and not connection.readonly:
+                    connection.set_session(readonly=True)
+                return connection
+            self.putconn(connection, close=True)
+        raise psycopg2.OperationalError("Could not get a healthy database connection")
+
+    def putconn(self, connection, close=False):
+        """Give a connection back to the pool, ending any transaction left
+        open. Closed connections are discarded."""
+        self._returned_at.pop(id(connection), None)
+        if connection.closed:
+            close = True
+        elif (
+            connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE
+        ):
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                close = True
+        if not close:
+            self._returned_at[id(connection)] = time.monotonic()
+        self.pool.putconn(connection, close=close)
+
+    @contextmanager
+    def connection(self):
+        "Borrow a connection for the duration of a with block."
+        connection = self.getconn()
+        try:
+            yield connection
+        finally:
+            self.putconn(connection)
+
+    def closeall(self):
+        self.pool.closeall()
+
+    def _healthy(self, connection):
+        if connection.closed:
+            return False
+        returned_at = self._returned_at.get(id(connection))
+        if (
+            returned_at is not None
+            and time.monotonic() - returned_at < HEALTH_CHECK_IDLE_SECONDS
+        ):
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
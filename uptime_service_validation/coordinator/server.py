@@ -1,11 +1,15 @@
 import logging
 import socket
 import sys
-from kubernetes import client, config
+from kubernetes import client, config, watch
+from kubernetes.client.rest import ApiException
 import os
 from datetime import datetime, timezone
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 import socket
 
 from uptime_service_validation.coordinator.config import Config, bool_env_var_set
@@ -41,50 +45,148 @@ def try_get_hostname_ip(hostname, logger, max_retries=5, initial_wait=0.2):
     return hostname
 
 
+# Seconds between two polls of the job statuses, when they can't be watched
+JOB_POLL_INTERVAL_SECONDS = 10
+# Seconds after which the API server ends a job watch; it is then resumed
+JOB_WATCH_TIMEOUT_SECONDS = 300
+
+
 # Format datetime such as it is accepted by the stateless validator
 def datetime_formatter(dt):
     return dt.strftime("%Y-%m-%d %H:%M:%S.%f")[:-5] + "+0000"
 
 
-def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
-    # Configuring Kubernetes client
-    config.load_incluster_config()
-
-    api_core = client.CoreV1Api()
-    api_batch = client.BatchV1Api()
-
-    namespace = (
-        open("/var/run/secrets/kubernetes.io/serviceaccount/namespace").read().strip()
-    )
+def job_finished(job, logging):
+    """Check if every completion of a job succeeded. Exit the program if one
+    of its indexes failed Config.RETRY_COUNT times, or if the job failed."""
+    job_name = job.metadata.name
+    status = job.status
+    if (status.succeeded or 0) >= (job.spec.completions or 1):
+        logging.info(f"Job {job_name} succeeded.")
+        return True
+    if status.failed is not None:
+        job_failed = any(
+            condition.type == "Failed" and condition.status == "True"
+            for condition in status.conditions or []
+        )
+        if status.failed_indexes or job_failed:
+            logging.error(
+                f"Job {job_name} failed (indexes: {status.failed_indexes}). Maximum retries ({Config.RETRY_COUNT}) reached. Exiting the program..."
+            )
+            exit(1)
+        logging.warning(
+            f"Job {job_name} failed {status.failed} time(s). Retrying the failed indexes..."
+        )
+    return False
 
-    service_account_name = os.environ.get("WORKER_SERVICE_ACCOUNT_NAME", "delegation-verify")
 
-    worker_cpu_request = os.environ.get("WORKER_CPU_REQUEST")
-    worker_memory_request = os.environ.get("WORKER_MEMORY_REQUEST")
-    worker_cpu_limit = os.environ.get("WORKER_CPU_LIMIT")
-    worker_memory_limit = os.environ.get("WORKER_MEMORY_LIMIT")
+def poll_jobs(api_batch, namespace, pending, logging):
+    "Read the status of every pending job once, then wait before the next round."
+    for job_name in list(pending):
+        try:
+            job_status = api_batch.read_namespaced_job_status(job_name, namespace)
+            if job_finished(job_status, logging):
+                pending.discard(job_name)
+        except Exception as e:
+            logging.error(f"Error reading job status for {job_name}: {e}")
+    if pending:
+        time.sleep(JOB_POLL_INTERVAL_SECONDS)
+
+
+def wait_for_jobs(api_batch, namespace, job_names, job_group_name, logging):
+    """Wait until the given jobs are done. Jobs are watched through their
+    job-group-name label, so that completions and failures are handled as
+    soon as they happen. The watch resumes from the last resource version it
+    saw, the jobs are listed again if that version expired, and their statuses
+    are polled if watching fails."""
+    pending = set(job_names)
+    label_selector = f"job-group-name={job_group_name}"
+    resource_version = None
+    while pending:
+        try:
+            if resource_version is None:
+                job_list = api_batch.list_namespaced_job(
+                    namespace, label_selector=label_selector
+                )
+                for job in job_list.items:
+                    if job.metadata.name in pending and job_finished(job, logging):
+                        pending.discard(job.metadata.name)
+                resource_version = job_list.metadata.resource_version
+                continue
+            job_watch = watch.Watch()
+            for event in job_watch.stream(
+                api_batch.list_namespaced_job,
+                namespace,
+                label_selector=label_selector,
+                resource_version=resource_version,
+                timeout_seconds=JOB_WATCH_TIMEOUT_SECONDS,
+            ):
+                job = event["object"]
+                resource_version = job.metadata.resource_version
+                job_name = job.metadata.name
+                if job_name not in pending:
+                    continue
+                if event["type"] == "DELETED":
+                    logging.error(f"Job {job_name} was deleted before it finished.")
+                    pending.discard(job_name)
+                elif job_finished(job, logging):
+                    pending.discard(job_name)
+                if not pending:
+                    job_watch.stop()
+                    break
+        except ApiException as e:
+            if e.status != 410:
+                logging.warning(f"Error watching jobs: {e}. Polling them instead...")
+                poll_jobs(api_batch, namespace, pending, logging)
+            resource_version = None
+        except Exception as e:
+            logging.warning(f"Error watching jobs: {e}. Polling them instead...")
+            poll_jobs(api_batch, namespace, pending, logging)
+            resource_version = None
+
+
+# Run by the worker containers of an Indexed Job: pick the time window of the
+# pod's completion index from the comma-separated lists of the batch.
+WORKER_WINDOW_SCRIPT = """
+i=$((JOB_COMPLETION_INDEX + 1))
+export START_TIMESTAMP="$(echo "$MINI_BATCH_STARTS" | cut -d, -f$i)"
+export END_TIMESTAMP="$(echo "$MINI_BATCH_ENDS" | cut -d, -f$i)"
+export AWS_ROLE_SESSION_NAME="$AWS_ROLE_SESSION_NAME-$JOB_COMPLETION_INDEX"
+exec /bin/entrypoint/entrypoint-worker.sh
+"""
+
+
+class ValidatorJobTemplate:
+    """The parts of the validator jobs which are the same for every batch:
+    the Kubernetes client, the namespace and the pod template, serialized to
+    its API representation. It is prepared once, and the Indexed Job of each
+    batch only fills in the batch's name, time windows and Cassandra address."""
+
+    def __init__(self, worker_image, worker_tag):
+        # Configuring Kubernetes client
+        config.load_incluster_config()
+
+        self.api_batch = client.BatchV1Api()
+
+        self.namespace = (
+            open("/var/run/secrets/kubernetes.io/serviceaccount/namespace")
+            .read()
+            .strip()
+        )
 
-    ttl_seconds = int(os.environ.get("WORKER_TTL_SECONDS_AFTER_FINISHED"))
+        service_account_name = os.environ.get(
+            "WORKER_SERVICE_ACCOUNT_NAME", "delegation-verify"
+        )
 
-    # List to keep track of job names
-    jobs = []
-    cassandra_ip = try_get_hostname_ip(Config.CASSANDRA_HOST, logging)
-    if Config.no_checks():
-        logging.info("stateless-verifier will run with --no-checks flag")
-    for index, mini_batch in enumerate(time_intervals):
+        worker_cpu_request = os.environ.get("WORKER_CPU_REQUEST")
+        worker_memory_request = os.environ.get("WORKER_MEMORY_REQUEST")
+        worker_cpu_limit = os.environ.get("WORKER_CPU_LIMIT")
+        worker_memory_limit = os.environ.get("WORKER_MEMORY_LIMIT")
 
-        # Job name
-        job_group_name = (
-            f"delegation-verify-{datetime.now(timezone.utc).strftime('%y-%m-%d-%H-%M')}"
-        )
-        job_name = f"{job_group_name}-{index}"
+        self.ttl_seconds = int(os.environ.get("WORKER_TTL_SECONDS_AFTER_FINISHED"))
 
-        # Define the environment variables
+        # Define the environment variables shared by every batch
         env_vars = [
-            client.V1EnvVar(
-                name="AWS_ROLE_SESSION_NAME",
-                value=job_name,
-            ),
             client.V1EnvVar(
                 name="AWS_REGION",
                 value=Config.AWS_REGION,
@@ -101,10 +203,6 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
                 name="AWS_KEYSPACE",
                 value=Config.AWS_KEYSPACE,
             ),
-            client.V1EnvVar(
-                name="CASSANDRA_HOST",
-                value=cassandra_ip,
-            ),
             client.V1EnvVar(
                 name="CASSANDRA_PORT",
                 value=Config.CASSANDRA_PORT,
@@ -129,14 +227,6 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
                 name="NETWORK_NAME",
                 value=Config.NETWORK_NAME,
             ),
-            client.V1EnvVar(
-                name="START_TIMESTAMP",
-                value=datetime_formatter(mini_batch[0]),
-            ),
-            client.V1EnvVar(
-                name="END_TIMESTAMP",
-                value=datetime_formatter(mini_batch[1]),
-            ),
             client.V1EnvVar(
                 name="NO_CHECKS",
                 value=Config.NO_CHECKS,
@@ -180,7 +270,9 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
         ]
 
         # Entrypoint configmap name
-        entrypoint_configmap_name = os.environ.get("WORKER_CONFIGMAP_NAME", "delegation-verify-coordinator-worker")
+        entrypoint_configmap_name = os.environ.get(
+            "WORKER_CONFIGMAP_NAME", "delegation-verify-coordinator-worker"
+        )
 
         # Define the volumes
         auth_volume = client.V1Volume(
@@ -216,9 +308,9 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
         container = client.V1Container(
             name="delegation-verify",
             image=f"{worker_image}:{worker_tag}",
-            command=[
-                "/bin/entrypoint/entrypoint-worker.sh"
-            ],  # The entrypoint script is in the cluster as a configmap. The script can be found in the helm chart of coordinator
+            # The entrypoint script is in the cluster as a configmap. The script can be
+            # found in the helm chart of coordinator. It is run for the pod's time window.
+            command=["/bin/sh", "-c", WORKER_WINDOW_SCRIPT],
             resources=resource_requirements_container,
             env=env_vars,
             image_pull_policy=os.environ.get("IMAGE_PULL_POLICY", "IfNotPresent"),
@@ -241,92 +333,191 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
 
         nodepool = os.environ.get("K8S_NODE_POOL")
         node_selector = {"karpenter.sh/nodepool": nodepool} if nodepool else None
-        tolerations = [{"key": "karpenter.sh/nodepool", "operator": "Exists"}] if nodepool else None
-
-        pod_annotations = {"karpenter.sh/do-not-disrupt": "true"}
-        pod_labels = {"job-group-name": job_group_name}
-
-        # Create the job
-        job = client.V1Job(
-            api_version="batch/v1",
-            kind="Job",
-            metadata=client.V1ObjectMeta(name=job_name),
-            spec=client.V1JobSpec(
-                ttl_seconds_after_finished=ttl_seconds,
-                template=client.V1PodTemplateSpec(
-                    metadata=client.V1ObjectMeta(
-                        annotations=pod_annotations, labels=pod_labels
-                    ),
-                    spec=client.V1PodSpec(
-                        node_selector=node_selector,
-                        tolerations=tolerations,
-                        topology_spread_constraints=[
-                            client.V1TopologySpreadConstraint(
-                                max_skew=int(os.environ.get("SPREAD_MAX_SKEW", "1")),
-                                topology_key="kubernetes.io/hostname",
-                                when_unsatisfiable="DoNotSchedule",
-                                label_selector=client.V1LabelSelector(
-                                    match_labels=pod_labels
-                                ),
-                            )
-                        ],
-                        init_containers=[init_container],
-                        containers=[container],
-                        restart_policy="Never",
-                        service_account_name=service_account_name,
-                        volumes=[auth_volume, entrypoint_volume],
-                    ),
-                ),
-            ),
+        tolerations = (
+            [{"key": "karpenter.sh/nodepool", "operator": "Exists"}]
+            if nodepool
+            else None
         )
 
-        # Create the job and configmap in Kubernetes
-        try:
-            api_batch.create_namespaced_job(namespace, job)
-            logging.info(
-                f"Job {job_name} created in namespace {namespace}; start: {datetime_formatter(mini_batch[0])}, end: {datetime_formatter(mini_batch[1])}."
-            )
-            jobs.append(job_name)
-        except Exception as e:
-            logging.error(f"Error creating job {job_name}: {e}")
+        self.pod_annotations = {"karpenter.sh/do-not-disrupt": "true"}
+
+        pod_spec = client.V1PodSpec(
+            node_selector=node_selector,
+            tolerations=tolerations,
+            topology_spread_constraints=[
+                client.V1TopologySpreadConstraint(
+                    max_skew=int(os.environ.get("SPREAD_MAX_SKEW", "1")),
+                    topology_key="kubernetes.io/hostname",
+                    when_unsatisfiable="DoNotSchedule",
+                )
+            ],
+            init_containers=[init_container],
+            containers=[container],
+            restart_policy="Never",
+            service_account_name=service_account_name,
+            volumes=[auth_volume, entrypoint_volume],
+        )
+        self.pod_spec = client.ApiClient().sanitize_for_serialization(pod_spec)
+
+    def job(self, job_name, time_intervals, cassandra_ip):
+        """Return the Indexed Job verifying the given time intervals, one
+        completion index per interval."""
+        labels = {"job-group-name": job_name}
+        container = self.pod_spec["containers"][0]
+        batch_env = [
+            {"name": "AWS_ROLE_SESSION_NAME", "value": job_name},
+            {"name": "CASSANDRA_HOST", "value": cassandra_ip},
+            {
+                "name": "MINI_BATCH_STARTS",
+                "value": ",".join(datetime_formatter(start) for start, _ in time_intervals),
+            },
+            {
+                "name": "MINI_BATCH_ENDS",
+                "value": ",".join(datetime_formatter(end) for _, end in time_intervals),
+            },
+        ]
+        pod_spec = {
+            **self.pod_spec,
+            "containers": [{**container, "env": container["env"] + batch_env}],
+            "topologySpreadConstraints": [
+                {**constraint, "labelSelector": {"matchLabels": labels}}
+                for constraint in self.pod_spec["topologySpreadConstraints"]
+            ],
+        }
+        return {
+            "apiVersion": "batch/v1",
+            "kind": "Job",
+            "metadata": {"name": job_name, "labels": labels},
+            "spec": {
+                "completionMode": "Indexed",
+                "completions": len(time_intervals),
+                "parallelism": len(time_intervals),
+                # every mini-batch is attempted at most Config.RETRY_COUNT times
+                "backoffLimitPerIndex": max(Config.RETRY_COUNT - 1, 0),
+                "ttlSecondsAfterFinished": self.ttl_seconds,
+                "template": {
+                    "metadata": {"annotations": self.pod_annotations, "labels": labels},
+                    "spec": pod_spec,
+                },
+            },
+        }
+
+
+@lru_cache(maxsize=1)
+def validator_job_template(worker_image, worker_tag):
+    "Prepare the template of the validator jobs once for the whole run."
+    return ValidatorJobTemplate(worker_image, worker_tag)
+
+
+def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
+    template = validator_job_template(worker_image, worker_tag)
+
+    cassandra_ip = try_get_hostname_ip(Config.CASSANDRA_HOST, logging)
+    if Config.no_checks():
+        logging.info("stateless-verifier will run with --no-checks flag")
+
+    # One Indexed Job per batch, its pods are watched through its name; unique,
+    # as a batch may be retried within the same minute
+    job_name = (
+        f"delegation-verify-{datetime.now(timezone.utc).strftime('%y-%m-%d-%H-%M-%S-%f')}"
+    )
+    job = template.job(job_name, time_intervals, cassandra_ip)
+
+    # Create the job in Kubernetes; the batch is not verified without it
+    try:
+        template.api_batch.create_namespaced_job(template.namespace, job)
+    except Exception as e:
+        logging.error(f"Error creating job {job_name}: {e}")
+        raise
+    for index, mini_batch in enumerate(time_intervals):
+        logging.info(
+            f"Job {job_name} index {index} created in namespace {template.namespace}; start: {datetime_formatter(mini_batch[0])}, end: {datetime_formatter(mini_batch[1])}."
+        )
 
     # Monitor jobs
-    while jobs:
-        for job_name in list(jobs):
-            try:
-                job_status = api_batch.read_namespaced_job_status(job_name, namespace)
-                if job_status.status.succeeded:
-                    logging.info(f"Job {job_name} succeeded.")
-                    jobs.remove(job_name)
-                elif job_status.status.failed is not None:
-                    if job_status.status.failed < Config.RETRY_COUNT:
-                        logging.warning(
-                            f"Job {job_name} failed. Retrying attempt {job_status.status.failed}/{Config.RETRY_COUNT}..."
-                        )
-                    else:
-                        logging.error(
-                            f"Job {job_name} failed. Maximum retries ({Config.RETRY_COUNT}) reached. Exiting the program..."
-                        )
-                        jobs.remove(job_name)
-                        exit(1)
-            except Exception as e:
-                logging.error(f"Error reading job status for {job_name}: {e}")
-
-        time.sleep(10)
+    wait_for_jobs(
+        template.api_batch, template.namespace, [job_name], job_name, logging
+    )
 
     logging.info("All jobs have been processed.")
 
 
+def stream_output(pipe, log, process_name, stream_name):
+    "Log the lines written by a process to one of its pipes as they arrive."
+    with pipe:
+        for line in pipe:
+            log(f"{process_name} ({stream_name}): {line.rstrip()}")
+
+
+def run_process(process_name, command, env, logging):
+    """Run a process, streaming its output to the log, and wait for it to
+    exit. Return its exit code and wall time in seconds."""
+    started = time.monotonic()
+    proc = subprocess.Popen(
+        command,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        # a line which is not valid UTF-8 must not stop draining a pipe
+        errors="replace",
+        bufsize=1,
+    )
+    # both pipes are drained while the process runs, so it never blocks on a full one
+    stderr_thread = threading.Thread(
+        target=stream_output,
+        args=(proc.stderr, logging.error, process_name, "stderr"),
+        daemon=True,
+    )
+    stderr_thread.start()
+    stream_output(proc.stdout, logging.info, process_name, "stdout")
+    returncode = proc.wait()
+    stderr_thread.join()
+    return returncode, time.monotonic() - started
+
+
+def run_processes(processes, logging, max_workers=None):
+    """Run (process_name, command, env) processes, at most max_workers of
+    them (by default one per CPU) at a time. Return the exit code and wall
+    time of every process, by name."""
+    max_workers = max_workers or os.cpu_count()
+    results = {}
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="local-validator"
+    ) as executor:
+        futures = {
+            executor.submit(run_process, process_name, command, env, logging): process_name
+            for process_name, command, env in processes
+        }
+        for future in as_completed(futures):
+            process_name = futures[future]
+            try:
+                returncode, wall_time = future.result()
+            except OSError as e:
+                logging.error(f"Process {process_name} could not be started: {e}")
+                continue
+            results[process_name] = (returncode, wall_time)
+            if returncode == 0:
+                logging.info(
+                    f"Process {process_name} completed at {datetime.now()} in {wall_time:.1f}s."
+                )
+            else:
+                logging.error(
+                    f"Process {process_name} exited with code {returncode} in {wall_time:.1f}s."
+                )
+    return results
+
+
 def setUpValidatorProcesses(time_intervals, logging, worker_image, worker_tag):
     processes = []
     if Config.no_checks():
         logging.info("stateless-verifier will run with --no-checks flag")
+    image = f"{worker_image}:{worker_tag}"
+    cassandra_ip = try_get_hostname_ip(os.environ.get("CASSANDRA_HOST"), logging)
     for index, mini_batch in enumerate(time_intervals):
         process_name = (
             f"local-validator-{datetime.now().strftime('%y-%m-%d-%H-%M')}-{index}"
         )
-        image = f"{worker_image}:{worker_tag}"
-        cassandra_ip = try_get_hostname_ip(os.environ.get("CASSANDRA_HOST"), logging)
         command = [
             "docker",
             "run",
@@ -388,31 +579,16 @@ def setUpValidatorProcesses(time_intervals, logging, worker_image, worker_tag):
         env["BatchStart"] = str(mini_batch[0])
         env["BatchEnd"] = str(mini_batch[1])
 
-        # Spawn the process
-        proc = subprocess.Popen(
-            command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        processes.append((process_name, proc))
+        processes.append((process_name, command, env))
         logging.info(f"Launching process {index}: {cmd_str}")
 
-    # Monitor the processes
-    while processes:
-        for process_name, proc in processes:
-            if proc.poll() is not None:  # Check if the process has completed
-                # Handle process stdout and stderr and remove it
-                output, errors = proc.communicate()
-                logging.info(f"Process {process_name} completed at {datetime.now()}")
-                if output:
-                    logging.info(f"{process_name} (stdout): {output.decode().strip()}")
-                if errors:
-                    logging.error(f"{process_name} (stderr): {errors.decode().strip()}")
-
-                processes.remove((process_name, proc))
-
-        time.sleep(1)
-
-        if not processes:
-            break
+    # Run the processes, as many at a time as there are CPUs unless configured otherwise
+    results = run_processes(processes, logging, Config.LOCAL_VALIDATOR_CONCURRENCY)
+    if results:
+        wall_times = [wall_time for _, wall_time in results.values()]
+        logging.info(
+            f"{len(results)} processes completed; wall time per process: max {max(wall_times):.1f}s, total {sum(wall_times):.1f}s."
+        )
 
 
 # Usage Example
@@ -0,0 +1,156 @@
+"""Executors running the stateless verifier on the mini-batches of a batch.
+The executor is chosen with VALIDATOR_EXECUTOR:
+
+ - KUBERNETES: one Indexed Job per batch (the default),
+ - DOCKER: one local container per mini-batch (the default with TEST_ENV),
+ - SUBPROCESS: one local process per mini-batch, running VALIDATOR_COMMAND,
+ - QUEUE: the validator worker pool (the default with WORKER_POOL),
+ - FAKE: an in-process stand-in for the verifier, which marks submissions in
+   PostgreSQL as verified with a synthetic chain of blocks, so that the whole
+   coordinator loop can be load-tested without a cluster nor the verifier."""
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import lru_cache
+import logging
+
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.server import (
+    run_processes,
+    setUpValidatorPods,
+    setUpValidatorProcesses,
+)
+from uptime_service_validation.coordinator.validator_pool import (
+    connect,
+    setUpValidatorQueue,
+    verification_command,
+)
+
+
+class ValidatorExecutor(ABC):
+    "Runs the stateless verifier on mini-batches and waits until it is done."
+
+    @abstractmethod
+    def run(self, time_intervals):
+        "Verify the submissions of the given (start, end) time intervals."
+
+
+class KubernetesExecutor(ValidatorExecutor):
+    def run(self, time_intervals):
+        setUpValidatorPods(
+            time_intervals, logging, Config.WORKER_IMAGE, Config.WORKER_TAG
+        )
+
+
+class DockerExecutor(ValidatorExecutor):
+    def run(self, time_intervals):
+        logging.info("running in test environment")
+        setUpValidatorProcesses(
+            time_intervals, logging, Config.WORKER_IMAGE, Config.WORKER_TAG
+        )
+
+
+class SubprocessExecutor(ValidatorExecutor):
+    "Runs VALIDATOR_COMMAND for every mini-batch, without a container."
+
+    def run(self, time_intervals):
+        processes = []
+        for index, (start, end) in enumerate(time_intervals):
+            command, env = verification_command(start, end, Config.VALIDATOR_COMMAND)
+            process_name = (
+                f"local-validator-{datetime.now().strftime('%y-%m-%d-%H-%M')}-{index}"
+            )
+            processes.append((process_name, command, env))
+        run_processes(processes, logging, Config.LOCAL_VALIDATOR_CONCURRENCY)
+
+
+class QueueExecutor(ValidatorExecutor):
+    def run(self, time_intervals):
+        setUpValidatorQueue(
+            time_intervals, logging, Config.WORKER_IMAGE, Config.WORKER_TAG
+        )
+
+
+class FakeExecutor(ValidatorExecutor):
+    """Stands in for the verifier: every submission of the mini-batches is
+    marked as verified, with the block of its slot as state hash. Blocks are
+    chained slot after slot, and a fork_rate fraction of the block producers
+    report a fork block of the same height instead. Only PostgreSQL
+    submission storage is supported."""
+
+    # Mina slots last 3 minutes
+    SLOT_SECONDS = 180
+
+    def __init__(self, fork_rate=None, connection_factory=connect):
+        self.fork_rate = Config.FAKE_FORK_RATE if fork_rate is None else fork_rate
+        self.connection_factory = connection_factory
+
+    def run(self, time_intervals):
+        connection = self.connection_factory()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TIME ZONE 'UTC'")
+                for start, end in time_intervals:
+                    self.verify(cursor, start, end)
+        finally:
+            connection.close()
+
+    def verify(self, cursor, start, end):
+        "Mark the submissions of a time window as verified."
+        cursor.execute(
+            """UPDATE submissions s
+               SET verified = true, validation_error = NULL,
+                   slot = b.slot, height = b.slot,
+                   state_hash = %(prefix)s || b.slot || b.fork,
+                   parent = %(prefix)s || (b.slot - 1)
+               FROM (
+                 SELECT id,
+                   floor(extract(epoch FROM submitted_at) / %(slot_seconds)s)::int AS slot,
+                   CASE WHEN ('x' || substr(md5(submitter), 1, 8))::bit(32)::bigint
+                             < %(fork_threshold)s
+                        THEN '-fork' ELSE '' END AS fork
+                 FROM submissions
+                 WHERE submitted_at >= %(start)s AND submitted_at < %(end)s
+               ) b
+               WHERE s.id = b.id""",
+            {
+                "prefix": "fake-",
+                "slot_seconds": self.SLOT_SECONDS,
+                "fork_threshold": int(self.fork_rate * 2**32),
+                "start": start,
+                "end": end,
+            },
+        )
+        logging.info(
+            "fake verifier: %s submissions verified between %s and %s",
+            cursor.rowcount,
+            start,
+            end,
+        )
+
+
+EXECUTORS = {
+    Config.EXECUTOR_KUBERNETES: KubernetesExecutor,
+    Config.EXECUTOR_DOCKER: DockerExecutor,
+    Config.EXECUTOR_SUBPROCESS: SubprocessExecutor,
+    Config.EXECUTOR_QUEUE: QueueExecutor,
+    Config.EXECUTOR_FAKE: FakeExecutor,
+}
+
+
+def executor_name():
+    """The configured executor, or the one implied by WORKER_POOL and
+    TEST_ENV when VALIDATOR_EXECUTOR is not set."""
+    if Config.VALIDATOR_EXECUTOR:
+        return Config.VALIDATOR_EXECUTOR
+    if Config.worker_pool():
+        return Config.EXECUTOR_QUEUE
+    if Config.is_test_environment():
+        return Config.EXECUTOR_DOCKER
+    return Config.EXECUTOR_KUBERNETES
+
+
+@lru_cache(maxsize=1)
+def validator_executor():
+    "Create the configured executor once for the whole run."
+    return EXECUTORS[executor_name()]()
@@ -0,0 +1,270 @@
+"""A pool of long-lived validator workers fed through a queue table in
+PostgreSQL. Instead of starting a pod or a container per mini-batch, the
+coordinator enqueues the time windows of a batch and waits until they are
+verified; warm workers claim windows with FOR UPDATE SKIP LOCKED, run the
+stateless verifier on them and report the outcome.
+
+Workers are started with `invoke worker-pool` (or by running this module),
+which spawns WORKER_POOL_SIZE processes."""
+
+from datetime import datetime, timezone
+import logging
+import multiprocessing
+import os
+import select
+import shlex
+import socket
+import subprocess
+import sys
+
+from dotenv import load_dotenv
+import psycopg2
+
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.postgres_pool import connection_options
+from uptime_service_validation.coordinator.server import datetime_formatter
+
+# Channels notified when windows are enqueued and when they are done
+ENQUEUED_CHANNEL = "validation_queue_enqueued"
+DONE_CHANNEL = "validation_queue_done"
+
+
+def connect():
+    "Open an autocommit connection for the queue operations."
+    connection = psycopg2.connect(
+        host=Config.POSTGRES_HOST,
+        port=Config.POSTGRES_PORT,
+        database=Config.POSTGRES_DB,
+        user=Config.POSTGRES_USER,
+        password=Config.POSTGRES_PASSWORD,
+        **connection_options(),
+    )
+    connection.autocommit = True
+    return connection
+
+
+class ValidationQueue:
+    """The validation_queue table: time windows of mini-batches waiting to be
+    verified, being verified, or done. Windows are grouped by the batch
+    (job group) they belong to."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def enqueue(self, job_group, time_intervals):
+        "Add the windows of a batch to the queue and wake up idle workers."
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                """INSERT INTO validation_queue (job_group, window_start, window_end)
+                   VALUES (%s, %s, %s)""",
+                [(job_group, start, end) for start, end in time_intervals],
+            )
+            cursor.execute("SELECT pg_notify(%s, %s)", (ENQUEUED_CHANNEL, job_group))
+
+    def claim(self, worker):
+        """Take the oldest pending window, skipping the ones other workers are
+        claiming. Return (id, window_start, window_end) or None."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """UPDATE validation_queue
+                   SET status = 'running', worker = %s, attempts = attempts + 1,
+                       claimed_at = now()
+                   WHERE id = (
+                     SELECT id FROM validation_queue
+                     WHERE status = 'pending'
+                     ORDER BY id
+                     FOR UPDATE SKIP LOCKED
+                     LIMIT 1)
+                   RETURNING id, window_start, window_end""",
+                (worker,),
+            )
+            return cursor.fetchone()
+
+    def complete(self, item_id, worker):
+        """Mark a window as verified. Return False if the claim of the worker
+        expired meanwhile, in which case the window is left as it is."""
+        return self._finish(
+            """UPDATE validation_queue
+               SET status = 'done', error = NULL, finished_at = now()
+               WHERE id = %s AND status = 'running' AND worker = %s
+               RETURNING job_group""",
+            (item_id, worker),
+        )
+
+    def fail(self, item_id, worker, error, max_attempts=Config.RETRY_COUNT):
+        """Put a window back in the queue after a failed verification, unless
+        it was attempted max_attempts times already. Return False if the claim
+        of the worker expired meanwhile, in which case the window is left as
+        it is."""
+        return self._finish(
+            """UPDATE validation_queue
+               SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                   error = %s, finished_at = now()
+               WHERE id = %s AND status = 'running' AND worker = %s
+               RETURNING job_group""",
+            (max_attempts, error, item_id, worker),
+        )
+
+    def release_expired(self, lease_seconds):
+        """Put back the windows claimed longer than lease_seconds ago, e.g. by
+        workers which died. Return their number."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """UPDATE validation_queue SET status = 'pending', worker = NULL
+                   WHERE status = 'running'
+                   AND claimed_at < now() - make_interval(secs => %s)""",
+                (lease_seconds,),
+            )
+            released = cursor.rowcount
+            if released:
+                cursor.execute("SELECT pg_notify(%s, '')", (ENQUEUED_CHANNEL,))
+            return released
+
+    def progress(self, job_group):
+        "Count the windows of a batch per status."
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """SELECT status, count(*) FROM validation_queue
+                   WHERE job_group = %s GROUP BY status""",
+                (job_group,),
+            )
+            return dict(cursor.fetchall())
+
+    def cancel(self, job_group):
+        "Drop the windows of a batch which are still waiting for a worker."
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """UPDATE validation_queue
+                   SET status = 'failed', error = 'cancelled', finished_at = now()
+                   WHERE job_group = %s AND status = 'pending'""",
+                (job_group,),
+            )
+
+    def listen(self, channel):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {channel}")
+
+    def wait(self, timeout):
+        """Wait until a notification arrives on a channel listened to, or for
+        timeout seconds at most."""
+        if not self.connection.notifies:
+            select.select([self.connection], [], [], timeout)
+            self.connection.poll()
+        self.connection.notifies.clear()
+
+    def _finish(self, query, parameters):
+        with self.connection.cursor() as cursor:
+            cursor.execute(query, parameters)
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            cursor.execute("SELECT pg_notify(%s, %s)", (DONE_CHANNEL, row[0]))
+            return True
+
+
+def setUpValidatorQueue(time_intervals, logging, worker_image, worker_tag):
+    """Enqueue the mini-batches for the worker pool and wait until they are
+    all verified. Exit the program if one of them failed too many times."""
+    # unique, as a batch may be retried within the same minute
+    job_group = (
+        f"delegation-verify-{datetime.now(timezone.utc).strftime('%y-%m-%d-%H-%M-%S-%f')}"
+    )
+    connection = connect()
+    try:
+        queue = ValidationQueue(connection)
+        queue.listen(DONE_CHANNEL)
+        queue.enqueue(job_group, time_intervals)
+        logging.info(
+            f"{len(time_intervals)} mini-batches of {job_group} enqueued for the worker pool."
+        )
+        while True:
+            progress = queue.progress(job_group)
+            if progress.get("failed"):
+                logging.error(
+                    f"Verification of {job_group} failed. Maximum retries ({Config.RETRY_COUNT}) reached. Exiting the program..."
+                )
+                queue.cancel(job_group)
+                exit(1)
+            if progress.get("done", 0) == len(time_intervals):
+                break
+            released = queue.release_expired(Config.WORKER_POOL_LEASE_SECONDS)
+            if released:
+                logging.warning(f"{released} expired claims released to the queue.")
+            queue.wait(Config.WORKER_POOL_POLL_SECONDS)
+    finally:
+        connection.close()
+    logging.info("All jobs have been processed.")
+
+
+def verification_command(start, end, template=None):
+    """Return the command verifying a window and its environment. The command
+    template (by default WORKER_POOL_COMMAND) may refer to {start} and {end};
+    the window is also given in START_TIMESTAMP and END_TIMESTAMP, as in
+    worker pods."""
+    start, end = datetime_formatter(start), datetime_formatter(end)
+    command = [
+        part.format(start=start, end=end)
+        for part in shlex.split(template or Config.WORKER_POOL_COMMAND)
+    ]
+    env = os.environ.copy()
+    env["START_TIMESTAMP"] = start
+    env["END_TIMESTAMP"] = end
+    return command, env
+
+
+def run_worker(worker):
+    "Verify windows claimed from the queue until the process is terminated."
+    queue = ValidationQueue(connect())
+    queue.listen(ENQUEUED_CHANNEL)
+    logging.info("worker %s started", worker)
+    while True:
+        item = queue.claim(worker)
+        if item is None:
+            queue.wait(Config.WORKER_POOL_POLL_SECONDS)
+            continue
+        item_id, start, end = item
+        command, env = verification_command(start, end)
+        logging.info("worker %s verifying %s - %s", worker, start, end)
+        try:
+            returncode = subprocess.run(command, env=env).returncode
+        except OSError as e:
+            logging.error("worker %s could not run %s: %s", worker, command, e)
+            returncode = None
+        if returncode == 0:
+            finished = queue.complete(item_id, worker)
+        else:
+            logging.warning("worker %s failed on %s - %s", worker, start, end)
+            finished = queue.fail(item_id, worker, f"exit code {returncode}")
+        if not finished:
+            logging.warning(
+                "worker %s lost its claim on %s - %s, which expired", worker, start, end
+            )
+
+
+def main(workers=None):
+    "Start the workers of the pool and run them until interrupted."
+    load_dotenv()
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    workers = workers or Config.WORKER_POOL_SIZE or os.cpu_count()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker, args=(f"{socket.gethostname()}-{index}",), daemon=True
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logging.info("%s validator workers started", workers)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logging.info("stopping the validator workers")
+
+
+if __name__ == "__main__":
+    main()
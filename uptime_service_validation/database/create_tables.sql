@@ -6,6 +6,8 @@ CREATE TABLE IF NOT EXISTS bot_logs (
 	batch_start_epoch BIGINT, 
 	batch_end_epoch BIGINT
 );
+CREATE INDEX IF NOT EXISTS idx_bot_logs_batch_start_epoch ON bot_logs (batch_start_epoch);
+CREATE INDEX IF NOT EXISTS idx_bot_logs_batch_end_epoch ON bot_logs (batch_end_epoch);
 
 CREATE TABLE IF NOT EXISTS statehash (
 	id SERIAL PRIMARY KEY,
@@ -40,6 +42,7 @@ CREATE TABLE IF NOT EXISTS nodes (
 	email_id TEXT,
 	application_status BOOLEAN
 );
+CREATE UNIQUE INDEX IF NOT EXISTS uq_nodes_block_producer_key ON nodes USING btree (block_producer_key);
 
 -- The points table stores the points of each node for each validated submission.
 CREATE TABLE IF NOT EXISTS points (
@@ -122,6 +125,47 @@ CREATE TABLE IF NOT EXISTS points_summary (
 -- for the same bot_log and node combination.
 CREATE UNIQUE INDEX IF NOT EXISTS uq_ps_bot_log_node ON points_summary USING btree (bot_log_id, node_id);
 
+-- Tables maintaining the scoring window incrementally (SCOREBOARD_MODE=INCREMENTAL).
+-- score_window holds a single row with the bounds of the window the counters
+-- correspond to and the number of surveys (batches) within it.
+-- node_window_points holds the number of points_summary entries of each node within the window.
+-- Every update counts batches which entered the window and discounts the ones which left it.
+CREATE TABLE IF NOT EXISTS score_window (
+	id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+	start_epoch NUMERIC NOT NULL,
+	end_epoch NUMERIC NOT NULL,
+	surveys INT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS node_window_points (
+	node_id INT PRIMARY KEY,
+	points INT NOT NULL,
+	CONSTRAINT fk_nodes
+		FOREIGN KEY(node_id) 
+		REFERENCES nodes(id)
+);
+
+-- Work queue of the validator worker pool (WORKER_POOL=1).
+-- The coordinator enqueues the time windows of the mini-batches of a batch (job_group),
+-- workers claim pending windows with FOR UPDATE SKIP LOCKED and mark them done,
+-- or put them back as pending after a failed attempt until they are failed for good.
+CREATE TABLE IF NOT EXISTS validation_queue (
+	id SERIAL PRIMARY KEY,
+	job_group TEXT NOT NULL,
+	window_start TIMESTAMPTZ(6) NOT NULL,
+	window_end TIMESTAMPTZ(6) NOT NULL,
+	status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+	attempts INT NOT NULL DEFAULT 0,
+	worker TEXT,
+	error TEXT,
+	created_at TIMESTAMPTZ(6) NOT NULL DEFAULT now(),
+	claimed_at TIMESTAMPTZ(6),
+	finished_at TIMESTAMPTZ(6)
+);
+
+CREATE INDEX IF NOT EXISTS idx_validation_queue_pending ON validation_queue (id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_validation_queue_job_group ON validation_queue (job_group);
+
 -- Trigger function definition for updating the points_summary
 -- This function, fn_update_point_summary, is a trigger function that responds to insert operations.
 -- When a new point is inserted, this function attempts to insert a corresponding entry into
@@ -232,4 +276,59 @@ END;
 $$ LANGUAGE plpgsql;
 
 -- Example call to the function with 100 days
--- SELECT cleanup_old_data(100);
\ No newline at end of file
+-- SELECT cleanup_old_data(100);
+
+-- Function to downsample old score history
+-- Scores only change between batches, so score_history describes a step function per node.
+-- For entries older than days_ago it keeps only the last entry of each node within every
+-- bucket ('hour', 'day', ... as accepted by date_trunc), i.e. the score at the end of the bucket.
+-- The step function can still be reconstructed with score_history_steps below.
+CREATE OR REPLACE FUNCTION downsample_score_history(days_ago INTEGER, bucket TEXT DEFAULT 'hour')
+RETURNS void AS $$
+DECLARE
+  threshold TIMESTAMP;
+  score_history_deleted INT;
+BEGIN
+  -- Align the threshold with the bucket so that no bucket is downsampled partially
+  SELECT date_trunc(bucket, (NOW() AT TIME ZONE 'UTC') - INTERVAL '1 day' * days_ago) INTO threshold;
+  RAISE NOTICE 'Downsampling score history older than % to one entry per %', threshold, bucket;
+
+  WITH ranked AS (
+    SELECT id, row_number() OVER (
+      PARTITION BY node_id, date_trunc(bucket, score_at) ORDER BY score_at DESC
+    ) AS position
+    FROM score_history
+    WHERE score_at < threshold
+  ), del AS (
+    DELETE FROM score_history h
+    USING ranked r
+    WHERE h.id = r.id AND r.position > 1
+    RETURNING 1
+  )
+  SELECT COUNT(*) INTO score_history_deleted FROM del;
+  RAISE NOTICE 'Deleted % rows from score_history', score_history_deleted;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Example call to the function keeping daily scores for history older than 30 days
+-- SELECT downsample_score_history(30, 'day');
+
+-- Function reconstructing the score of every node at regular points in time
+-- from score_history, which may be sparse (SCORE_HISTORY_MODE=CHANGES) or downsampled.
+-- The score at a given time is the one of the latest entry at or before that time.
+CREATE OR REPLACE FUNCTION score_history_steps(from_ts TIMESTAMP, to_ts TIMESTAMP, step INTERVAL)
+RETURNS TABLE (node_id INT, score_at TIMESTAMP, score INT, score_percent NUMERIC(5,2)) AS $$
+  SELECT n.id, t.ts, h.score, h.score_percent
+  FROM generate_series(from_ts, to_ts, step) AS t(ts)
+  CROSS JOIN nodes n
+  CROSS JOIN LATERAL (
+    SELECT sh.score, sh.score_percent
+    FROM score_history sh
+    WHERE sh.node_id = n.id AND sh.score_at <= t.ts
+    ORDER BY sh.score_at DESC
+    LIMIT 1
+  ) h
+$$ LANGUAGE sql STABLE;
+
+-- Example call to the function listing daily scores over the first week of June 2024
+-- SELECT * FROM score_history_steps('2024-06-01', '2024-06-07', '1 day');
\ No newline at end of file